@@ -3,7 +3,7 @@ import os
 import logging
 import json
 import socket
-from flask import Flask, redirect, url_for, request, flash, abort, jsonify
+from flask import Flask, redirect, url_for, request, flash, abort, jsonify, has_request_context, g, current_app
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, current_user
 from flask_admin import Admin
@@ -48,8 +48,34 @@ celery = Celery(
     backend=os.environ.get("CELERY_RESULT_BACKEND"),
 )
 
+# Бэкенды Flask-Caching, которые хранят данные в памяти одного процесса
+PROCESS_LOCAL_CACHE_TYPES = {"simplecache", "simple", "nullcache", "null"}
+
+
+def cache_is_shared():
+    """
+    Видят ли все процессы (веб и воркеры Celery) один и тот же кэш. На
+    нем держатся версии каталога и дерева категорий и журнал изменений
+    снимков: записанное в SimpleCache одного процесса остальные не увидят.
+    CACHE_SHARED переопределяет вывод по CACHE_TYPE.
+    """
+    shared = current_app.config.get("CACHE_SHARED")
+    if shared is not None:
+        return shared
+    cache_type = current_app.config.get("CACHE_TYPE") or "null"
+    return cache_type.rsplit(".", 1)[-1].lower() not in PROCESS_LOCAL_CACHE_TYPES
+
+
+# Сколько секунд кэшируется число записей в списках админки
+ADMIN_COUNT_CACHE_TIMEOUT = 300
+# С какого размера таблицы (по статистике MySQL) вместо COUNT(*) берется оценка
+APPROXIMATE_COUNT_MIN_ROWS = 1000000
+
 
 class SecureModelView(ModelView):
+    # Связи, загружаемые вместе со страницей списка (joinedload/selectinload)
+    list_loader_options = ()
+
     def is_accessible(self):
         return current_user.is_authenticated and current_user.is_admin
 
@@ -58,6 +84,70 @@ class SecureModelView(ModelView):
             return redirect(url_for("auth.login", next=request.url))
         abort(403)
 
+    def get_query(self):
+        return super().get_query().options(*self.list_loader_options)
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, *args, **kwargs):
+        # Без поиска и фильтров число записей для пагинации берется из кэша
+        g.admin_list_unfiltered = not search and not filters
+        try:
+            return super().get_list(page, sort_column, sort_desc, search, filters, *args, **kwargs)
+        finally:
+            g.pop("admin_list_unfiltered", None)
+
+    def get_count_query(self):
+        if g.get("admin_list_unfiltered"):
+            return self.session.query(db.literal(self.cached_count()))
+        return super().get_count_query()
+
+    def _count_cache_key(self):
+        return f"admin_count_{self.model.__tablename__}"
+
+    def cached_count(self):
+        """
+        Число записей таблицы: из кэша на ADMIN_COUNT_CACHE_TIMEOUT секунд,
+        для больших таблиц MySQL — оценка из information_schema без COUNT(*).
+        """
+        key = self._count_cache_key()
+        try:
+            count = cache.get(key)
+        except:
+            count = None
+        if count is None:
+            count = self._estimated_count()
+            if count is None:
+                count = super().get_count_query().scalar()
+            try:
+                cache.set(key, count, timeout=ADMIN_COUNT_CACHE_TIMEOUT)
+            except:
+                pass  # Игнорируем ошибку кэша
+        return count
+
+    def _estimated_count(self):
+        if self.session.get_bind().dialect.name != "mysql":
+            return None
+        estimate = self.session.execute(
+            db.text(
+                "SELECT TABLE_ROWS FROM information_schema.TABLES "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table"
+            ),
+            {"table": self.model.__tablename__},
+        ).scalar()
+        return estimate if estimate and estimate >= APPROXIMATE_COUNT_MIN_ROWS else None
+
+    def after_model_change(self, form, model, is_created):
+        if is_created:
+            self._forget_count()
+
+    def after_model_delete(self, model):
+        self._forget_count()
+
+    def _forget_count(self):
+        try:
+            cache.delete(self._count_cache_key())
+        except:
+            pass  # Игнорируем ошибку кэша
+
 
 def create_app(config_name="default"):
     app = Flask(__name__)
@@ -87,6 +177,18 @@ def create_app(config_name="default"):
 
     app.jinja_env.filters['pluralize'] = pluralize
 
+    # Счетчики корзины и избранного для шапки (из кэша, без COUNT на каждую страницу)
+    @app.context_processor
+    def inject_header_counters():
+        from .services.counter_service import CounterService
+        from .services.cart_service import CartService
+
+        if not has_request_context():
+            return {}
+        if current_user.is_authenticated:
+            return {"header_counters": CounterService.get(current_user.id)}
+        return {"header_counters": {"cart": CartService.guest_positions(), "wishlist": 0}}
+
     # Health check endpoint
     @app.route("/health")
     def health_check():
@@ -266,23 +368,32 @@ def create_app(config_name="default"):
         PromoCode,
         Review,
     )
+    from sqlalchemy.orm import configure_mappers, joinedload
+
+    # Обратные связи (backref) вроде Product.category появляются после настройки мапперов
+    configure_mappers()
+    from .admin_views import CustomAdminIndexView, ImportExportView, SlugRetryMixin
 
-    class ProductAdminView(SecureModelView):
+    class ProductAdminView(SlugRetryMixin, SecureModelView):
         def _image_preview_formatter(view, context, model, name):
-            first_image = (
-                ProductImage.query.filter_by(product_id=model.id)
-                .order_by(ProductImage.sort_order)
-                .first()
-            )
+            from .services.image_service import ImageService
+
+            first_image = model.primary_image
             if first_image:
+                # Самая малая производная вместо оригинала, сжатого CSS до 50px
                 return Markup(
-                    f'<img src="/static/images/{first_image.image_url}" style="width: 50px; height: 50px; object-fit: cover; border-radius: 4px;">'
+                    f'<img src="{ImageService.thumbnail_url(first_image, 100)}" style="width: 50px; height: 50px; object-fit: cover; border-radius: 4px;">'
                 )
             return Markup(
                 '<img src="/static/images/default_product.png" style="width: 50px; height: 50px; object-fit: cover;">'
             )
 
         column_formatters = {"images": _image_preview_formatter}
+        # Главное изображение и категория с родителем — в запросе страницы, а не по запросу на строку
+        list_loader_options = (
+            joinedload(Product.primary_image),
+            joinedload(Product.category).joinedload(Category.parent),
+        )
         column_list = ("id", "name", "slug", "price", "in_stock", "category", "images")
         column_labels = {
             "images": "Фото",
@@ -342,10 +453,23 @@ def create_app(config_name="default"):
             )
         ]
 
-    class CategoryAdminView(SecureModelView):
+    class CategoryAdminView(SlugRetryMixin, SecureModelView):
         form_columns = ["name", "slug", "parent_id", "meta_title", "meta_description"]
 
-    from .admin_views import CustomAdminIndexView, ImportExportView
+    class OrderAdminView(SecureModelView):
+        list_loader_options = (joinedload(Order.customer),)
+
+    class OrderItemAdminView(SecureModelView):
+        list_loader_options = (
+            joinedload(OrderItem.order),
+            joinedload(OrderItem.product),
+        )
+
+    class CartAdminView(SecureModelView):
+        list_loader_options = (joinedload(Cart.user), joinedload(Cart.product))
+
+    class ReviewAdminView(SecureModelView):
+        list_loader_options = (joinedload(Review.author),)
 
     admin = Admin(
         app,
@@ -367,19 +491,19 @@ def create_app(config_name="default"):
         SecureModelView(Brand, db.session, name="Бренды", category="Каталог")
     )
     admin.add_view(
-        SecureModelView(Order, db.session, name="Заказы", category="Магазин")
+        OrderAdminView(Order, db.session, name="Заказы", category="Магазин")
     )
     admin.add_view(
-        SecureModelView(OrderItem, db.session, name="Детали заказа", category="Магазин")
+        OrderItemAdminView(OrderItem, db.session, name="Детали заказа", category="Магазин")
     )
     admin.add_view(
-        SecureModelView(Cart, db.session, name="Корзины", category="Магазин")
+        CartAdminView(Cart, db.session, name="Корзины", category="Магазин")
     )
     admin.add_view(
         SecureModelView(PromoCode, db.session, name="Промокоды", category="Магазин")
     )
     admin.add_view(
-        SecureModelView(Review, db.session, name="Отзывы", category="Каталог")
+        ReviewAdminView(Review, db.session, name="Отзывы", category="Каталог")
     )
     admin.add_view(
         ImportExportView(
@@ -409,7 +533,21 @@ def create_app(config_name="default"):
         csrf.exempt(api_bp)
 
         app.register_blueprint(api_bp, url_prefix="/api")
+        # Слушатель сессии, поддерживающий агрегаты рейтинга товаров
+        from .services import rating_service  # noqa: F401
+        # Слушатель сессии, ведущий пути дерева категорий
+        from .services import category_service  # noqa: F401
+        # Слушатель сессии, поддерживающий дневные итоги продаж
+        from .services import sales_stats_service  # noqa: F401
+        # Слушатель сессии, ставящий в очередь производные изображений
+        from .services.image_service import ImageService
+        from .commands import catalog_cli
+
+        app.cli.add_command(catalog_cli)
         app.jinja_env.globals.update(now=datetime.now)
+        app.jinja_env.globals.update(
+            image_srcset=ImageService.srcset, image_thumbnail=ImageService.thumbnail_url
+        )
         db.create_all()
 
     return app
\ No newline at end of file
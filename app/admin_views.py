@@ -1,12 +1,62 @@
 from flask_admin import AdminIndexView, expose, BaseView
 from flask_login import login_required, current_user
-from app.models import Order, Product, User, OrderItem, db, Category, Brand
-from flask import flash, redirect, url_for, Response, request
-from datetime import datetime, timedelta
-from sqlalchemy import func
-from sqlalchemy.orm import joinedload
-import csv
-import io
+from app.models import Order, Product, db, ImportJob, ExportJob
+from flask import (
+    flash,
+    redirect,
+    url_for,
+    Response,
+    request,
+    jsonify,
+    abort,
+    send_file,
+    stream_with_context,
+    g,
+)
+from datetime import datetime, date, timedelta
+import os
+from app.services.import_service import ImportService
+from app.services.export_service import ExportService, EXPORT_FORMATS
+from app.services.slug_service import SlugService
+from app.services.sales_stats_service import SalesStatsService
+
+# Самый длинный период графиков продаж в панели, дней
+MAX_SALES_RANGE_DAYS = 366
+# Попыток сохранить запись, если выделенный slug успела занять другая запись
+SLUG_RETRY_ATTEMPTS = 3
+
+
+class SlugRetryMixin:
+    """
+    Повторяет сохранение модели со slug при конфликте уникального индекса:
+    slug выделяется при flush, и параллельное сохранение может занять его
+    раньше. Повтор заново заполняет модель из формы и выделяет slug.
+    """
+
+    def handle_view_exception(self, exc):
+        if SlugService.is_conflict(exc) and g.get("slug_attempts_left"):
+            g.slug_conflict = True
+            return True
+        return super().handle_view_exception(exc)
+
+    def _save_with_retry(self, save):
+        g.slug_attempts_left = SLUG_RETRY_ATTEMPTS - 1
+        try:
+            while True:
+                g.slug_conflict = False
+                result = save()
+                if not g.slug_conflict:
+                    return result
+                g.slug_attempts_left -= 1
+        finally:
+            g.pop("slug_attempts_left", None)
+            g.pop("slug_conflict", None)
+
+    def create_model(self, form):
+        return self._save_with_retry(lambda: super(SlugRetryMixin, self).create_model(form))
+
+    def update_model(self, form, model):
+        return self._save_with_retry(lambda: super(SlugRetryMixin, self).update_model(form, model))
 
 
 class CustomAdminIndexView(AdminIndexView):
@@ -16,156 +66,169 @@ class CustomAdminIndexView(AdminIndexView):
         if not current_user.is_authenticated or not current_user.is_admin:
             flash("Доступ запрещен. Требуются права администратора.", "danger")
             return redirect(url_for("login", next=url_for("admin.index")))
-        total_orders = Order.query.count()
+        # Заказы, выручка, продажи и регистрации — из дневных итогов, а не из заказов
+        today = datetime.utcnow().date()
+        month_start = today - timedelta(days=29)
+        totals = SalesStatsService.summary()
+        last_month = SalesStatsService.summary(month_start, today)
         total_products = Product.query.count()
-        total_users = User.query.count()
-        thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-        recent_orders = Order.query.filter(Order.created_at >= thirty_days_ago).count()
-        revenue = (
-            db.session.query(func.sum(Order.final_amount))
-            .filter(Order.created_at >= thirty_days_ago, Order.status == "Paid")
-            .scalar()
-            or 0
-        )
         latest_orders = Order.query.order_by(Order.created_at.desc()).limit(5).all()
-        popular_products = (
-            db.session.query(
-                Product.name, func.sum(OrderItem.quantity).label("total_sold")
-            )
-            .join(OrderItem)
-            .group_by(Product.id)
-            .order_by(func.sum(OrderItem.quantity).desc())
-            .limit(5)
-            .all()
-        )
-        days = []
-        order_counts = []
-        for i in range(7):
-            day = datetime.utcnow() - timedelta(days=6 - i)
-            next_day = day + timedelta(days=1)
-            count = Order.query.filter(
-                Order.created_at >= day, Order.created_at < next_day
-            ).count()
-            days.append(day.strftime("%d.%m"))
-            order_counts.append(count)
+        series = SalesStatsService.daily_series(today - timedelta(days=6), today)
+        monthly_revenue = SalesStatsService.monthly_revenue()
         return self.render(
             "admin/index.html",
-            total_orders=total_orders,
+            total_orders=totals["orders"],
             total_products=total_products,
-            total_users=total_users,
-            recent_orders=recent_orders,
-            revenue=round(float(revenue), 2),
+            total_users=totals["new_users"],
+            recent_orders=last_month["orders"],
+            revenue=round(float(last_month["revenue"]), 2),
             latest_orders=latest_orders,
-            popular_products=popular_products,
-            days=days,
-            order_counts=order_counts,
+            popular_products=SalesStatsService.top_products(5, month_start, today),
+            days=[point["day"].strftime("%d.%m") for point in series],
+            order_counts=[point["orders"] for point in series],
+            status_counts=SalesStatsService.status_counts(month_start, today),
+            revenue_months=[label for label, _ in monthly_revenue],
+            revenue_values=[round(value, 2) for _, value in monthly_revenue],
+        )
+
+    @expose("/sales")
+    @login_required
+    def sales(self):
+        """
+        Итоги за произвольный период для графиков: ?start=ГГГГ-ММ-ДД&end=ГГГГ-ММ-ДД
+        или ?days=N (последние N дней). Читает только дневные итоги.
+        """
+        if not current_user.is_admin:
+            abort(403)
+        today = datetime.utcnow().date()
+        try:
+            end = date.fromisoformat(request.args["end"]) if request.args.get("end") else today
+            if request.args.get("start"):
+                start = date.fromisoformat(request.args["start"])
+            else:
+                days = min(max(request.args.get("days", 7, type=int), 1), MAX_SALES_RANGE_DAYS)
+                start = end - timedelta(days=days - 1)
+        except ValueError:
+            return jsonify({"error": "Даты передаются в формате ГГГГ-ММ-ДД"}), 400
+        if start > end or (end - start).days >= MAX_SALES_RANGE_DAYS:
+            return jsonify({"error": f"Период — от 1 до {MAX_SALES_RANGE_DAYS} дней"}), 400
+        summary = SalesStatsService.summary(start, end)
+        return jsonify(
+            {
+                "start": start.isoformat(),
+                "end": end.isoformat(),
+                "orders": summary["orders"],
+                "revenue": float(summary["revenue"]),
+                "new_users": summary["new_users"],
+                "statuses": SalesStatsService.status_counts(start, end),
+                "top_products": [
+                    {"name": name, "units": int(units), "revenue": float(revenue)}
+                    for name, units, revenue in SalesStatsService.top_products(5, start, end)
+                ],
+                "days": [
+                    {"day": point["day"].isoformat(), "orders": point["orders"], "revenue": point["revenue"]}
+                    for point in SalesStatsService.daily_series(start, end)
+                ],
+            }
         )
 
 
 class ImportExportView(BaseView):
+    def is_accessible(self):
+        return current_user.is_authenticated and current_user.is_admin
+
+    def inaccessible_callback(self, name, **kwargs):
+        if not current_user.is_authenticated:
+            return redirect(url_for("auth.login", next=request.url))
+        abort(403)
+
     @expose("/")
     def index(self):
-        return self.render("admin/import_export.html")
+        return self.render(
+            "admin/import_export.html",
+            jobs=ImportService.recent_jobs(),
+            export_jobs=ExportService.recent_jobs(),
+        )
 
     @expose("/export")
     def export(self):
-        output = io.StringIO()
-        writer = csv.writer(output)
-        headers = [
-            "id",
-            "name",
-            "slug",
-            "description",
-            "price",
-            "old_price",
-            "sku",
-            "in_stock",
-            "category_name",
-            "brand_name",
-            "meta_title",
-            "meta_description",
-        ]
-        writer.writerow(headers)
-        products = Product.query.options(
-            joinedload(Product.category),
-            joinedload(Product.brand)
-        ).all()
-        for product in products:
-            row = [
-                product.id,
-                product.name,
-                product.slug,
-                product.description,
-                product.price,
-                product.old_price,
-                product.sku,
-                product.in_stock,
-                product.category.name if product.category else "",
-                product.brand.name if product.brand else "",
-                product.meta_title,
-                product.meta_description,
-            ]
-            writer.writerow(row)
-        output.seek(0)
+        fmt = request.args.get("format", "csv")
+        if fmt not in EXPORT_FORMATS:
+            abort(404)
+        _, mimetype, extension = EXPORT_FORMATS[fmt]
+        # Потоковый ответ (chunked): в памяти только текущая порция товаров
         return Response(
-            output,
-            mimetype="text/csv",
-            headers={"Content-Disposition": "attachment;filename=products_export.csv"},
+            stream_with_context(ExportService.stream(fmt, self._image_prefix())),
+            mimetype=mimetype,
+            headers={"Content-Disposition": f"attachment;filename=products_export.{extension}"},
         )
 
+    @expose("/export/jobs", methods=["POST"])
+    def start_export(self):
+        fmt = request.form.get("format", "csv")
+        if fmt not in EXPORT_FORMATS:
+            abort(400)
+        try:
+            job = ExportService.start(fmt, self._image_prefix(), user_id=current_user.id)
+        except Exception as e:
+            flash(f"Не удалось запустить выгрузку: {e}", "danger")
+            return redirect(url_for(".index"))
+        flash(f"Выгрузка #{job.id} формируется в фоне, файл появится в списке ниже.", "success")
+        return redirect(url_for(".index"))
+
+    @expose("/export/jobs/<int:job_id>")
+    def export_status(self, job_id):
+        job = db.session.get(ExportJob, job_id) or abort(404)
+        return jsonify(
+            id=job.id,
+            status=job.status,
+            rows_exported=job.rows_exported,
+            message=job.message,
+        )
+
+    @expose("/export/jobs/<int:job_id>/download")
+    def download_export(self, job_id):
+        job = db.session.get(ExportJob, job_id) or abort(404)
+        if job.status != "done" or not job.path or not os.path.exists(job.path):
+            abort(404)
+        return send_file(job.path, as_attachment=True, download_name=os.path.basename(job.path))
+
+    @staticmethod
+    def _image_prefix():
+        return url_for("static", filename="images/", _external=True)
+
     @expose("/import", methods=["POST"])
     def import_csv(self):
         file = request.files.get("file")
         if not file or file.filename == "":
             flash("Файл не был выбран.", "danger")
             return redirect(url_for(".index"))
-        if not file.filename.endswith(".csv"):
-            flash("Пожалуйста, загрузите файл в формате CSV.", "danger")
+        if not file.filename.lower().endswith((".csv", ".csv.gz")):
+            flash("Пожалуйста, загрузите файл в формате CSV (можно сжатый .csv.gz).", "danger")
             return redirect(url_for(".index"))
         try:
-            stream = io.StringIO(file.stream.read().decode("UTF-8"), newline=None)
-            csv_reader = csv.reader(stream)
-            headers = next(csv_reader)
-            created_count, updated_count = 0, 0
-            for row in csv_reader:
-                row_data = dict(zip(headers, row))
-                product_id = row_data.get("id")
-                product = Product.query.get(product_id) if product_id else None
-                if not product:
-                    product = Product()
-                    created_count += 1
-                else:
-                    updated_count += 1
-                product.name = row_data.get("name")
-                product.slug = row_data.get("slug") or None
-                product.description = row_data.get("description")
-                product.price = row_data.get("price")
-                product.old_price = row_data.get("old_price") or None
-                product.sku = row_data.get("sku")
-                product.in_stock = int(row_data.get("in_stock", 0))
-                product.meta_title = row_data.get("meta_title")
-                product.meta_description = row_data.get("meta_description")
-                category_name = row_data.get("category_name")
-                if category_name:
-                    category = Category.query.filter_by(name=category_name).first()
-                    if not category:
-                        category = Category(name=category_name)
-                        db.session.add(category)
-                    product.category = category
-                brand_name = row_data.get("brand_name")
-                if brand_name:
-                    brand = Brand.query.filter_by(name=brand_name).first()
-                    if not brand:
-                        brand = Brand(name=brand_name)
-                        db.session.add(brand)
-                    product.brand = brand
-                db.session.add(product)
-            db.session.commit()
-            flash(
-                f"Импорт завершен! Создано: {created_count}, обновлено: {updated_count} товаров.",
-                "success",
-            )
+            job = ImportService.start(file, user_id=current_user.id)
         except Exception as e:
-            db.session.rollback()
-            flash(f"Произошла ошибка при импорте: {e}", "danger")
+            flash(f"Не удалось запустить импорт: {e}", "danger")
+            return redirect(url_for(".index"))
+        flash(
+            f"Файл {job.filename} загружен, импорт #{job.id} выполняется в фоне. "
+            "Прогресс и ошибки строк — в таблице ниже.",
+            "success",
+        )
         return redirect(url_for(".index"))
+
+    @expose("/import/<int:job_id>")
+    def import_status(self, job_id):
+        job = db.session.get(ImportJob, job_id) or abort(404)
+        return jsonify(
+            id=job.id,
+            status=job.status,
+            progress=job.progress,
+            rows_processed=job.rows_processed,
+            created=job.created_count,
+            updated=job.updated_count,
+            error_count=job.error_count,
+            errors=job.errors or [],
+            message=job.message,
+        )
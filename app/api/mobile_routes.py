@@ -1,9 +1,16 @@
-from flask import jsonify, request, current_app
+from flask import jsonify, request
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
-from app.models import User, Product, Category
-from app import db
+from werkzeug.datastructures import MultiDict
+from app.models import User, Product
 from . import api_bp
-from .serializers import ProductListSchema, ProductDetailSchema, UserSchema, CategorySchema
+from .serializers import ProductListSchema, ProductDetailSchema, UserSchema, CategoryTreeSchema
+from app.services.search_service import SearchService
+from app.services.pagination_service import PaginationService, SORT_KEYS
+from app.services.catalog_engine import CatalogEngine
+from app.services.category_service import CategoryService
+from app.services.wishlist_service import WishlistService
+from app.services.recommendation_service import RecommendationService
+from app.utils import parse_catalog_filters, get_catalog_version, conditional_get
 from sqlalchemy.orm import joinedload, selectinload
 
 # --- AUTH ---
@@ -48,49 +55,102 @@ def mobile_profile():
 
 # --- CATALOG ---
 
+def catalog_version_validator(**kwargs):
+    return get_catalog_version(), request.full_path
+
+
+def product_validator(product_id):
+    return get_catalog_version(), RecommendationService.version(), product_id
+
+
+def wishlist_personalization():
+    # Единственное, что в ответах каталога зависит от пользователя, — флаг in_wishlist
+    return sorted(WishlistService.get_ids(get_jwt_identity()))
+
+
 @api_bp.route("/mobile/products", methods=["GET"])
+@jwt_required(optional=True)
+@conditional_get(catalog_version_validator, wishlist_personalization)
 def mobile_products_list():
     page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor', type=str)
     per_page = 20
     category_id = request.args.get('category_id', type=int)
     search = request.args.get('search', type=str)
+    sort_by = request.args.get('sort_by', 'id_asc')
 
-    query = Product.query.options(
-        joinedload(Product.category),
-        selectinload(Product.images)
-    )
+    options = (joinedload(Product.category), joinedload(Product.primary_image))
+    query = Product.query.options(*options)
 
     if category_id:
-        query = query.filter(Product.category_id == category_id)
+        # Категория вместе с подкатегориями
+        query = query.filter(CategoryService.product_filter(Product.category_id, category_id))
     
     if search:
-        query = query.filter(Product.name.ilike(f"%{search}%"))
-
-    # Пагинация
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        # Выдача по релевантности: курсор хранит смещение
+        query = SearchService.rank_query(query, search)
+        sort_by = None
+    elif sort_by not in SORT_KEYS:
+        return jsonify({"msg": "Unknown sort_by"}), 400
+
+    # Пагинация по курсору (page без курсора поддерживается для старых клиентов)
+    try:
+        pagination = None
+        if not search:
+            # Колоночный снимок каталога, если он включен и готов
+            pagination = CatalogEngine.paginate(
+                parse_catalog_filters(MultiDict(), category_id),
+                sort_by,
+                cursor=cursor,
+                per_page=per_page,
+                page=page,
+                options=options,
+            )
+        if pagination is None:
+            pagination = PaginationService.paginate(
+                query, sort_by=sort_by, cursor=cursor, per_page=per_page, page=page
+            )
+    except ValueError:
+        return jsonify({"msg": "Invalid cursor"}), 400
     products = pagination.items
 
     # Сериализация
-    schema = ProductListSchema(many=True)
+    schema = ProductListSchema(
+        many=True, context={"wishlist_ids": WishlistService.get_ids(get_jwt_identity())}
+    )
     return jsonify({
         "items": schema.dump(products),
         "total": pagination.total,
         "pages": pagination.pages,
-        "current_page": page
+        "current_page": pagination.page,
+        "next_cursor": pagination.next_cursor,
+        "prev_cursor": pagination.prev_cursor,
     })
 
 @api_bp.route("/mobile/products/<int:product_id>", methods=["GET"])
+@jwt_required(optional=True)
+@conditional_get(product_validator, wishlist_personalization)
 def mobile_product_detail(product_id):
     product = Product.query.options(
         joinedload(Product.brand),
+        joinedload(Product.primary_image),
         selectinload(Product.images)
     ).get_or_404(product_id)
 
-    schema = ProductDetailSchema()
-    return jsonify(schema.dump(product))
+    wishlist_ids = WishlistService.get_ids(get_jwt_identity())
+    schema = ProductDetailSchema(context={"wishlist_ids": wishlist_ids})
+    data = schema.dump(product)
+    related = RecommendationService.related_products(
+        product, limit=8, options=(joinedload(Product.primary_image),)
+    )
+    data["related"] = ProductListSchema(
+        many=True, context={"wishlist_ids": wishlist_ids}
+    ).dump(related)
+    return jsonify(data)
 
 @api_bp.route("/mobile/categories", methods=["GET"])
+@conditional_get(catalog_version_validator)
 def mobile_categories():
-    categories = Category.query.filter_by(parent_id=None).all()
-    schema = CategorySchema(many=True)
-    return jsonify(schema.dump(categories))
\ No newline at end of file
+    # Полное дерево из памяти процесса: корни с вложенными children
+    schema = CategoryTreeSchema(many=True)
+    return jsonify(schema.dump(CategoryService.tree().roots))
\ No newline at end of file
@@ -1,8 +1,14 @@
-from flask import jsonify, request, url_for, current_app
+from flask import jsonify, request, current_app
 from flask_login import login_required, current_user
-from app.models import Product, Cart
+from app.models import Product
 from app import db, limiter
+from app.services.autocomplete_service import AutocompleteService
+from app.services.wishlist_service import WishlistService
+from app.services.counter_service import CounterService
+from app.services.cart_service import CartService
+from app.services.review_service import ReviewService, REVIEWS_PER_PAGE
 from . import api_bp
+from .serializers import ReviewSchema
 from .schemas import (
     CartAddItemSchema,
     CartRemoveItemSchema,
@@ -11,25 +17,42 @@ from .schemas import (
 )
 
 
+def cart_summary_response(user_id, **extra):
+    """Ответ /api/cart/*: количество, сумма и подытоги позиций из CartService.summary."""
+    summary = CartService.summary(user_id)
+    return jsonify(
+        {
+            "success": True,
+            **extra,
+            "cart_count": summary["count"],
+            "cart_positions": summary["positions"],
+            "total_price": float(summary["total"]),
+            "items": [
+                {
+                    "product_id": line["product_id"],
+                    "quantity": line["quantity"],
+                    "price": float(line["price"]),
+                    "subtotal": float(line["subtotal"]),
+                }
+                for line in summary["lines"]
+            ],
+        }
+    )
+
+
 @api_bp.route("/cart/add", methods=["POST"])
 @login_required
 def api_add_to_cart():
     data = request.get_json()
     product_id = data.get("product_id")
     quantity = int(data.get("quantity", 1))
+    # id — до коммита: после него current_user перечитывается из БД
+    user_id = current_user.id
 
-    # Используем сервис из Этапа 1
-    from app.services.cart_service import CartService
     success, message = CartService.add_item(current_user, product_id, quantity)
     
     if success:
-        # Считаем количество товаров для обновления счетчика
-        cart_count = sum(item.quantity for item in current_user.cart_items)
-        return jsonify({
-            "success": True,
-            "message": message,
-            "cart_count": cart_count
-        })
+        return cart_summary_response(user_id, message=message)
     
     return jsonify({"success": False, "error": message}), 400
 
@@ -45,17 +68,10 @@ def api_remove_from_cart():
         return jsonify({"success": False, "error": errors}), 400
 
     try:
-        product_id = data["product_id"]
-        cart_item = Cart.query.filter_by(
-            user_id=current_user.id, product_id=product_id
-        ).first()
-
-        if cart_item:
-            db.session.delete(cart_item)
-            db.session.commit()
+        user_id = current_user.id
+        CartService.remove_item(user_id, data["product_id"])
 
-        cart_count = sum(item.quantity for item in current_user.cart_items.all())
-        return jsonify({"success": True, "cart_count": cart_count})
+        return cart_summary_response(user_id)
 
     except Exception as e:
         db.session.rollback()
@@ -74,45 +90,14 @@ def api_update_cart():
         return jsonify({"success": False, "error": errors}), 400
 
     try:
-        product_id = data["product_id"]
-        quantity = data["quantity"]
-
-        if quantity <= 0:
-            cart_item = Cart.query.filter_by(
-                user_id=current_user.id, product_id=product_id
-            ).first()
-            if cart_item:
-                db.session.delete(cart_item)
-        else:
-            product = Product.query.get_or_404(product_id)
-            if product.in_stock < quantity:
-                return jsonify({"success": False, "error": "Недостаточно товара"}), 400
-
-            cart_item = Cart.query.filter_by(
-                user_id=current_user.id, product_id=product_id
-            ).first()
-            if cart_item:
-                cart_item.quantity = quantity
-            else:
-                cart_item = Cart(
-                    user_id=current_user.id, product_id=product_id, quantity=quantity
-                )
-                db.session.add(cart_item)
-
-        db.session.commit()
-
-        total_price = sum(
-            item.product.price * item.quantity for item in current_user.cart_items.all()
-        )
-        cart_count = sum(item.quantity for item in current_user.cart_items.all())
-
-        return jsonify(
-            {
-                "success": True,
-                "total_price": float(total_price),
-                "cart_count": cart_count,
-            }
+        user_id = current_user.id
+        success, message = CartService.set_quantity(
+            user_id, data["product_id"], data["quantity"]
         )
+        if not success:
+            return jsonify({"success": False, "error": message}), 400
+
+        return cart_summary_response(user_id)
 
     except Exception as e:
         db.session.rollback()
@@ -120,6 +105,25 @@ def api_update_cart():
         return jsonify({"success": False, "error": "Internal server error"}), 500
 
 
+@api_bp.route("/products/<int:product_id>/reviews")
+@api_bp.route("/mobile/products/<int:product_id>/reviews")
+def product_reviews(product_id):
+    """Следующие страницы отзывов товара (сайт и мобильное приложение)."""
+    per_page = request.args.get("per_page", REVIEWS_PER_PAGE, type=int)
+    try:
+        reviews, next_cursor = ReviewService.page(
+            product_id, cursor=request.args.get("cursor"), per_page=per_page
+        )
+    except ValueError:
+        return jsonify({"msg": "Invalid cursor"}), 400
+    return jsonify(
+        {
+            "items": ReviewSchema(many=True).dump(reviews),
+            "next_cursor": next_cursor,
+        }
+    )
+
+
 @api_bp.route("/search/autocomplete")
 def autocomplete():
     """AJAX: Получить подсказки для поиска"""
@@ -127,11 +131,12 @@ def autocomplete():
     if len(query) < 2:
         return jsonify([])
 
-    products = Product.query.filter(Product.name.ilike(f"%{query}%")).limit(5).all()
-    results = [
-        {"name": p.name, "url": url_for("main.product", product_id=p.id)}
-        for p in products
-    ]
+    try:
+        results = AutocompleteService.complete(query, limit=5)
+    except Exception as e:
+        # Индекс недоступен — отвечаем через общий поиск по БД
+        current_app.logger.warning(f"Автодополнение из индекса недоступно: {e}")
+        results = AutocompleteService.search_fallback(query, limit=5)
     return jsonify(results)
 
 
@@ -154,6 +159,8 @@ def toggle_wishlist():
         if is_in_wishlist:
             current_user.wishlist.remove(product)
             db.session.commit()
+            WishlistService.invalidate(current_user.id)
+            CounterService.adjust(current_user.id, "wishlist", -1)
             return jsonify(
                 {
                     "success": True,
@@ -164,6 +171,8 @@ def toggle_wishlist():
         else:
             current_user.wishlist.append(product)
             db.session.commit()
+            WishlistService.invalidate(current_user.id)
+            CounterService.adjust(current_user.id, "wishlist", 1)
             return jsonify(
                 {"success": True, "action": "added", "message": "Добавлено в избранное"}
             )
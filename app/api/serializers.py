@@ -1,20 +1,34 @@
 from flask import url_for, current_app
 from marshmallow import Schema, fields, pre_dump
+from app.services.image_service import ImageService
 
 class ProductImageSchema(Schema):
     image_url = fields.Method("get_absolute_image_url")
     sort_order = fields.Int()
+    # Производные по ширинам ("url 320w, ..."); пустая строка, пока не построены
+    srcset = fields.Method("get_srcset")
+    srcset_webp = fields.Method("get_srcset_webp")
 
     def get_absolute_image_url(self, obj):
         # Генерирует абсолютный URL: http://domain.com/static/images/filename.jpg
         return url_for('static', filename=f'images/{obj.image_url}', _external=True)
 
+    def get_srcset(self, obj):
+        return ImageService.srcset(obj, "jpeg", external=True)
+
+    def get_srcset_webp(self, obj):
+        return ImageService.srcset(obj, "webp", external=True)
+
 class CategorySchema(Schema):
     id = fields.Int()
     name = fields.Str()
     slug = fields.Str()
     parent_id = fields.Int(allow_none=True)
 
+class CategoryTreeSchema(CategorySchema):
+    """Категория с подкатегориями (узел CategoryTree)"""
+    children = fields.List(fields.Nested(lambda: CategoryTreeSchema()))
+
 class ProductListSchema(Schema):
     """Облегченная схема для списков товаров"""
     id = fields.Int()
@@ -23,19 +37,26 @@ class ProductListSchema(Schema):
     price = fields.Float()
     old_price = fields.Float(allow_none=True)
     in_stock = fields.Int()
+    rating_avg = fields.Float()
+    rating_count = fields.Int()
     # Возвращаем только первую картинку или заглушку
     main_image = fields.Method("get_main_image")
+    main_image_srcset = fields.Method("get_main_image_srcset")
     category = fields.Nested(CategorySchema, only=("id", "name"))
+    # Множество id из избранного передается в context["wishlist_ids"]
+    in_wishlist = fields.Method("get_in_wishlist")
+
+    def get_in_wishlist(self, obj):
+        return obj.id in self.context.get("wishlist_ids", ())
 
     def get_main_image(self, obj):
-        # Логика получения главной картинки (аналогично add_first_image_to_products)
-        img_filename = "default_product.png"
-        if obj.images:
-            sorted_images = sorted(obj.images, key=lambda x: x.sort_order)
-            img_filename = sorted_images[0].image_url
-        
+        # Главное изображение денормализовано (Product.primary_image), коллекция не нужна
+        img_filename = obj.primary_image.image_url if obj.primary_image else "default_product.png"
         return url_for('static', filename=f'images/{img_filename}', _external=True)
 
+    def get_main_image_srcset(self, obj):
+        return ImageService.srcset(obj.primary_image, "jpeg", external=True)
+
 class ProductDetailSchema(ProductListSchema):
     """Полная схема для карточки товара"""
     description = fields.Str()
@@ -49,6 +70,16 @@ class ProductDetailSchema(ProductListSchema):
     def get_brand_name(self, obj):
         return obj.brand.name if obj.brand else None
 
+class ReviewSchema(Schema):
+    id = fields.Int()
+    rating = fields.Int()
+    comment = fields.Str(allow_none=True)
+    created_at = fields.DateTime()
+    author = fields.Method("get_author_name")
+
+    def get_author_name(self, obj):
+        return obj.author.name if obj.author else None
+
 class UserSchema(Schema):
     id = fields.Int()
     email = fields.Str()
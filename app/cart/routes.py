@@ -1,4 +1,4 @@
-from flask import render_template, redirect, url_for, flash, request, session
+from flask import render_template, redirect, url_for, flash, request
 from flask_login import current_user, login_required
 from app import db
 from app.models import Order, OrderItem, Product, Cart
@@ -9,35 +9,10 @@ from decimal import Decimal
 
 def merge_session_cart_to_db():
     """
-    Объединяет содержимое корзины из сессии с корзиной в базе данных.
-    Вызывается при входе пользователя в систему.
+    Объединяет гостевую корзину текущей сессии с корзиной пользователя.
+    Вызывается при входе и регистрации.
     """
-    if 'cart' in session:
-        for item_data in session['cart']:
-            product_id = item_data['product_id']
-            quantity = item_data['quantity']
-
-            # Проверяем, есть ли уже такой товар в корзине пользователя
-            existing_item = Cart.query.filter_by(
-                user_id=current_user.id,
-                product_id=product_id
-            ).first()
-
-            if existing_item:
-                # Обновляем количество
-                existing_item.quantity += quantity
-            else:
-                # Добавляем новый товар в корзину
-                new_item = Cart(
-                    user_id=current_user.id,
-                    product_id=product_id,
-                    quantity=quantity
-                )
-                db.session.add(new_item)
-
-        # Очищаем корзину из сессии после объединения
-        session.pop('cart', None)
-        db.session.commit()
+    CartService.merge_guest_cart(current_user.id)
 
 @cart_app.route("/")
 def cart_view():
@@ -71,9 +46,9 @@ def checkout():
     try:
         # Используем транзакцию
         with db.session.begin_nested():
-            # 1. Получаем корзину
-            cart_items = Cart.query.filter_by(user_id=current_user.id).all()
-            if not cart_items:
+            # 1. Получаем корзину (из настроенного хранилища, CART_BACKEND)
+            cart_lines = CartService.store().lines(current_user.id)
+            if not cart_lines:
                 flash("Корзина пуста", "warning")
                 return redirect(url_for("main.catalog"))
 
@@ -90,34 +65,38 @@ def checkout():
             db.session.add(order)
             db.session.flush() # Получаем ID заказа
 
-            for item in cart_items:
+            for product_id, quantity in cart_lines.items():
                 # 2. БЛОКИРУЕМ СТРОКУ ТОВАРА (Anti-Race Condition)
                 # Это гарантирует, что никто не купит товар, пока мы обрабатываем транзакцию
-                product = Product.query.with_for_update().get(item.product_id)
+                product = Product.query.with_for_update().get(product_id)
+                if product is None:
+                    continue  # Товар удален из каталога, пока лежал в корзине
 
-                if product.in_stock < item.quantity:
+                if product.in_stock < quantity:
                     raise Exception(f"Товар {product.name} закончился, пока вы оформляли заказ")
 
                 # 3. Списываем остатки
-                product.in_stock -= item.quantity
+                product.in_stock -= quantity
 
                 # 4. Создаем элемент заказа
                 order_item = OrderItem(
                     order_id=order.id,
                     product_id=product.id,
-                    quantity=item.quantity,
+                    quantity=quantity,
                     price=product.price
                 )
                 db.session.add(order_item)
-                total_amount += product.price * item.quantity
+                total_amount += product.price * quantity
 
             order.total_amount = total_amount
             order.final_amount = total_amount # С учетом возможных скидок
 
-            # 5. Очищаем корзину
+            # 5. Очищаем корзину: строки таблицы — в той же транзакции
             Cart.query.filter_by(user_id=current_user.id).delete()
 
         db.session.commit()
+        # Хранилище корзин (Redis) и счетчик в шапке — после коммита заказа
+        CartService.clear(current_user.id)
         flash(f"Заказ #{order.id} успешно оформлен!", "success")
         return redirect(url_for("auth.profile"))
 
@@ -0,0 +1,158 @@
+import os
+import click
+from flask.cli import AppGroup
+
+catalog_cli = AppGroup("catalog", help="Обслуживание индексов каталога.")
+
+
+@catalog_cli.command("rebuild-facets")
+@click.option("--category-id", type=int, default=None, help="Только одна категория.")
+def rebuild_facets(category_id):
+    """Перестраивает индекс фасетов характеристик."""
+    from app.services.facet_service import FacetService
+
+    count = FacetService.rebuild(category_id)
+    click.echo(f"Индекс фасетов перестроен: {count} записей.")
+
+
+@catalog_cli.command("backfill-specs")
+@click.option("--chunk-size", type=int, default=1000, show_default=True)
+def backfill_specs(chunk_size):
+    """Заполняет таблицу product_spec из Product.specifications порциями."""
+    from app.services.spec_service import SpecService
+
+    products, rows = SpecService.backfill(chunk_size=chunk_size, echo=click.echo)
+    click.echo(f"Готово: {products} товаров, {rows} характеристик.")
+    click.echo("Не забудьте перестроить фасеты: flask catalog rebuild-facets")
+
+
+@catalog_cli.command("rebuild-search")
+@click.option("--chunk-size", type=int, default=1000, show_default=True)
+def rebuild_search(chunk_size):
+    """Перестраивает поисковый индекс товаров."""
+    from app.services.search_service import SearchService
+
+    total = SearchService.backend().rebuild(chunk_size=chunk_size, echo=click.echo)
+    click.echo(f"Поисковый индекс перестроен: {total} товаров.")
+
+
+@catalog_cli.command("repair-ratings")
+@click.option("--chunk-size", type=int, default=5000, show_default=True)
+def repair_ratings(chunk_size):
+    """Пересчитывает рейтинг и распределение оценок товаров из отзывов."""
+    from app.services.rating_service import RatingService
+
+    total = RatingService.recompute(chunk_size=chunk_size, echo=click.echo)
+    click.echo(f"Рейтинги пересчитаны: {total} товаров.")
+
+
+@catalog_cli.command("build-recommendations")
+@click.option("--full", is_flag=True, help="Пересчитать с нуля, без накопленных счетчиков.")
+def build_recommendations(full):
+    """Пересчитывает рекомендации «С этим товаром покупают»."""
+    from app.services.recommendation_service import RecommendationService
+
+    result = RecommendationService.build(full=full, echo=click.echo)
+    click.echo(
+        f"Рекомендации: {result['order_items']} новых позиций заказов, "
+        f"{result['pairs']} пар, {result['rows']} строк для {result['products']} товаров "
+        f"за {result['timings']['total']:.1f} с."
+    )
+
+
+@catalog_cli.command("repair-primary-images")
+@click.option("--chunk-size", type=int, default=5000, show_default=True)
+def repair_primary_images(chunk_size):
+    """Пересчитывает главное изображение товаров (после массовой загрузки в обход ORM)."""
+    from app import db
+    from app.services.image_service import ImageService
+
+    ImageService.sync_primary_images(db.session.connection(), chunk_size=chunk_size, echo=click.echo)
+    db.session.commit()
+    click.echo("Главные изображения пересчитаны.")
+
+
+@catalog_cli.command("rebuild-category-paths")
+def rebuild_category_paths():
+    """Пересчитывает пути дерева категорий (после правки parent_id в обход ORM)."""
+    from app import db
+    from app.services.category_service import CategoryService
+
+    changed = CategoryService.sync_paths(db.session.connection())
+    db.session.commit()
+    CategoryService.invalidate()
+    click.echo(f"Пути категорий пересчитаны: изменено {len(changed)}.")
+
+
+@catalog_cli.command("build-image-derivatives")
+@click.option("--workers", type=int, default=None, help="Число процессов (по умолчанию — по числу CPU).")
+@click.option("--force", is_flag=True, help="Обработать и изображения, для которых производные уже есть.")
+def build_image_derivatives(workers, force):
+    """Строит миниатюры и WebP для уже загруженных изображений товаров."""
+    from app.services.image_service import ImageService
+
+    processed, failed = ImageService.backfill(workers=workers, force=force, echo=click.echo)
+    click.echo(f"Производные построены: {processed} изображений, ошибок: {failed}.")
+
+
+@catalog_cli.command("build-autocomplete")
+def build_autocomplete():
+    """Строит снимок индекса автодополнения (воркеры подхватят его сами)."""
+    from app.services.autocomplete_service import AutocompleteService
+
+    index = AutocompleteService.build_snapshot()
+    click.echo(
+        f"Снимок автодополнения {index.version}: {len(index.product_ids)} товаров, "
+        f"~{index.memory_usage() // (1024 * 1024)} МБ."
+    )
+
+
+@catalog_cli.command("build-snapshot")
+def build_snapshot():
+    """Строит колоночный снимок каталога для CATALOG_ENGINE=columnar."""
+    from app.services.catalog_engine import CatalogEngine, ColumnarSnapshot
+
+    path = CatalogEngine.build_snapshot()
+    snapshot = ColumnarSnapshot(path)
+    size = sum(
+        os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)
+    )
+    click.echo(
+        f"Снимок каталога {os.path.basename(path)}: {len(snapshot)} товаров, "
+        f"{len(snapshot.vocabulary)} значений характеристик, ~{size // (1024 * 1024)} МБ."
+    )
+
+@catalog_cli.command("import-products")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--chunk-size", type=int, default=1000, show_default=True)
+def import_products(path, chunk_size):
+    """Импортирует товары из CSV (или .csv.gz) на диске сервера без очереди Celery."""
+    from app import db
+    from app.models import ImportJob
+    from app.services.import_service import ImportService
+
+    job = ImportJob(filename=os.path.basename(path), path=path, size_bytes=os.path.getsize(path))
+    db.session.add(job)
+    db.session.commit()
+    job = ImportService.run(job.id, chunk_size=chunk_size, remove_file=False, echo=click.echo)
+    click.echo(
+        f"Импорт #{job.id}: {job.status}. Строк {job.rows_processed}, создано {job.created_count}, "
+        f"обновлено {job.updated_count}, ошибок {job.error_count}."
+    )
+    for error in job.errors or []:
+        click.echo(f"  строка {error['line']}: {error['error']}")
+    if job.message:
+        click.echo(job.message)
+
+
+@catalog_cli.command("rebuild-sales-stats")
+@click.option("--start", type=click.DateTime(formats=["%Y-%m-%d"]), default=None, help="Первый день (по умолчанию — первый заказ).")
+@click.option("--end", type=click.DateTime(formats=["%Y-%m-%d"]), default=None, help="Последний день (по умолчанию — сегодня).")
+def rebuild_sales_stats(start, end):
+    """Пересчитывает дневные итоги продаж и регистраций для панели администратора."""
+    from app.services.sales_stats_service import SalesStatsService
+
+    days = SalesStatsService.rebuild(
+        start.date() if start else None, end.date() if end else None, echo=click.echo
+    )
+    click.echo(f"Дневные итоги пересчитаны: {days} дней.")
@@ -4,37 +4,51 @@ from flask import (
     url_for,
     make_response,
     current_app,
-    render_template_string,
     session,
     redirect,
     flash,
     send_from_directory,
     abort,
+    send_file,
 )
 from flask_login import current_user, login_required
-from app import db, cache
-from app.models import Product, Category, Brand, ProductImage, Review, Order, User
+from app import db
+from app.models import Product, ProductImage, Review, Order, User
 from app.forms import ReviewForm
-from app.utils import get_category_filters, filter_products_by_specs, get_cached_categories, get_cached_brands
-from datetime import datetime
+from app.utils import (
+    parse_catalog_filters,
+    get_cached_categories,
+    get_cached_brands,
+    get_catalog_version,
+    conditional_get,
+    page_personalization,
+)
+from app.services.facet_service import FacetService
+from app.services.pagination_service import PaginationService, SORT_KEYS
+from app.services.catalog_engine import CatalogEngine
+from app.services.category_service import CategoryService
+from app.services.wishlist_service import WishlistService
+from app.services.review_service import ReviewService
+from app.services.recommendation_service import RecommendationService
+from app.services.sitemap_service import SitemapService
+import hashlib
 from . import main_bp
-from sqlalchemy.orm import joinedload, selectinload
-from sqlalchemy import func
+from sqlalchemy.orm import joinedload
 import os
 
 
 def add_first_image_to_products(products):
     """
-    Эффективно добавляет первое изображение к каждому товару в списке.
-    Предполагается, что `product.images` уже загружены с помощью selectinload.
+    Добавляет к каждому товару главное изображение для карточки.
+    Берется из product.primary_image: загружайте его joinedload(Product.primary_image),
+    коллекция images для списков не нужна.
     """
     for product in products:
-        if product.images:
-            # Сортируем уже загруженные изображения по sort_order
-            sorted_images = sorted(product.images, key=lambda img: img.sort_order)
-            product.first_image = sorted_images[0].image_url
-        else:
-            product.first_image = "default_product.png"
+        # Для srcset (производные строит ImageService)
+        product.main_image = product.primary_image
+        product.first_image = (
+            product.primary_image.image_url if product.primary_image else "default_product.png"
+        )
     return products
 
 
@@ -45,7 +59,7 @@ def index():
     featured_products_query = Product.query.options(
         joinedload(Product.category),
         joinedload(Product.brand),
-        selectinload(Product.images),
+        joinedload(Product.primary_image),
     )
     featured_products = (
         featured_products_query.order_by(Product.id.desc()).limit(8).all()
@@ -59,64 +73,87 @@ def index():
     )
 
 
+def catalog_validator(slug=None):
+    # Вся выдача каталога определяется версией каталога и параметрами запроса
+    return get_catalog_version(), request.full_path
+
+
+def product_validator(slug=None, product_id=None):
+    # Отзывы и рейтинг тоже меняют версию каталога (см. sync_product_ratings)
+    return get_catalog_version(), RecommendationService.version(), slug, product_id
+
+
 @main_bp.route("/catalog/")
 @main_bp.route("/catalog/<slug>")
+@conditional_get(catalog_validator, page_personalization)
 def catalog(slug=None):
     page = request.args.get("page", 1, type=int)
     per_page = 24
 
-    # Базовый запрос
-    query = Product.query.options(
-        joinedload(Product.category),
-        joinedload(Product.brand),
-        selectinload(Product.images),
-    )
-
     current_category = None
     dynamic_filters = {}
 
     if slug:
-        current_category = Category.query.filter_by(slug=slug).first_or_404()
-        query = query.filter(Product.category_id == current_category.id)
-
-        # 1. Генерируем фильтры для этой категории
-        dynamic_filters = get_category_filters(current_category.id)
-
-    # Стандартные фильтры (SQL)
-    search_query = request.args.get("search_query", type=str)
-    brand_ids = request.args.getlist("brand_id", type=int) # getlist для мультивыбора
-    min_price = request.args.get("min_price", type=float)
-    max_price = request.args.get("max_price", type=float)
+        # Узел дерева категорий из памяти процесса: крошки и подкатегории без запросов
+        current_category = CategoryService.tree().by_slug.get(slug)
+        if current_category is None:
+            abort(404)
+
+    # Все фильтры (категория, бренды, цена, поиск, характеристики) в одном наборе
+    filters = parse_catalog_filters(
+        request.args, current_category.id if current_category else None
+    )
+    brand_ids = filters["brand_ids"]
     sort_by = request.args.get("sort_by", "price_asc")
 
-    if brand_ids:
-        query = query.filter(Product.brand_id.in_(brand_ids))
-    if min_price is not None and min_price >= 0:
-        query = query.filter(Product.price >= min_price)
-    if max_price is not None and max_price >= 0:
-        query = query.filter(Product.price <= max_price)
-    if search_query:
-        query = query.filter(Product.name.ilike(f"%{search_query}%"))
-
-    # 2. Применяем фильтрацию по JSON (Python-level для совместимости)
-    if slug and request.args:
-        query = filter_products_by_specs(query, request.args)
-
-    # Сортировка
-    if sort_by == "price_desc":
-        query = query.order_by(Product.price.desc())
-    elif sort_by == "name_asc":
-        query = query.order_by(Product.name.asc())
-    else:
-        query = query.order_by(Product.price.asc())
+    # Счетчики брендов и характеристик и гистограмма цен — одним запросом (с кэшем)
+    filter_summary = FacetService.get_filter_summary(filters)
+    if slug:
+        dynamic_filters = FacetService.get_category_facets(
+            current_category.id, live_counts=filter_summary["specs"]
+        )
+
+    options = (
+        joinedload(Product.category),
+        joinedload(Product.brand),
+        joinedload(Product.primary_image),
+    )
 
-    # Пагинация
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    # Пагинация по курсору: сортировка всегда дополняется Product.id
+    if sort_by not in SORT_KEYS:
+        sort_by = "price_asc"
+    cursor = request.args.get("cursor")
+    # Колоночный снимок (если включен и готов), иначе — SQL
+    try:
+        pagination = CatalogEngine.paginate(
+            filters, sort_by, cursor=cursor, per_page=per_page, page=page, options=options
+        )
+    except ValueError:
+        pagination = CatalogEngine.paginate(
+            filters, sort_by, per_page=per_page, options=options
+        )
+    if pagination is None:
+        query = FacetService.apply_filters(Product.query, filters).options(*options)
+        try:
+            pagination = PaginationService.paginate(
+                query,
+                sort_by=sort_by,
+                cursor=cursor,
+                per_page=per_page,
+                page=page,
+            )
+        except ValueError:
+            pagination = PaginationService.paginate(query, sort_by=sort_by, per_page=per_page)
     products = pagination.items
     products = add_first_image_to_products(products)
 
-    all_categories = get_cached_categories()
-    all_brands = get_cached_brands()
+    # Только бренды, которые есть среди товаров (и уже отмеченные), с количеством
+    brand_counts = filter_summary["brands"]
+    all_brands = [
+        (brand, brand_counts.get(brand.id, 0))
+        for brand in get_cached_brands()
+        if brand.id in brand_counts or brand.id in brand_ids
+    ]
 
     # Meta
     title = current_category.name if current_category else "Каталог"
@@ -126,15 +163,22 @@ def catalog(slug=None):
         title=title,
         products=products,
         pagination=pagination,
-        all_categories=all_categories,
+        root_categories=CategoryService.tree().roots,
         all_brands=all_brands,
         current_category=current_category,
         current_brand_ids=brand_ids, # передаем список
-        current_min_price=min_price,
-        current_max_price=max_price,
+        current_min_price=filters["min_price"],
+        current_max_price=filters["max_price"],
+        price_summary=filter_summary["price"],
         current_sort_by=sort_by,
+        wishlist_ids=WishlistService.ids_for_user(current_user),
         dynamic_filters=dynamic_filters, # Передаем фильтры в шаблон
-        request_args=request.args # Для сохранения состояния чекбоксов
+        request_args=request.args, # Для сохранения состояния чекбоксов
+        page_args={
+            key: values
+            for key, values in request.args.to_dict(flat=False).items()
+            if key not in ("page", "cursor")
+        },
     )
 
 
@@ -143,17 +187,36 @@ def catalog(slug=None):
 def wishlist():
     """Страница избранного"""
     # Получаем товары из списка желаний текущего пользователя
-    # Используем selectinload для оптимизации загрузки картинок
-    products = current_user.wishlist.options(selectinload(Product.images)).all()
+    # Главное изображение — одним JOIN, без коллекции images
+    products = current_user.wishlist.options(joinedload(Product.primary_image)).all()
 
     products = add_first_image_to_products(products)
 
     return render_template("wishlist.html", title="Избранное", products=products)
 
 
+def remember_viewed_product(product_id):
+    """Недавно просмотренные товары в сессии: последние 5 id, новый — первым."""
+    viewed = [viewed_id for viewed_id in session.get("viewed_products", []) if viewed_id != product_id]
+    viewed.insert(0, product_id)
+    session["viewed_products"] = viewed[:5]
+
+
 @main_bp.route("/product/<slug>")
 @main_bp.route("/product/id/<int:product_id>")
 def product(slug=None, product_id=None):
+    response = make_response(product_page(slug=slug, product_id=product_id))
+    # Страница из кэша браузера (304) — тоже просмотр; при рендере он учтен в product_page
+    if response.status_code == 304:
+        if product_id is None:
+            product_id = db.session.query(Product.id).filter_by(slug=slug).scalar()
+        if product_id is not None:
+            remember_viewed_product(product_id)
+    return response
+
+
+@conditional_get(product_validator, page_personalization)
+def product_page(slug=None, product_id=None):
     if slug:
         prod = (
             Product.query.filter_by(slug=slug)
@@ -174,35 +237,17 @@ def product(slug=None, product_id=None):
         .all()
     )
 
-    if "viewed_products" not in session:
-        session["viewed_products"] = []
-    viewed = session["viewed_products"]
-    if prod.id in viewed:
-        viewed.remove(prod.id)
-    viewed.insert(0, prod.id)
-    if len(viewed) > 5:
-        viewed.pop()
-    session.modified = True
+    remember_viewed_product(prod.id)
 
     review_form = ReviewForm()
-    reviews = (
-        prod.reviews.options(joinedload(Review.author))
-        .order_by(Review.created_at.desc())
-        .all()
-    )
-    avg_rating = (
-        db.session.query(func.avg(Review.rating))
-        .filter(Review.product_id == prod.id)
-        .scalar()
-        or 0
-    )
-    avg_rating = round(avg_rating, 1)
-
-    related_products = (
-        Product.query.options(selectinload(Product.images))
-        .filter(Product.category_id == prod.category_id, Product.id != prod.id)
-        .limit(4)
-        .all()
+    # Первая страница отзывов; остальные подгружаются через API по курсору
+    reviews, reviews_cursor = ReviewService.page(prod.id)
+    # Агрегаты хранятся в товаре и обновляются при записи отзывов
+    avg_rating = round(prod.rating_avg or 0, 1)
+
+    # Соседи по совместным покупкам предрасчитаны, добор — из той же категории
+    related_products = RecommendationService.related_products(
+        prod, limit=4, options=(joinedload(Product.primary_image),)
     )
     related_products = add_first_image_to_products(related_products)
 
@@ -211,11 +256,14 @@ def product(slug=None, product_id=None):
         title=prod.meta_title or prod.name,
         meta_description=prod.meta_description,
         product=prod,
+        product_category=CategoryService.tree().get(prod.category_id),
         images=images,
         review_form=review_form,
         reviews=reviews,
+        reviews_cursor=reviews_cursor,
         avg_rating=avg_rating,
         related_products=related_products,
+        wishlist_ids=WishlistService.ids_for_user(current_user),
     )
 
 
@@ -245,40 +293,34 @@ def add_review(slug=None, product_id=None):
         )
         db.session.add(review)
         db.session.commit()
-        cache.delete_memoized(product, slug=product.slug)
         flash("Спасибо за ваш отзыв!", "success")
         return redirect(url_for("main.product", slug=product.slug))
 
     images = (
-        ProductImage.query.filter_by(product_id=product_id)
+        ProductImage.query.filter_by(product_id=product.id)
         .order_by(ProductImage.sort_order)
         .all()
     )
-    reviews = product.reviews.order_by(Review.created_at.desc()).all()
-    avg_rating = (
-        db.session.query(func.avg(Review.rating))
-        .filter(Review.product_id == product_id)
-        .scalar()
-        or 0
-    )
-    avg_rating = round(avg_rating, 1)
-    related_products = (
-        Product.query.options(selectinload(Product.images))
-        .filter(Product.category_id == product.category_id, Product.id != product.id)
-        .limit(4)
-        .all()
+    reviews, reviews_cursor = ReviewService.page(product.id)
+    avg_rating = round(product.rating_avg or 0, 1)
+    related_products = RecommendationService.related_products(
+        product, limit=4, options=(joinedload(Product.primary_image),)
     )
     related_products = add_first_image_to_products(related_products)
 
     return render_template(
         "product.html",
-        title=product.name,
+        title=product.meta_title or product.name,
+        meta_description=product.meta_description,
         product=product,
+        product_category=CategoryService.tree().get(product.category_id),
         images=images,
         review_form=form,
         reviews=reviews,
+        reviews_cursor=reviews_cursor,
         avg_rating=avg_rating,
         related_products=related_products,
+        wishlist_ids=WishlistService.ids_for_user(current_user),
     )
 
 
@@ -329,70 +371,40 @@ def track_order():
 
 @main_bp.route("/sitemap.xml")
 def sitemap():
-    pages = []
+    """Индекс sitemap: страницы сайта и шарды товаров по 50 тыс. URL."""
     base_url = request.url_root.rstrip("/")
-    static_routes = [
-        {
-            "loc": url_for("main.index", _external=True),
-            "priority": "1.0",
-            "changefreq": "daily",
-        },
-        {
-            "loc": url_for("main.catalog", _external=True),
-            "priority": "0.9",
-            "changefreq": "daily",
-        },
-        {
-            "loc": url_for("main.about", _external=True),
-            "priority": "0.5",
-            "changefreq": "monthly",
-        },
-        {
-            "loc": url_for("main.shipping", _external=True),
-            "priority": "0.5",
-            "changefreq": "monthly",
-        },
-        {
-            "loc": url_for("main.contact", _external=True),
-            "priority": "0.5",
-            "changefreq": "monthly",
-        },
-    ]
-    pages.extend(static_routes)
-    categories = get_cached_categories()
-    for category in categories:
-        pages.append(
-            {
-                "loc": url_for("main.catalog", slug=category.slug, _external=True),
-                "priority": "0.8",
-                "changefreq": "weekly",
-            }
-        )
-    # Для продуктов пока оставим без кэширования, так как их может быть много
-    products = Product.query.all()
-    for product in products:
-        pages.append(
-            {
-                "loc": url_for("main.product", slug=product.slug, _external=True),
-                "priority": "0.6",
-                "changefreq": "monthly",
-                "lastmod": datetime.utcnow().isoformat(),
-            }
-        )
-
-    sitemap_xml_template = """<?xml version="1.0" encoding="UTF-8"?>
-<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
-{% for page in pages %}<url>
-    <loc>{{ page.loc }}</loc>
-    {% if page.lastmod %}<lastmod>{{ page.lastmod }}</lastmod>{% endif %}
-    <changefreq>{{ page.changefreq }}</changefreq>
-    <priority>{{ page.priority }}</priority>
-</url>{% endfor %}
-</urlset>"""
-    sitemap_xml = render_template_string(sitemap_xml_template, pages=pages)
+    sitemap_xml, last_modified = SitemapService.render_index(base_url)
     response = make_response(sitemap_xml)
     response.headers["Content-Type"] = "application/xml"
-    return response
+    response.set_etag(hashlib.sha1(sitemap_xml.encode("utf-8")).hexdigest()[:20])
+    if last_modified:
+        response.last_modified = last_modified
+    return response.make_conditional(request)
+
+
+def send_sitemap_shard(shard):
+    if shard is None:
+        abort(404)
+    return send_file(
+        shard.path,
+        mimetype="application/xml",
+        conditional=True,
+        etag=shard.etag,
+        last_modified=shard.last_modified,
+        max_age=3600,
+    )
+
+
+@main_bp.route("/sitemap-pages.xml")
+def sitemap_pages():
+    return send_sitemap_shard(SitemapService.pages_shard(request.url_root.rstrip("/")))
+
+
+@main_bp.route("/sitemap-products-<int:number>.xml")
+def sitemap_products(number):
+    return send_sitemap_shard(
+        SitemapService.product_shard(number, request.url_root.rstrip("/"))
+    )
 
 
 @main_bp.app_errorhandler(404)
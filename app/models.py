@@ -5,7 +5,9 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import URLSafeTimedSerializer as Serializer
 from flask import current_app
 from sqlalchemy import event
-from slugify import slugify
+from sqlalchemy.dialects import mysql
+from itertools import chain
+from app.services.slug_service import SlugService
 
 # Таблица-связка для списка желаний (многие ко многим)
 wishlist_items = db.Table(
@@ -72,14 +74,27 @@ class Category(db.Model):
     name = db.Column(db.String(100), nullable=False, index=True)
     slug = db.Column(db.String(120), unique=True, index=True)
     parent_id = db.Column(db.Integer, db.ForeignKey("category.id"), nullable=True)
+    # Материализованный путь "1/5/12/": id предков и самой категории. Ведется
+    # CategoryService при записи категорий; поддерево — все пути с этим префиксом
+    path = db.Column(db.String(255), index=True)
+    parent = db.relationship(
+        "Category", remote_side=[id], backref=db.backref("children", lazy=True)
+    )
     products = db.relationship("Product", backref="category", lazy=True)
     meta_title = db.Column(db.String(255))
     meta_description = db.Column(db.String(255))
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
+        server_default=db.func.now(),
+    )
 
     def __str__(self):
+        # Родитель — через связь: загруженный вместе со списком не запрашивается повторно
         if self.parent_id:
-            parent = Category.query.get(self.parent_id)
-            return f"{parent.name} → {self.name}"
+            return f"{self.parent.name} → {self.name}"
         return self.name
 
     def __repr__(self):
@@ -111,10 +126,18 @@ class ProductImage(db.Model):
     image_url = db.Column(db.String(255), nullable=False)
     sort_order = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Производные (static/images/derivatives): SHA-1 файла и построенные ширины
+    content_hash = db.Column(db.String(40), index=True)
+    derivative_widths = db.Column(db.JSON)
     product = db.relationship(
         "Product", backref=db.backref("images", lazy=True, cascade="all, delete-orphan")
     )
 
+    __table_args__ = (
+        # Выбор главного изображения товара (Product.primary_image_id)
+        db.Index("idx_product_image_order", "product_id", "sort_order", "id"),
+    )
+
 
 # Модель Продукта
 class Product(db.Model):
@@ -138,14 +161,63 @@ class Product(db.Model):
     country = db.Column(db.String(100))      # Страна производства
     warranty = db.Column(db.String(50))      # Гарантия
     specifications = db.Column(db.JSON)      # JSON для хранения характеристик
+
+    # Агрегаты отзывов (поддерживаются RatingService при записи Review)
+    rating_avg = db.Column(db.Numeric(3, 2), nullable=False, default=0, server_default="0")
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_1 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_2 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_3 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_4 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_5 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
     
+    # Главное изображение для списков (первое по sort_order, id) — без загрузки
+    # всей коллекции images. Поддерживается ImageService.sync_primary_images
+    primary_image_id = db.Column(db.Integer)
+    primary_image = db.relationship(
+        "ProductImage",
+        primaryjoin="foreign(Product.primary_image_id) == ProductImage.id",
+        viewonly=True,
+    )
+
     reviews = db.relationship(
         "Review", backref="product", lazy="dynamic", cascade="all, delete-orphan"
     )
     meta_title = db.Column(db.String(255))
     meta_description = db.Column(db.String(255))
+    # Время последнего изменения (lastmod в sitemap, отпечатки шардов)
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
+        server_default=db.func.now(),
+    )
 
-    __table_args__ = (db.Index("idx_product_name", "name"),)
+    __table_args__ = (
+        db.Index("idx_product_name", "name"),
+        # Для seek-пагинации внутри категории: (категория, сортировка, id)
+        db.Index("idx_product_category_price", "category_id", "price", "id"),
+        db.Index("idx_product_category_name", "category_id", "name", "id"),
+        # Покрывающий индекс для счетчиков брендов в категории
+        db.Index("idx_product_category_brand", "category_id", "brand_id", "price"),
+        # Сортировка по рейтингу (sort_by=rating)
+        db.Index("idx_product_rating", "rating_avg", "id"),
+        db.Index("idx_product_category_rating", "category_id", "rating_avg", "id"),
+        # Покрывающий индекс для отпечатков шардов sitemap (диапазон id)
+        db.Index("idx_product_id_updated", "id", "updated_at"),
+    )
+
+    @property
+    def rating_histogram(self):
+        """Распределение оценок: [(звезды, кол-во, процент)] от 5 к 1."""
+        total = self.rating_count or 0
+        return [
+            (stars, count, round(count * 100 / total) if total else 0)
+            for stars, count in (
+                (stars, getattr(self, f"rating_{stars}") or 0) for stars in range(5, 0, -1)
+            )
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.sku})"
@@ -154,25 +226,116 @@ class Product(db.Model):
         return f"<Product {self.name}>"
 
 
-# Автоматическая генерация slug
-def generate_slug(target, value, oldvalue, initiator):
-    if value and (not target.slug or value != oldvalue):
-        base_slug = slugify(value)
-        counter = 1
-        slug = base_slug
-        model_class = target.__class__
-        while (
-            model_class.query.filter(model_class.id != target.id)
-            .filter_by(slug=slug)
-            .first()
-        ):
-            slug = f"{base_slug}-{counter}"
-            counter += 1
-        target.slug = slug
+# Автоматическая генерация slug: при записи, пачкой на весь flush
+SLUG_FALLBACKS = {Product: "product", Category: "category"}
+
+
+@event.listens_for(db.session, "before_flush")
+def generate_slugs(session, flush_context, instances):
+    """
+    Новым объектам без slug и переименованным (если slug построен не из
+    нового названия) назначает свободный slug. Явно заданный slug не
+    меняется. Все объекты flush получают slug одним запросом на модель
+    (SlugService.allocate), а не запросом на каждый кандидат суффикса.
+    """
+    pending, reserved = {}, {}
+    for obj in chain(session.new, session.dirty):
+        model_class = type(obj)
+        if model_class not in SLUG_FALLBACKS or obj in session.deleted or not obj.name:
+            continue
+        attrs = db.inspect(obj).attrs
+        if obj.slug and (obj in session.new or attrs.slug.history.has_changes()):
+            reserved.setdefault(model_class, set()).add(obj.slug)
+            continue
+        if obj.slug and not attrs.name.history.has_changes():
+            continue
+        base = SlugService.base_slug(obj.name, SLUG_FALLBACKS[model_class])
+        if SlugService.matches(obj.slug, base):
+            continue
+        pending.setdefault(model_class, []).append((obj, base))
+    for model_class, items in pending.items():
+        slugs = SlugService.allocate(
+            session.connection(),
+            model_class.__table__,
+            [base for _, base in items],
+            reserved=reserved.get(model_class, ()),
+        )
+        for (obj, _), slug in zip(items, slugs):
+            obj.slug = slug
+
+
+# Индекс фасетов: категория → группа → характеристика → значение → кол-во товаров
+class SpecFacet(db.Model):
+    __tablename__ = "spec_facet"
+    id = db.Column(db.Integer, primary_key=True)
+    category_id = db.Column(
+        db.Integer, db.ForeignKey("category.id"), nullable=False
+    )
+    spec_group = db.Column(db.String(100), nullable=False)
+    spec_key = db.Column(db.String(100), nullable=False)
+    spec_value = db.Column(db.String(255), nullable=False)
+    product_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint(
+            "category_id",
+            "spec_group",
+            "spec_key",
+            "spec_value",
+            name="uq_spec_facet_value",
+        ),
+    )
+
+    def __repr__(self):
+        return f"<SpecFacet {self.category_id}:{self.spec_group}/{self.spec_key}={self.spec_value}>"
 
 
-event.listen(Product.name, "set", generate_slug, retval=False)
-event.listen(Category.name, "set", generate_slug, retval=False)
+# Нормализованные характеристики товара (синхронизируются с Product.specifications)
+class ProductSpec(db.Model):
+    __tablename__ = "product_spec"
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(
+        db.Integer,
+        db.ForeignKey("product.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    spec_group = db.Column(db.String(100), nullable=False)
+    spec_key = db.Column(db.String(100), nullable=False)
+    spec_value = db.Column(db.String(255), nullable=False)
+
+    __table_args__ = (
+        db.Index(
+            "idx_product_spec_lookup",
+            "spec_group",
+            "spec_key",
+            "spec_value",
+            "product_id",
+        ),
+        db.Index("idx_product_spec_product", "product_id", "spec_group", "spec_key"),
+    )
+
+    def __repr__(self):
+        return f"<ProductSpec {self.product_id}:{self.spec_group}/{self.spec_key}={self.spec_value}>"
+
+
+# Инвертированный поисковый индекс: основа слова → товар с весом релевантности
+class SearchTerm(db.Model):
+    __tablename__ = "search_term"
+    # Бинарная сортировка в MySQL нужна для поиска по префиксу через диапазон
+    term = db.Column(
+        db.String(64).with_variant(mysql.VARCHAR(64, collation="utf8mb4_bin"), "mysql"),
+        primary_key=True,
+    )
+    product_id = db.Column(
+        db.Integer,
+        db.ForeignKey("product.id", ondelete="CASCADE"),
+        primary_key=True,
+        index=True,
+    )
+    weight = db.Column(db.Integer, nullable=False, default=1)
+
+    def __repr__(self):
+        return f"<SearchTerm {self.term} → {self.product_id}>"
 
 
 # Модель Отзыва
@@ -188,12 +351,30 @@ class Review(db.Model):
 
     __table_args__ = (
         db.Index("idx_review_user_product", "user_id", "product_id"),
+        # Страницы отзывов товара от новых к старым
+        db.Index("idx_review_product_created", "product_id", "created_at", "id"),
     )
 
     def __repr__(self):
         return f"<Review {self.id} for Product {self.product_id}>"
 
 
+# Предрасчитанные соседи товара по совместным покупкам (top-K по rank)
+class ProductRecommendation(db.Model):
+    __tablename__ = "product_recommendation"
+    product_id = db.Column(
+        db.Integer, db.ForeignKey("product.id", ondelete="CASCADE"), primary_key=True
+    )
+    rank = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    recommended_id = db.Column(
+        db.Integer, db.ForeignKey("product.id", ondelete="CASCADE"), nullable=False
+    )
+    score = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+        return f"<ProductRecommendation {self.product_id} #{self.rank} -> {self.recommended_id}>"
+
+
 # Модель Заказа
 class Order(db.Model):
     __tablename__ = "order"
@@ -239,6 +420,42 @@ class OrderItem(db.Model):
         return f"<OrderItem {self.id}>"
 
 
+# Дневные итоги продаж по статусу заказа (см. SalesStatsService)
+class SalesDaily(db.Model):
+    __tablename__ = "sales_daily"
+    day = db.Column(db.Date, primary_key=True)
+    status = db.Column(db.String(50), primary_key=True)
+    orders_count = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<SalesDaily {self.day} {self.status}: {self.orders_count}>"
+
+
+# Дневные продажи товара: штуки и сумма позиций заказов
+class ProductSalesDaily(db.Model):
+    __tablename__ = "product_sales_daily"
+    day = db.Column(db.Date, primary_key=True)
+    product_id = db.Column(
+        db.Integer, db.ForeignKey("product.id", ondelete="CASCADE"), primary_key=True, index=True
+    )
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<ProductSalesDaily {self.day} {self.product_id}: {self.units}>"
+
+
+# Число регистраций пользователей за день
+class SignupDaily(db.Model):
+    __tablename__ = "signup_daily"
+    day = db.Column(db.Date, primary_key=True)
+    users_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<SignupDaily {self.day}: {self.users_count}>"
+
+
 # МОДЕЛЬ КОРЗИНЫ
 class Cart(db.Model):
     __tablename__ = "cart"
@@ -292,4 +509,58 @@ class PromoCode(db.Model):
         return True, ""
 
     def __repr__(self):
-        return f"<PromoCode {self.code}>"
\ No newline at end of file
+        return f"<PromoCode {self.code}>"
+
+
+# Фоновый импорт товаров из CSV: прогресс и ошибки строк для админки
+class ImportJob(db.Model):
+    __tablename__ = "import_job"
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255), nullable=False)
+    # Загруженный файл в IMPORT_DIR (удаляется после обработки)
+    path = db.Column(db.String(500))
+    status = db.Column(db.String(20), nullable=False, default="pending", index=True)
+    size_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    processed_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    rows_processed = db.Column(db.Integer, nullable=False, default=0)
+    created_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_count = db.Column(db.Integer, nullable=False, default=0)
+    error_count = db.Column(db.Integer, nullable=False, default=0)
+    # Первые ошибки: [{"line": номер строки файла, "error": текст}]
+    errors = db.Column(db.JSON)
+    message = db.Column(db.Text)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    @property
+    def progress(self):
+        """Доля прочитанного файла в процентах."""
+        if self.status == "done":
+            return 100
+        if not self.size_bytes:
+            return 0
+        return min(100, int(self.processed_bytes * 100 / self.size_bytes))
+
+    def __repr__(self):
+        return f"<ImportJob {self.id} {self.status}>"
+
+
+# Фоновая выгрузка каталога в сжатый файл для скачивания из админки
+class ExportJob(db.Model):
+    __tablename__ = "export_job"
+    id = db.Column(db.Integer, primary_key=True)
+    format = db.Column(db.String(10), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="pending", index=True)
+    # Готовый .gz в EXPORT_DIR
+    path = db.Column(db.String(500))
+    rows_exported = db.Column(db.Integer, nullable=False, default=0)
+    size_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    message = db.Column(db.Text)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    finished_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f"<ExportJob {self.id} {self.format} {self.status}>"
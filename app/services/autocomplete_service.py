@@ -0,0 +1,396 @@
+import heapq
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from flask import current_app, url_for
+from sqlalchemy import func
+from app import db, celery, cache
+from app.models import Product, OrderItem
+from app.services.search_service import SearchService
+from app.utils import get_catalog_version, on_catalog_change, enqueue_task
+
+SHORT_PREFIX_LENGTH = 3
+SHORT_PREFIX_TOP = 10
+CHECK_INTERVAL = 5  # секунд между проверками новой версии снимка
+REBUILD_DELAY = 30  # секунд: несколько изменений каталога подряд дают одну пересборку
+BUILD_CHUNK_SIZE = 10000
+NAMES_BLOCK_SIZE = 64
+# Массивы индекса, которые пишутся в снимок отдельными файлами
+ARRAYS = ("name_starts", "product_ids", "weights", "words")
+MAX_QUERY_TOKENS = 6
+TEXT_ENCODING = "cp1251"
+NON_WORD_RE = re.compile(r"[^0-9a-zа-я]")
+ALPHABETS = {
+    "ru": "абвгдежзийклмнопрстуфхцчшщъыьэюя",
+    "en": "abcdefghijklmnopqrstuvwxyz",
+}
+
+
+def normalize(text):
+    """Нижний регистр, ё → е, все, кроме букв и цифр, → одиночный пробел."""
+    return " ".join(NON_WORD_RE.sub(" ", text.lower().replace("ё", "е")).split())
+
+
+def edits1(word):
+    """Все слова на расстоянии одной правки (удаление, перестановка, замена, вставка)."""
+    letters = ALPHABETS["ru"] if re.search(r"[а-я]", word) else ALPHABETS["en"]
+    splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+    deletes = [left + right[1:] for left, right in splits if right]
+    transposes = [
+        left + right[1] + right[0] + right[2:] for left, right in splits if len(right) > 1
+    ]
+    replaces = [left + c + right[1:] for left, right in splits if right for c in letters]
+    inserts = [left + c + right for left, right in splits for c in letters]
+    return set(deletes + transposes + replaces + inserts) - {word}
+
+
+class PrefixIndex:
+    """
+    Компактный индекс автодополнения для одного процесса.
+
+    Нормализованные названия склеены в одну строку байт cp1251 (после
+    нормализации в ней только цифры, латиница и кириллица — по байту на
+    символ). words — смещения начал слов, отсортированные по тексту от
+    слова до конца названия, поэтому префикс любого слова находится двумя
+    бинарными поисками. Исходные названия для ответа хранятся сжатыми
+    блоками, для коротких префиксов лучшие товары посчитаны заранее.
+    """
+
+    def __init__(self, version, text, name_starts, product_ids, weights, words, names, top_short):
+        self.version = version
+        self.text = text
+        self.name_starts = name_starts
+        self.product_ids = product_ids
+        self.weights = weights
+        self.words = words
+        self.names = names
+        self.top_short = top_short
+
+    @classmethod
+    def build(cls, version, rows):
+        """rows — итерируемые тройки (product_id, name, weight)."""
+        text_parts, block, names = [], [], []
+        name_starts, product_ids, weights = array("I"), array("I"), array("f")
+        position = 0
+        for product_id, name, weight in rows:
+            name = " ".join((name or "").split())
+            normalized = normalize(name).encode(TEXT_ENCODING)
+            if not normalized:
+                continue
+            name_starts.append(position)
+            product_ids.append(product_id)
+            weights.append(weight)
+            text_parts.append(normalized)
+            position += len(normalized) + 1
+            block.append(name)
+            if len(block) == NAMES_BLOCK_SIZE:
+                names.append(zlib.compress("\n".join(block).encode()))
+                block = []
+        if block:
+            names.append(zlib.compress("\n".join(block).encode()))
+        text = b"\n".join(text_parts) + b"\n"
+        del text_parts
+
+        starts = [0] + [match.end() for match in re.finditer(rb"[ \n]", text[:-1])]
+        words = array(
+            "I", sorted(starts, key=lambda offset: text[offset:text.index(b"\n", offset)])
+        )
+        del starts
+        index = cls(version, text, name_starts, product_ids, weights, words, names, {})
+        index.top_short = index._build_top_short()
+        return index
+
+    def _build_top_short(self):
+        """Заранее считает лучшие товары для всех префиксов длиной 2–3 символа."""
+        buckets = {}
+        text = self.text
+        for offset in self.words:
+            name_index = self._name_index(offset)
+            item = (self.weights[name_index], -name_index)
+            for length in range(2, SHORT_PREFIX_LENGTH + 1):
+                prefix = text[offset:offset + length]
+                if len(prefix) < length or prefix[-1:] in (b" ", b"\n"):
+                    break
+                heap = buckets.setdefault(prefix, [])
+                if len(heap) < SHORT_PREFIX_TOP * 2:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+        top_short = {}
+        for prefix, heap in buckets.items():
+            ordered = array("I")
+            for _, negative_index in sorted(set(heap), reverse=True):
+                if -negative_index not in ordered:
+                    ordered.append(-negative_index)
+            top_short[prefix] = ordered[:SHORT_PREFIX_TOP]
+        return top_short
+
+    def _name_index(self, offset):
+        return bisect_right(self.name_starts, offset) - 1
+
+    def _text(self, name_index):
+        start = self.name_starts[name_index]
+        return self.text[start:self.text.index(b"\n", start)]
+
+    def _display_name(self, name_index):
+        block = zlib.decompress(self.names[name_index // NAMES_BLOCK_SIZE]).decode()
+        return block.split("\n")[name_index % NAMES_BLOCK_SIZE]
+
+    def _word_range(self, prefix):
+        length = len(prefix)
+
+        def key(offset):
+            return self.text[offset:offset + length]
+
+        low = bisect_left(self.words, prefix, key=key)
+        if low == len(self.words) or key(self.words[low]) != prefix:
+            return low, low
+        return low, bisect_right(self.words, prefix, low, key=key)
+
+    def _lookup(self, tokens, ranges, limit):
+        if len(tokens) == 1 and len(tokens[0]) <= SHORT_PREFIX_LENGTH:
+            return list(self.top_short.get(tokens[0], ()))[:limit]
+        low, high = min(ranges, key=lambda bounds: bounds[1] - bounds[0])
+        if low == high:
+            return []
+        candidates = {self._name_index(offset) for offset in self.words[low:high]}
+        if len(tokens) > 1:
+            candidates = [
+                name_index for name_index in candidates
+                if all(
+                    (b" " + self._text(name_index)).find(b" " + token) >= 0
+                    for token in tokens
+                )
+            ]
+        return heapq.nlargest(limit, candidates, key=lambda i: (self.weights[i], -i))
+
+    def complete(self, query, limit=5):
+        """Возвращает до limit пар (product_id, name), с учетом одной опечатки."""
+        tokens = [
+            token.encode(TEXT_ENCODING) for token in normalize(query).split()[:MAX_QUERY_TOKENS]
+        ]
+        if not tokens:
+            return []
+        ranges = [self._word_range(token) for token in tokens]
+        found = self._lookup(tokens, ranges, limit)
+        if len(found) < limit:
+            # Опечатка в одном из слов: пробуем варианты на расстоянии 1
+            fuzzy = set()
+            for position, token in enumerate(tokens):
+                if len(token) < 4:
+                    continue
+                for variant in edits1(token.decode(TEXT_ENCODING)):
+                    variant = variant.encode(TEXT_ENCODING)
+                    bounds = self._word_range(variant)
+                    if bounds[0] == bounds[1]:
+                        continue
+                    fuzzy.update(self._lookup(
+                        tokens[:position] + [variant] + tokens[position + 1:],
+                        ranges[:position] + [bounds] + ranges[position + 1:],
+                        limit,
+                    ))
+            fuzzy.difference_update(found)
+            found += heapq.nlargest(
+                limit - len(found), fuzzy, key=lambda i: (self.weights[i], -i)
+            )
+        return [(self.product_ids[i], self._display_name(i)) for i in found]
+
+    def save(self, path):
+        """
+        Записывает индекс в каталог path: текст и массивы — сырыми байтами
+        (.bin), сжатые блоки названий — одним файлом, остальное — в meta.json.
+        """
+        os.makedirs(path + ".tmp")
+        with open(os.path.join(path + ".tmp", "text.bin"), "wb") as text_file:
+            text_file.write(self.text)
+        for name in ARRAYS:
+            with open(os.path.join(path + ".tmp", f"{name}.bin"), "wb") as array_file:
+                getattr(self, name).tofile(array_file)
+        with open(os.path.join(path + ".tmp", "names.bin"), "wb") as names_file:
+            names_file.write(b"".join(self.names))
+        meta = {
+            "version": self.version,
+            "itemsizes": {name: getattr(self, name).itemsize for name in ARRAYS},
+            "name_blocks": [len(block) for block in self.names],
+            "top_short": {
+                prefix.decode(TEXT_ENCODING): list(ids) for prefix, ids in self.top_short.items()
+            },
+        }
+        with open(os.path.join(path + ".tmp", "meta.json"), "w", encoding="utf-8") as meta_file:
+            json.dump(meta, meta_file, ensure_ascii=False)
+        os.rename(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        """Читает индекс, записанный save(). Поврежденный снимок — ValueError."""
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as meta_file:
+            meta = json.load(meta_file)
+        with open(os.path.join(path, "text.bin"), "rb") as text_file:
+            text = text_file.read()
+        arrays = {}
+        for name, typecode in zip(ARRAYS, ("I", "I", "f", "I")):
+            values = array(typecode)
+            if values.itemsize != meta["itemsizes"][name]:
+                raise ValueError(f"Снимок записан на другой платформе: {name}")
+            with open(os.path.join(path, f"{name}.bin"), "rb") as array_file:
+                values.frombytes(array_file.read())
+            arrays[name] = values
+        with open(os.path.join(path, "names.bin"), "rb") as names_file:
+            data = names_file.read()
+        names, offset = [], 0
+        for length in meta["name_blocks"]:
+            names.append(data[offset:offset + length])
+            offset += length
+        top_short = {
+            prefix.encode(TEXT_ENCODING): array("I", ids)
+            for prefix, ids in meta["top_short"].items()
+        }
+        return cls(meta["version"], text, names=names, top_short=top_short, **arrays)
+
+    def memory_usage(self):
+        """Приблизительный объем памяти индекса в байтах."""
+        arrays = (self.name_starts, self.product_ids, self.weights, self.words)
+        total = len(self.text) + sum(item.itemsize * len(item) for item in arrays)
+        total += sum(len(block) for block in self.names)
+        total += sum(len(k) + v.itemsize * len(v) for k, v in self.top_short.items())
+        return total
+
+
+class AutocompleteService:
+    _index = None
+    _name = None  # каталог снимка, из которого загружен _index
+    _checked_at = 0
+    _lock = threading.Lock()
+    _url_prefix = None
+
+    @staticmethod
+    def snapshot_dir():
+        return current_app.config.get("AUTOCOMPLETE_SNAPSHOT_DIR") or os.path.join(
+            current_app.instance_path, "autocomplete"
+        )
+
+    @staticmethod
+    def build_snapshot():
+        """Строит индекс из БД и атомарно сохраняет версионированный снимок на диск."""
+        version = get_catalog_version()
+        sold = dict(
+            db.session.query(OrderItem.product_id, func.sum(OrderItem.quantity))
+            .group_by(OrderItem.product_id)
+        )
+        rows = (
+            (
+                product_id,
+                name,
+                math.log1p(sold.get(product_id) or 0) + (0.5 if in_stock else 0),
+            )
+            for product_id, name, in_stock in db.session.query(
+                Product.id, Product.name, Product.in_stock
+            ).yield_per(BUILD_CHUNK_SIZE)
+        )
+        index = PrefixIndex.build(version, rows)
+
+        directory = AutocompleteService.snapshot_dir()
+        os.makedirs(directory, exist_ok=True)
+        name = f"autocomplete-{version}-{time.time_ns()}"
+        index.save(os.path.join(directory, name))
+        pointer = os.path.join(directory, "current")
+        with open(pointer + ".tmp", "w") as current:
+            current.write(name)
+        os.replace(pointer + ".tmp", pointer)
+        # Старые снимки удаляем (процессы держат загруженный индекс в памяти)
+        for entry in os.listdir(directory):
+            if entry.startswith("autocomplete-") and entry != name:
+                path = os.path.join(directory, entry)
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+        return index
+
+    @staticmethod
+    def schedule_build(countdown=None):
+        """Ставит сборку снимка в очередь Celery, если она еще не запланирована."""
+        try:
+            if cache.add("autocomplete_rebuild_pending", 1, timeout=REBUILD_DELAY):
+                enqueue_task(build_autocomplete_snapshot, countdown=countdown)
+        except Exception as e:
+            current_app.logger.warning(f"Не удалось запланировать сборку автодополнения: {e}")
+
+    @classmethod
+    def get_index(cls):
+        """
+        Индекс текущего процесса или None, пока снимка нет. Не чаще раза в
+        CHECK_INTERVAL секунд проверяет, не появился ли на диске более новый
+        снимок. Отсутствующий снимок строит задача Celery, а не запрос.
+        """
+        if time.monotonic() - cls._checked_at < CHECK_INTERVAL:
+            return cls._index
+        with cls._lock:
+            if time.monotonic() - cls._checked_at < CHECK_INTERVAL:
+                return cls._index
+            cls._checked_at = time.monotonic()
+            directory = cls.snapshot_dir()
+            try:
+                with open(os.path.join(directory, "current")) as current:
+                    name = current.read().strip()
+            except OSError:
+                name = None
+            if not name:
+                cls.schedule_build()
+            elif cls._index is None or cls._name != name:
+                try:
+                    cls._index = PrefixIndex.load(os.path.join(directory, name))
+                    cls._name = name
+                except (OSError, ValueError, KeyError) as e:
+                    current_app.logger.warning(f"Снимок автодополнения недоступен: {e}")
+                    cls.schedule_build()
+        return cls._index
+
+    @staticmethod
+    def search_fallback(query, limit=5):
+        """Подсказки через общий поиск по БД — пока индекса нет или он недоступен."""
+        product_ids = SearchService.search_ids(query, limit=limit)
+        names = dict(
+            db.session.query(Product.id, Product.name).filter(Product.id.in_(product_ids))
+        )
+        return [
+            {"name": names[p_id], "url": url_for("main.product", product_id=p_id)}
+            for p_id in product_ids
+            if p_id in names
+        ]
+
+    @classmethod
+    def complete(cls, query, limit=5):
+        index = cls.get_index()
+        if index is None:
+            return cls.search_fallback(query, limit)
+        if cls._url_prefix is None:
+            cls._url_prefix = url_for("main.product", product_id=0)[:-1]
+        return [
+            {"name": name, "url": f"{cls._url_prefix}{product_id}"}
+            for product_id, name in index.complete(query, limit)
+        ]
+
+
+@on_catalog_change
+def schedule_autocomplete_rebuild(product_ids):
+    """Пересобирает снимок с задержкой, объединяя серию изменений в одну сборку."""
+    AutocompleteService.schedule_build(countdown=REBUILD_DELAY)
+
+
+@celery.task
+def build_autocomplete_snapshot():
+    """Фоновая задача Celery: новый снимок индекса автодополнения."""
+    cache.delete("autocomplete_rebuild_pending")
+    index = AutocompleteService.build_snapshot()
+    return len(index.product_ids)
@@ -1,57 +1,519 @@
-from flask import session
-from app.models import Cart, Product, ProductImage, db
+import uuid
+from flask import session, current_app
+from redis import Redis
+from redis.exceptions import WatchError
+from app import celery
+from app.models import Cart, Product, db
+from app.services.counter_service import CounterService
 from decimal import Decimal
+from sqlalchemy import select, update, delete, insert, bindparam, and_
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import joinedload
 
+CART_TABLE = Cart.__table__
+SESSION_CART_KEY = "cart"
+# Гостевая корзина в Redis: в cookie сессии только ее токен
+GUEST_TOKEN_KEY = "cart_token"
+USER_CART_KEY = "cart:user:{}"
+GUEST_CART_KEY = "cart:guest:{}"
+# Пользователи, чьи корзины изменились в Redis и еще не записаны в таблицу cart
+DIRTY_CARTS_KEY = "cart:dirty"
+# Служебное поле хэша: корзина пользователя уже загружена из таблицы
+# (пустая корзина тоже остается ключом, и таблица не перечитывается)
+LOADED_FIELD = "loaded"
+# Корзина пользователя долго без изменений вытесняется из Redis —
+# к этому времени она давно записана в таблицу и загрузится снова
+USER_CART_TTL = 30 * 24 * 3600
+FLUSH_BATCH_SIZE = 500
+
+
+class SqlCartStore:
+    """
+    Корзины пользователей — строки таблицы cart (каждое изменение —
+    транзакция), гостей — словарь {"product_id": {"quantity": n}} в сессии.
+    owner — id пользователя или None для гостя текущей сессии.
+    """
+
+    def lines(self, owner):
+        """{product_id: количество}."""
+        if owner is None:
+            return {
+                int(product_id): item["quantity"]
+                for product_id, item in session.get(SESSION_CART_KEY, {}).items()
+            }
+        return dict(
+            db.session.execute(
+                select(Cart.product_id, Cart.quantity).where(Cart.user_id == owner).order_by(Cart.id)
+            ).all()
+        )
+
+    def priced_lines(self, owner):
+        """[(product_id, количество, цена)] — для пользователя одним запросом с ценами."""
+        if owner is None:
+            return _with_prices(self.lines(owner))
+        return db.session.execute(
+            select(Cart.product_id, Cart.quantity, Product.price)
+            .join(Product, Product.id == Cart.product_id)
+            .where(Cart.user_id == owner)
+            .order_by(Cart.id)
+        ).all()
+
+    def positions(self, owner):
+        if owner is None:
+            return len(session.get(SESSION_CART_KEY, {}))
+        return db.session.query(db.func.count(Cart.id)).filter(Cart.user_id == owner).scalar() or 0
+
+    def add(self, owner, product_id, quantity):
+        """Прибавляет количество; True — позиция новая."""
+        if owner is None:
+            cart = session.get(SESSION_CART_KEY, {})
+            item = cart.setdefault(str(product_id), {"quantity": 0})
+            item["quantity"] += quantity
+            session[SESSION_CART_KEY] = cart
+            session.modified = True
+            return item["quantity"] == quantity
+        item = Cart.query.filter_by(user_id=owner, product_id=product_id).first()
+        if item:
+            item.quantity += quantity
+        else:
+            db.session.add(Cart(user_id=owner, product_id=product_id, quantity=quantity))
+        db.session.commit()
+        return item is None
+
+    def set(self, owner, product_id, quantity):
+        """Задает количество; возвращает изменение числа позиций (-1, 0 или 1)."""
+        if quantity <= 0:
+            return self.remove(owner, product_id)
+        if owner is None:
+            cart = session.get(SESSION_CART_KEY, {})
+            created = str(product_id) not in cart
+            cart[str(product_id)] = {"quantity": quantity}
+            session[SESSION_CART_KEY] = cart
+            session.modified = True
+            return int(created)
+        item = Cart.query.filter_by(user_id=owner, product_id=product_id).first()
+        if item:
+            item.quantity = quantity
+        else:
+            db.session.add(Cart(user_id=owner, product_id=product_id, quantity=quantity))
+        db.session.commit()
+        return int(item is None)
+
+    def remove(self, owner, product_id):
+        if owner is None:
+            cart = session.get(SESSION_CART_KEY, {})
+            removed = cart.pop(str(product_id), None) is not None
+            session.modified = True
+            return -int(removed)
+        # Одним DELETE, без загрузки позиции
+        deleted = Cart.query.filter_by(user_id=owner, product_id=product_id).delete()
+        db.session.commit()
+        return -deleted
+
+    def clear(self, owner):
+        if owner is None:
+            session.pop(SESSION_CART_KEY, None)
+            return
+        Cart.query.filter_by(user_id=owner).delete()
+        db.session.commit()
+
+    def merge(self, owner, lines):
+        """
+        Добавляет lines к корзине пользователя: остатки и текущие количества —
+        одним запросом, запись — одним INSERT с обновлением при совпадении
+        (user_id, product_id). Возвращает число измененных позиций.
+        """
+        rows = db.session.execute(
+            select(Product.id, Product.in_stock, Cart.quantity)
+            .outerjoin(Cart, and_(Cart.product_id == Product.id, Cart.user_id == owner))
+            .where(Product.id.in_(list(lines)))
+        ).all()
+        merged = _merge_quantities(
+            lines,
+            {product_id: quantity for product_id, _, quantity in rows if quantity is not None},
+            {product_id: in_stock for product_id, in_stock, _ in rows},
+        )
+        if merged:
+            _upsert_cart(
+                db.session.connection(),
+                [
+                    {"user_id": owner, "product_id": product_id, "quantity": quantity}
+                    for product_id, quantity in merged.items()
+                ],
+            )
+            db.session.commit()
+        return len(merged)
+
+    def flush(self, batch_size=FLUSH_BATCH_SIZE):
+        return 0  # Все изменения уже в таблице
+
+
+class RedisCartStore:
+    """
+    Корзины в хэшах Redis {product_id: количество}: изменение количества —
+    атомарный HINCRBY/HSET без транзакции в БД. Гостевые корзины истекают
+    через CART_GUEST_TTL после последнего изменения. Измененные корзины
+    пользователей отмечаются в DIRTY_CARTS_KEY, и периодическая задача
+    flush_carts переносит их в таблицу cart (надежность и админка). Корзина
+    пользователя, которой нет в Redis, загружается из таблицы.
+    """
+
+    def __init__(self, client, guest_ttl):
+        self.client = client
+        self.guest_ttl = guest_ttl
+
+    def _key(self, owner, create=False):
+        if owner is not None:
+            return USER_CART_KEY.format(owner)
+        token = session.get(GUEST_TOKEN_KEY)
+        if token is None:
+            if not create:
+                return None
+            token = session[GUEST_TOKEN_KEY] = uuid.uuid4().hex
+        return GUEST_CART_KEY.format(token)
+
+    def _ttl(self, owner):
+        return USER_CART_TTL if owner is not None else self.guest_ttl
+
+    def _load(self, owner, key):
+        """Заполняет корзину пользователя из таблицы, если ее еще нет в Redis."""
+        if owner is None or self.client.exists(key):
+            return
+        rows = db.session.execute(
+            select(Cart.product_id, Cart.quantity).where(Cart.user_id == owner)
+        ).all()
+        with self.client.pipeline() as pipe:
+            try:
+                # Запись только если ключ не появился за время чтения таблицы
+                pipe.watch(key)
+                if pipe.exists(key):
+                    return
+                pipe.multi()
+                pipe.hset(key, mapping={LOADED_FIELD: 1, **{str(product_id): quantity for product_id, quantity in rows}})
+                pipe.expire(key, USER_CART_TTL)
+                pipe.execute()
+            except WatchError:
+                pass  # Корзину одновременно загрузил другой запрос
+
+    def _write(self, owner, key, changes):
+        """
+        Изменение хэша, продление TTL и отметка для записи в таблицу — одной
+        транзакцией. changes(pipe) возвращает команды [(команда, *аргументы)]
+        (пустой список — ничего не менять); результат — ответ первой из них.
+        Корзина пользователя меняется под WATCH и только существующая: если
+        ключ истек после загрузки, корзина загружается из таблицы заново —
+        иначе команда создала бы хэш без остальных позиций, и flush_carts
+        удалил бы их из таблицы. Отметка о загрузке — HSETNX в той же транзакции.
+        """
+        while True:
+            self._load(owner, key)
+            with self.client.pipeline() as pipe:
+                try:
+                    if owner is not None:
+                        pipe.watch(key)
+                        if not pipe.exists(key):
+                            continue  # Истекла после загрузки
+                    commands = changes(pipe)
+                    if not commands:
+                        return None
+                    pipe.multi()
+                    if owner is not None:
+                        pipe.hsetnx(key, LOADED_FIELD, 1)
+                    for command, *args in commands:
+                        getattr(pipe, command)(key, *args)
+                    pipe.expire(key, self._ttl(owner))
+                    if owner is not None:
+                        pipe.sadd(DIRTY_CARTS_KEY, owner)
+                    return pipe.execute()[owner is not None]
+                except WatchError:
+                    continue  # Корзину одновременно изменил другой запрос
+
+    def lines(self, owner):
+        key = self._key(owner)
+        if key is None:
+            return {}
+        self._load(owner, key)
+        return _decode(self.client.hgetall(key))
+
+    def priced_lines(self, owner):
+        return _with_prices(self.lines(owner))
+
+    def positions(self, owner):
+        key = self._key(owner)
+        if key is None:
+            return 0
+        self._load(owner, key)
+        return self.client.hlen(key) - (owner is not None)
+
+    def add(self, owner, product_id, quantity):
+        key = self._key(owner, create=True)
+        return self._write(owner, key, lambda pipe: [("hincrby", product_id, quantity)]) == quantity
+
+    def set(self, owner, product_id, quantity):
+        if quantity <= 0:
+            return self.remove(owner, product_id)
+        key = self._key(owner, create=True)
+        return self._write(owner, key, lambda pipe: [("hset", product_id, quantity)])
+
+    def remove(self, owner, product_id):
+        key = self._key(owner)
+        if key is None:
+            return 0
+        return -self._write(owner, key, lambda pipe: [("hdel", product_id)])
+
+    def clear(self, owner):
+        key = self._key(owner)
+        if key is None:
+            return
+        if owner is None:
+            session.pop(GUEST_TOKEN_KEY, None)
+        with self.client.pipeline() as pipe:
+            pipe.delete(key)
+            if owner is not None:
+                # Пустая, но загруженная корзина: таблица очистится при записи
+                pipe.hset(key, LOADED_FIELD, 1)
+                pipe.expire(key, USER_CART_TTL)
+                pipe.sadd(DIRTY_CARTS_KEY, owner)
+            pipe.execute()
+
+    def merge(self, owner, lines):
+        """Добавляет lines к корзине пользователя в Redis; остатки — одним запросом."""
+        key = self._key(owner)
+        stock = dict(
+            db.session.execute(
+                select(Product.id, Product.in_stock).where(Product.id.in_(list(lines)))
+            ).all()
+        )
+        merged = {}
+
+        def changes(pipe):
+            # Текущее содержимое — под WATCH, чтобы не затереть параллельное изменение
+            merged.clear()
+            merged.update(_merge_quantities(lines, _decode(pipe.hgetall(key)), stock))
+            if not merged:
+                return []
+            return [("hset", None, None, {str(product_id): quantity for product_id, quantity in merged.items()})]
+
+        self._write(owner, key, changes)
+        return len(merged)
+
+    def flush(self, batch_size=FLUSH_BATCH_SIZE):
+        """Переносит измененные корзины пользователей в таблицу cart. Возвращает их число."""
+        flushed = 0
+        while True:
+            user_ids = [int(user_id) for user_id in self.client.spop(DIRTY_CARTS_KEY, batch_size) or []]
+            if not user_ids:
+                return flushed
+            try:
+                self.persist(user_ids)
+            except Exception:
+                db.session.rollback()
+                # Вернем отметки: корзины запишутся при следующем запуске
+                self.client.sadd(DIRTY_CARTS_KEY, *user_ids)
+                raise
+            flushed += len(user_ids)
+
+    def persist(self, user_ids):
+        """
+        Приводит строки таблицы cart к содержимому Redis для user_ids одной
+        транзакцией. Отметка снимается до чтения хэшей, поэтому изменение во
+        время записи снова отметит корзину. Корзины, которых нет в Redis, не трогаются.
+        """
+        with self.client.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.hgetall(USER_CART_KEY.format(user_id))
+            carts = {
+                user_id: _decode(values) for user_id, values in zip(user_ids, pipe.execute()) if values
+            }
+        if not carts:
+            return
+        # Удаленные из каталога товары в таблицу не попадают
+        wanted = {product_id for lines in carts.values() for product_id in lines}
+        existing_products = set(
+            db.session.execute(select(Product.id).where(Product.id.in_(wanted))).scalars()
+        ) if wanted else set()
+        current = {
+            (user_id, product_id): (row_id, quantity)
+            for row_id, user_id, product_id, quantity in db.session.execute(
+                select(Cart.id, Cart.user_id, Cart.product_id, Cart.quantity).where(
+                    Cart.user_id.in_(list(carts))
+                )
+            )
+        }
+        inserts, updates = [], []
+        for user_id, lines in carts.items():
+            for product_id, quantity in lines.items():
+                if product_id not in existing_products:
+                    continue
+                row = current.pop((user_id, product_id), None)
+                if row is None:
+                    inserts.append({"user_id": user_id, "product_id": product_id, "quantity": quantity})
+                elif row[1] != quantity:
+                    updates.append({"row_id": row[0], "new_quantity": quantity})
+        stale = [row_id for row_id, _ in current.values()]
+        connection = db.session.connection()
+        if stale:
+            connection.execute(delete(CART_TABLE).where(CART_TABLE.c.id.in_(stale)))
+        if updates:
+            connection.execute(
+                update(CART_TABLE)
+                .where(CART_TABLE.c.id == bindparam("row_id"))
+                .values(quantity=bindparam("new_quantity")),
+                updates,
+            )
+        if inserts:
+            connection.execute(insert(CART_TABLE), inserts)
+        db.session.commit()
+
+
+def _merge_quantities(lines, current, stock):
+    """
+    Новые количества после слияния: сумма, но не больше остатка и не
+    меньше уже лежавшего в корзине. Только изменившиеся позиции;
+    товары без остатка или удаленные пропускаются.
+    """
+    merged = {}
+    for product_id, quantity in lines.items():
+        if product_id not in stock:
+            continue
+        existing = current.get(product_id, 0)
+        target = max(existing, min(existing + quantity, stock[product_id] or 0))
+        if target > 0 and target != existing:
+            merged[product_id] = target
+    return merged
+
+
+def _upsert_cart(connection, rows):
+    """
+    Один многострочный INSERT в cart с заменой количества при совпадении
+    unique_user_product: ON DUPLICATE KEY UPDATE в MySQL, ON CONFLICT в SQLite.
+    """
+    if connection.dialect.name == "mysql":
+        statement = mysql_insert(CART_TABLE).values(rows)
+        statement = statement.on_duplicate_key_update(quantity=statement.inserted.quantity)
+    else:
+        statement = sqlite_insert(CART_TABLE).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=["user_id", "product_id"],
+            set_={"quantity": statement.excluded.quantity},
+        )
+    connection.execute(statement)
+
+
+def _decode(values):
+    lines = {}
+    for field, quantity in values.items():
+        field = field.decode() if isinstance(field, bytes) else field
+        if field != LOADED_FIELD and int(quantity) > 0:
+            lines[int(field)] = int(quantity)
+    return lines
+
+
+def _with_prices(lines):
+    """[(product_id, количество, цена)] одним запросом цен; удаленные товары пропускаются."""
+    if not lines:
+        return []
+    prices = dict(
+        db.session.execute(select(Product.id, Product.price).where(Product.id.in_(list(lines)))).all()
+    )
+    return [
+        (product_id, quantity, prices[product_id])
+        for product_id, quantity in lines.items()
+        if product_id in prices
+    ]
+
+
+SQL_STORE = SqlCartStore()
+
+
 class CartService:
+    @staticmethod
+    def store():
+        """
+        Хранилище корзин по CART_BACKEND: "sql" (по умолчанию) или "redis".
+        Клиент Redis создается по CART_REDIS_URL; тесты могут положить свой
+        (например fakeredis.FakeRedis()) в app.extensions["cart_redis"].
+        """
+        if current_app.config.get("CART_BACKEND", "sql") != "redis":
+            return SQL_STORE
+        client = current_app.extensions.get("cart_redis")
+        if client is None:
+            client = current_app.extensions["cart_redis"] = Redis.from_url(
+                current_app.config["CART_REDIS_URL"]
+            )
+        return RedisCartStore(client, current_app.config.get("CART_GUEST_TTL", 7 * 24 * 3600))
+
+    @staticmethod
+    def owner(user):
+        return user.id if user.is_authenticated else None
+
+    @staticmethod
+    def _main_image(product):
+        # То же главное изображение, что и в каталоге (Product.primary_image)
+        return product.primary_image.image_url if product.primary_image else "default_product.png"
+
     @staticmethod
     def get_cart_items(user):
         """
         Возвращает стандартизированный список элементов корзины и общую сумму.
-        Устраняет проблему N+1 с помощью joinedload.
+        Товары со своими главными изображениями — одним запросом.
         """
         total_price = Decimal("0.00")
         standardized_items = []
 
-        if user.is_authenticated:
-            # Оптимизированный запрос: загружаем продукт и его картинки за один раз
-            db_items = Cart.query.filter_by(user_id=user.id).options(
-                joinedload(Cart.product).joinedload(Product.images)
-            ).all()
-
-            for item in db_items:
-                main_img = next((img.image_url for img in item.product.images if img.sort_order == 0), "default_product.png")
+        lines = CartService.store().lines(CartService.owner(user))
+        if lines:
+            products = {
+                product.id: product
+                for product in Product.query.filter(Product.id.in_(list(lines)))
+                .options(joinedload(Product.primary_image))
+                .all()
+            }
+            for product_id, qty in lines.items():
+                product = products.get(product_id)
+                if product is None:
+                    continue  # Товар удален из каталога
+                subtotal = product.price * qty
                 standardized_items.append({
-                    "product": item.product,
-                    "quantity": item.quantity,
-                    "price": item.product.price,
-                    "image_url": main_img,
-                    "subtotal": item.product.price * item.quantity
+                    "product": product,
+                    "quantity": qty,
+                    "price": product.price,
+                    "image_url": CartService._main_image(product),
+                    "subtotal": subtotal
                 })
-                total_price += item.product.price * item.quantity
-        else:
-            # Логика для анонимных пользователей (сессии)
-            session_cart = session.get("cart", {})
-            if session_cart:
-                # Загружаем продукты из сессии одним запросом
-                product_ids = [int(p_id) for p_id in session_cart.keys()]
-                products = Product.query.filter(Product.id.in_(product_ids)).options(joinedload(Product.images)).all()
-                
-                for product in products:
-                    qty = session_cart[str(product.id)]["quantity"]
-                    main_img = next((img.image_url for img in product.images if img.sort_order == 0), "default_product.png")
-                    subtotal = product.price * qty
-                    standardized_items.append({
-                        "product": product,
-                        "quantity": qty,
-                        "price": product.price,
-                        "image_url": main_img,
-                        "subtotal": subtotal
-                    })
-                    total_price += subtotal
-                    
+                total_price += subtotal
+
         return standardized_items, total_price
 
+    @staticmethod
+    def summary(user_id):
+        """
+        Сводка корзины пользователя одним запросом (позиции с ценами товаров):
+        {"count": штук, "positions": позиций, "total": сумма,
+         "lines": [{"product_id", "quantity", "price", "subtotal"}, ...]}.
+        """
+        lines = [
+            {
+                "product_id": product_id,
+                "quantity": quantity,
+                "price": price,
+                "subtotal": price * quantity,
+            }
+            for product_id, quantity, price in CartService.store().priced_lines(user_id)
+        ]
+        return {
+            "count": sum(line["quantity"] for line in lines),
+            "positions": len(lines),
+            "total": sum((line["subtotal"] for line in lines), Decimal("0.00")),
+            "lines": lines,
+        }
+
+    @staticmethod
+    def guest_positions():
+        """Число позиций гостевой корзины (счетчик в шапке)."""
+        return CartService.store().positions(None)
+
     @staticmethod
     def add_item(user, product_id, quantity):
         """Добавляет товар в корзину с проверкой остатков."""
@@ -59,22 +521,51 @@ class CartService:
         if product.in_stock < quantity:
             return False, f"Недостаточно товара {product.name} (в наличии: {product.in_stock})"
 
-        if user.is_authenticated:
-            item = Cart.query.filter_by(user_id=user.id, product_id=product_id).first()
-            if item:
-                item.quantity += quantity
-            else:
-                item = Cart(user_id=user.id, product_id=product_id, quantity=quantity)
-                db.session.add(item)
-            db.session.commit()
-        else:
-            cart = session.get("cart", {})
-            p_id_str = str(product_id)
-            if p_id_str in cart:
-                cart[p_id_str]["quantity"] += quantity
-            else:
-                cart[p_id_str] = {"quantity": quantity}
-            session["cart"] = cart
-            session.modified = True
-            
-        return True, "Успешно добавлено"
\ No newline at end of file
+        # id — до коммита: после него обращение к user перечитало бы пользователя
+        owner = CartService.owner(user)
+        created = CartService.store().add(owner, product_id, quantity)
+        if created and owner is not None:
+            CounterService.adjust(owner, "cart", 1)
+
+        return True, "Успешно добавлено"
+
+    @staticmethod
+    def set_quantity(user_id, product_id, quantity):
+        """Задает количество (0 и меньше — удаление) с проверкой остатков."""
+        if quantity > 0:
+            product = Product.query.get_or_404(product_id)
+            if product.in_stock < quantity:
+                return False, "Недостаточно товара"
+        CounterService.adjust(user_id, "cart", CartService.store().set(user_id, product_id, quantity))
+        return True, "Корзина обновлена"
+
+    @staticmethod
+    def remove_item(user_id, product_id):
+        CounterService.adjust(user_id, "cart", CartService.store().remove(user_id, product_id))
+
+    @staticmethod
+    def clear(user_id):
+        """Очищает корзину пользователя (после оформления заказа)."""
+        CartService.store().clear(user_id)
+        CounterService.reset(user_id, "cart")
+
+    @staticmethod
+    def merge_guest_cart(user_id):
+        """Переносит гостевую корзину текущей сессии в корзину пользователя (при входе)."""
+        store = CartService.store()
+        lines = store.lines(None)
+        if lines:
+            store.merge(user_id, lines)
+            CounterService.reset(user_id, "cart")
+        store.clear(None)
+
+    @staticmethod
+    def flush():
+        """Записывает измененные в Redis корзины в таблицу cart."""
+        return CartService.store().flush()
+
+
+@celery.task
+def flush_carts():
+    """Фоновая задача Celery: запись корзин из Redis в таблицу cart."""
+    return CartService.flush()
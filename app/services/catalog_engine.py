@@ -0,0 +1,511 @@
+import json
+import os
+import shutil
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR
+from flask import current_app
+from app import db, celery, cache, cache_is_shared
+from app.models import Product, ProductSpec
+from app.services.pagination_service import KeysetPage, decode_cursor, encode_cursor
+from app.services.spec_service import SpecService
+from app.utils import on_catalog_change, enqueue_task
+
+try:
+    import numpy as np
+except ImportError:  # Движок необязательный: без NumPy каталог работает через SQL
+    np = None
+
+SEQ_KEY = "catalog_engine_seq"
+CHANGE_KEY = "catalog_engine_change_{}"
+CHANGE_TIMEOUT = 24 * 3600
+CHECK_INTERVAL = 2  # секунд между проверками новых изменений в процессе
+GAP_TIMEOUT = 10  # секунд ждем пропущенную запись журнала, затем считаем снимок устаревшим
+MAX_OVERLAY = 5000  # измененных строк поверх снимка, после которых нужна пересборка
+REBUILD_DELAY = 60
+BUILD_CHUNK_SIZE = 10000
+# Сортировки каталога: ключ -> (поле снимка, по убыванию)
+SORTS = {
+    "price_asc": ("price", False),
+    "price_desc": ("price", True),
+    "name_asc": ("name", False),
+    "name_desc": ("name", True),
+    "id_asc": ("id", False),
+    "id_desc": ("id", True),
+}
+
+
+def to_cents(price, rounding=ROUND_FLOOR):
+    return int((Decimal(str(price)) * 100).to_integral_value(rounding=rounding))
+
+
+class ColumnarSnapshot:
+    """
+    Колонки каталога одной версии в файлах .npy. Файлы открываются через
+    mmap только для чтения, поэтому воркеры gunicorn делят одни и те же
+    страницы памяти (page cache), а не держат по копии.
+
+    Характеристики закодированы словарем: для каждой тройки
+    (группа, характеристика, значение) хранится список номеров строк.
+    """
+
+    ARRAYS = (
+        "id", "price", "category", "brand", "stock", "order_price", "order_name",
+        "names", "name_offsets", "spec_postings", "spec_offsets",
+    )
+
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as meta_file:
+            meta = json.load(meta_file)
+        self.path = path
+        self.seq = meta["seq"]
+        for name in self.ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+        self.vocabulary = {tuple(entry): i for i, entry in enumerate(meta["specs"])}
+
+    def __len__(self):
+        return len(self.id)
+
+    def name(self, row):
+        start, end = self.name_offsets[row], self.name_offsets[row + 1]
+        return bytes(self.names[start:end]).decode()
+
+    def row_of(self, product_id):
+        """Номер строки товара в снимке или None."""
+        row = int(np.searchsorted(self.id, product_id))
+        if row < len(self.id) and self.id[row] == product_id:
+            return row
+        return None
+
+    def spec_rows(self, group, key, value):
+        entry = self.vocabulary.get((group, key, value))
+        if entry is None:
+            return self.spec_postings[:0]
+        return self.spec_postings[self.spec_offsets[entry]:self.spec_offsets[entry + 1]]
+
+    @staticmethod
+    def build(directory, seq):
+        """
+        Читает товары и product_spec из БД порциями и записывает новый
+        снимок в отдельный каталог. Возвращает путь к нему.
+        """
+        ids, prices, categories, brands, stock, names = [], [], [], [], [], []
+        rows = (
+            db.session.query(
+                Product.id,
+                Product.price,
+                Product.category_id,
+                Product.brand_id,
+                Product.in_stock,
+                Product.name,
+            )
+            .order_by(Product.id)
+            .yield_per(BUILD_CHUNK_SIZE)
+        )
+        for product_id, price, category_id, brand_id, in_stock, name in rows:
+            ids.append(product_id)
+            prices.append(to_cents(price))
+            categories.append(category_id)
+            brands.append(brand_id)
+            stock.append(in_stock or 0)
+            names.append(name or "")
+
+        columns = {
+            "id": np.array(ids, dtype=np.int64),
+            "price": np.array(prices, dtype=np.int64),
+            "category": np.array(categories, dtype=np.int32),
+            "brand": np.array(brands, dtype=np.int32),
+            "stock": np.array(stock, dtype=np.int32),
+        }
+        columns["order_price"] = np.lexsort((columns["id"], columns["price"])).astype(np.int32)
+        columns["order_name"] = np.array(
+            sorted(range(len(ids)), key=lambda row: (names[row].casefold(), ids[row])),
+            dtype=np.int32,
+        )
+        encoded = [name.encode() for name in names]
+        columns["names"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        columns["name_offsets"] = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(name) for name in encoded], out=columns["name_offsets"][1:])
+        del names, encoded
+
+        # Словарь характеристик: строки product_spec уже упорядочены по индексу
+        vocabulary, postings, offsets = [], [], [0]
+        current, product_ids = None, []
+
+        def flush():
+            wanted = np.array(product_ids, dtype=np.int64)
+            rows = np.minimum(np.searchsorted(columns["id"], wanted), max(len(ids) - 1, 0))
+            rows = rows[columns["id"][rows] == wanted] if len(ids) else rows[:0]
+            vocabulary.append(list(current))
+            postings.append(rows.astype(np.int32))
+            offsets.append(offsets[-1] + len(rows))
+
+        spec_rows = (
+            db.session.query(
+                ProductSpec.spec_group,
+                ProductSpec.spec_key,
+                ProductSpec.spec_value,
+                ProductSpec.product_id,
+            )
+            .order_by(
+                ProductSpec.spec_group,
+                ProductSpec.spec_key,
+                ProductSpec.spec_value,
+                ProductSpec.product_id,
+            )
+            .yield_per(BUILD_CHUNK_SIZE)
+        )
+        for group, key, value, product_id in spec_rows:
+            if (group, key, value) != current:
+                if current is not None:
+                    flush()
+                current, product_ids = (group, key, value), []
+            product_ids.append(product_id)
+        if current is not None:
+            flush()
+        columns["spec_postings"] = (
+            np.concatenate(postings) if postings else np.zeros(0, dtype=np.int32)
+        )
+        columns["spec_offsets"] = np.array(offsets, dtype=np.int64)
+
+        path = os.path.join(directory, f"snapshot-{seq}-{time.time_ns()}")
+        os.makedirs(path + ".tmp")
+        for name, values in columns.items():
+            np.save(os.path.join(path + ".tmp", f"{name}.npy"), values)
+        with open(os.path.join(path + ".tmp", "meta.json"), "w", encoding="utf-8") as meta_file:
+            json.dump({"seq": seq, "specs": vocabulary}, meta_file, ensure_ascii=False)
+        os.rename(path + ".tmp", path)
+        return path
+
+
+class CatalogState:
+    """
+    Снимок плюс изменения поверх него в текущем процессе: alive скрывает
+    строки снимка, измененные после его сборки, а их актуальные версии
+    лежат в extra (словарь по id товара).
+    """
+
+    def __init__(self, snapshot, seq, alive, extra):
+        self.snapshot = snapshot
+        self.seq = seq
+        self.alive = alive
+        self.extra = extra
+        self.gap_since = None
+        self.stale = False
+
+    def apply(self, product_ids, seq):
+        """Новое состояние с перечитанными из БД товарами product_ids."""
+        alive = self.alive.copy()
+        extra = dict(self.extra)
+        product_ids = sorted(product_ids)
+        for product_id in product_ids:
+            extra.pop(product_id, None)
+            row = self.snapshot.row_of(product_id)
+            if row is not None:
+                alive[row] = False
+        for start in range(0, len(product_ids), BUILD_CHUNK_SIZE):
+            products = db.session.query(
+                Product.id,
+                Product.price,
+                Product.category_id,
+                Product.brand_id,
+                Product.in_stock,
+                Product.name,
+                Product.specifications,
+            ).filter(Product.id.in_(product_ids[start:start + BUILD_CHUNK_SIZE]))
+            for product_id, price, category_id, brand_id, in_stock, name, specs in products:
+                extra[product_id] = {
+                    "id": product_id,
+                    "price": to_cents(price),
+                    "category": category_id,
+                    "brand": brand_id,
+                    "stock": in_stock or 0,
+                    "name": name or "",
+                    "specs": set(SpecService.iter_spec_values(specs)),
+                }
+        return CatalogState(self.snapshot, seq, alive, extra)
+
+    @property
+    def overlay_size(self):
+        return len(self.alive) - int(np.count_nonzero(self.alive)) + len(self.extra)
+
+    def _mask(self, filters):
+        snapshot = self.snapshot
+        mask = self.alive.copy()
+        if filters["category_id"]:
+            mask &= np.isin(snapshot.category, filters["category_ids"])
+        if filters["brand_ids"]:
+            mask &= np.isin(snapshot.brand, filters["brand_ids"])
+        if filters["min_price"] is not None:
+            mask &= snapshot.price >= to_cents(filters["min_price"], ROUND_CEILING)
+        if filters["max_price"] is not None:
+            mask &= snapshot.price <= to_cents(filters["max_price"])
+        for (group, key), values in filters["specs"].items():
+            matches = np.zeros(len(mask), dtype=bool)
+            for value in values:
+                matches[snapshot.spec_rows(group, key, value)] = True
+            mask &= matches
+        return mask
+
+    @staticmethod
+    def _matches(row, filters):
+        if filters["category_id"] and row["category"] not in filters["category_ids"]:
+            return False
+        if filters["brand_ids"] and row["brand"] not in filters["brand_ids"]:
+            return False
+        if filters["min_price"] is not None and row["price"] < to_cents(filters["min_price"], ROUND_CEILING):
+            return False
+        if filters["max_price"] is not None and row["price"] > to_cents(filters["max_price"]):
+            return False
+        return all(
+            any((group, key, value) in row["specs"] for value in values)
+            for (group, key), values in filters["specs"].items()
+        )
+
+    def select(self, filters, field):
+        """
+        Товары, прошедшие фильтры, в порядке возрастания поля field:
+        (строки снимка, отсортированный список extra, функция ключа строки снимка).
+        """
+        snapshot = self.snapshot
+        mask = self._mask(filters)
+        if field == "id":
+            base = np.flatnonzero(mask)
+            base_key = lambda row: (int(snapshot.id[row]),)
+            extra_key = lambda item: (item["id"],)
+        else:
+            order = snapshot.order_price if field == "price" else snapshot.order_name
+            base = order[mask[order]]
+            if field == "price":
+                base_key = lambda row: (int(snapshot.price[row]), int(snapshot.id[row]))
+                extra_key = lambda item: (item["price"], item["id"])
+            else:
+                base_key = lambda row: (snapshot.name(row).casefold(), int(snapshot.id[row]))
+                extra_key = lambda item: (item["name"].casefold(), item["id"])
+        extra = sorted(
+            (item for item in self.extra.values() if self._matches(item, filters)),
+            key=extra_key,
+        )
+        return base, extra, base_key, extra_key
+
+
+class CatalogEngine:
+    """
+    Необязательный движок фильтрации и сортировки каталога по колоночному
+    снимку (CATALOG_ENGINE = "columnar"). Фильтры считаются векторными
+    масками NumPy, сортировки — готовыми перестановками снимка, а из БД
+    загружаются только товары запрошенной страницы. При любой проблеме
+    со снимком paginate возвращает None, и каталог идет по SQL-пути.
+    """
+
+    _state = None
+    _checked_at = 0
+    _lock = threading.Lock()
+
+    @staticmethod
+    def enabled():
+        # Журнал изменений (SEQ_KEY) должен быть виден всем процессам, иначе
+        # снимок не узнает о правках из других воркеров — тогда работает SQL
+        return (
+            np is not None
+            and current_app.config.get("CATALOG_ENGINE") == "columnar"
+            and cache_is_shared()
+        )
+
+    @staticmethod
+    def snapshot_dir():
+        return current_app.config.get("CATALOG_SNAPSHOT_DIR") or os.path.join(
+            current_app.instance_path, "catalog_snapshot"
+        )
+
+    @staticmethod
+    def build_snapshot():
+        """Собирает новый снимок и делает его текущим для всех процессов."""
+        directory = CatalogEngine.snapshot_dir()
+        os.makedirs(directory, exist_ok=True)
+        # Изменения после этого номера будут применены поверх снимка повторно
+        seq = cache.get(SEQ_KEY) or 0
+        path = ColumnarSnapshot.build(directory, seq)
+        pointer = os.path.join(directory, "current")
+        with open(pointer + ".tmp", "w") as current:
+            current.write(os.path.basename(path))
+        os.replace(pointer + ".tmp", pointer)
+        # Старые снимки удаляем (открытые через mmap файлы остаются доступны процессам)
+        for name in os.listdir(directory):
+            if name.startswith("snapshot-") and name != os.path.basename(path):
+                shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+        return path
+
+    @staticmethod
+    def schedule_rebuild():
+        try:
+            if cache.add("catalog_snapshot_rebuild_pending", 1, timeout=REBUILD_DELAY):
+                enqueue_task(build_catalog_snapshot, countdown=REBUILD_DELAY)
+        except Exception as e:
+            current_app.logger.warning(f"Не удалось запланировать сборку снимка каталога: {e}")
+
+    @classmethod
+    def get_state(cls):
+        now = time.monotonic()
+        if cls._state is not None and now - cls._checked_at < CHECK_INTERVAL:
+            return cls._state
+        with cls._lock:
+            if cls._state is None or time.monotonic() - cls._checked_at >= CHECK_INTERVAL:
+                cls._checked_at = time.monotonic()
+                try:
+                    cls._state = cls._refresh(cls._state)
+                except Exception as e:
+                    current_app.logger.warning(f"Снимок каталога недоступен: {e}")
+                    cls._state = None
+        return cls._state
+
+    @classmethod
+    def _refresh(cls, state):
+        directory = cls.snapshot_dir()
+        try:
+            with open(os.path.join(directory, "current")) as current:
+                path = os.path.join(directory, current.read().strip())
+        except OSError:
+            cls.schedule_rebuild()
+            return None
+        if state is None or state.snapshot.path != path:
+            snapshot = ColumnarSnapshot(path)
+            state = CatalogState(snapshot, snapshot.seq, np.ones(len(snapshot), dtype=bool), {})
+
+        seq = cache.get(SEQ_KEY) or 0
+        if seq < state.seq:
+            # Кэш очищен: журнал изменений потерян, снимку доверять нельзя
+            state.stale = True
+        if seq > state.seq:
+            keys = [CHANGE_KEY.format(number) for number in range(state.seq + 1, seq + 1)]
+            changed, applied = set(), 0
+            if len(keys) <= MAX_OVERLAY:
+                for entry in cache.get_many(*keys):
+                    if entry is None:
+                        break
+                    changed.update(entry)
+                    applied += 1
+            if applied:
+                gap_since = state.gap_since
+                state = state.apply(changed, state.seq + applied)
+                state.gap_since = gap_since
+            if state.seq < seq:
+                # Запись журнала еще не появилась или уже вытеснена из кэша
+                state.gap_since = state.gap_since or time.monotonic()
+                if time.monotonic() - state.gap_since > GAP_TIMEOUT:
+                    state.stale = True
+            else:
+                state.gap_since = None
+        if state.stale or state.overlay_size > MAX_OVERLAY:
+            cls.schedule_rebuild()
+        return state
+
+    @classmethod
+    def paginate(cls, filters, sort_by, cursor=None, per_page=24, page=None, options=()):
+        """
+        Страница каталога по снимку, совместимая с PaginationService.paginate.
+        None — движок выключен, снимок не готов или фильтр не поддерживается
+        (полнотекстовый поиск). Некорректный курсор — ValueError.
+        """
+        if not cls.enabled() or filters.get("search") or sort_by not in SORTS:
+            return None
+        state = cls.get_state()
+        if state is None or state.stale:
+            return None
+
+        field, descending = SORTS[sort_by]
+        base, extra, base_key, extra_key = state.select(filters, field)
+        extra_keys = [extra_key(item) for item in extra]
+        # Позиции extra в общей отсортированной последовательности
+        extra_positions = [
+            bisect_left(base, item_key, key=base_key) + i for i, item_key in enumerate(extra_keys)
+        ]
+        total = len(base) + len(extra)
+
+        def element(position):
+            if descending:
+                position = total - 1 - position
+            i = bisect_left(extra_positions, position)
+            if i < len(extra_positions) and extra_positions[i] == position:
+                return extra[i]["id"], extra[i]
+            row = int(base[position - i])
+            return int(state.snapshot.id[row]), row
+
+        def count(cursor_key, inclusive):
+            search = bisect_right if inclusive else bisect_left
+            return search(base, cursor_key, key=base_key) + search(extra_keys, cursor_key)
+
+        state_data = decode_cursor(cursor) if cursor else None
+        if state_data is not None and "o" in state_data:
+            try:
+                start = max(int(state_data["o"]), 0)
+            except (TypeError, ValueError) as e:
+                raise ValueError("Некорректный курсор") from e
+            state_data = None
+        else:
+            start = (max(page or 1, 1) - 1) * per_page
+        if state_data is not None and state_data.get("s") == sort_by:
+            try:
+                if field == "price":
+                    value = to_cents(state_data["v"])
+                elif field == "name":
+                    value = str(state_data["v"]).casefold()
+                cursor_key = (int(state_data["id"]),) if field == "id" else (value, int(state_data["id"]))
+            except (KeyError, TypeError, ValueError, ArithmeticError) as e:
+                raise ValueError("Некорректный курсор") from e
+            if state_data.get("d") == "prev":
+                end = total - count(cursor_key, True) if descending else count(cursor_key, False)
+                start = max(end - per_page, 0)
+            else:
+                start = total - count(cursor_key, False) if descending else count(cursor_key, True)
+        end = min(start + per_page, total)
+
+        window = [element(position) for position in range(start, end)]
+        product_ids = [product_id for product_id, _ in window]
+        products = {
+            product.id: product
+            for product in Product.query.options(*options).filter(Product.id.in_(product_ids))
+        }
+        items = [products[product_id] for product_id in product_ids if product_id in products]
+        current_page = start // per_page + 1
+
+        def cursor_for(product, direction):
+            value = product.id if field == "id" else getattr(product, field)
+            return encode_cursor({
+                "s": sort_by,
+                "v": str(value),
+                "id": product.id,
+                "d": direction,
+                "p": current_page,
+            })
+
+        return KeysetPage(
+            items,
+            current_page,
+            per_page,
+            total,
+            cursor_for(items[-1], "next") if end < total and items else None,
+            cursor_for(items[0], "prev") if start > 0 and items else None,
+        )
+
+
+@on_catalog_change
+def record_catalog_changes(product_ids):
+    """Журнал изменений для инкрементального обновления снимков в воркерах."""
+    if not product_ids or not CatalogEngine.enabled():
+        return
+    try:
+        seq = cache.cache.inc(SEQ_KEY)
+        if seq is None:
+            return
+        cache.set(CHANGE_KEY.format(seq), sorted(product_ids), timeout=CHANGE_TIMEOUT)
+    except Exception as e:
+        current_app.logger.warning(f"Не удалось записать изменения каталога: {e}")
+
+
+@celery.task
+def build_catalog_snapshot():
+    """Фоновая задача Celery: новый колоночный снимок каталога."""
+    cache.delete("catalog_snapshot_rebuild_pending")
+    return CatalogEngine.build_snapshot()
@@ -0,0 +1,233 @@
+import time
+import threading
+from itertools import chain
+from sqlalchemy import event, select, update, bindparam
+from sqlalchemy.orm.attributes import set_committed_value
+from flask import g, has_app_context
+from app import db, cache, cache_is_shared
+from app.models import Category
+
+CATEGORY_TABLE = Category.__table__
+TREE_VERSION_KEY = "category_tree_version"
+
+
+def build_paths(parents):
+    """
+    Материализованные пути по {id: parent_id}: "1/5/12/". Цикл в родителях
+    (категория вложена в собственную подкатегорию) — ValueError.
+    """
+    paths = {}
+    for category_id in parents:
+        chain_ids = []
+        current = category_id
+        while current is not None and current not in paths:
+            if current in chain_ids:
+                raise ValueError("Категория не может быть вложена в собственную подкатегорию")
+            chain_ids.append(current)
+            current = parents.get(current)
+        prefix = paths[current] if current is not None else ""
+        for node_id in reversed(chain_ids):
+            prefix = paths[node_id] = f"{prefix}{node_id}/"
+    return paths
+
+
+class CategoryNode:
+    """Категория в дереве: поля для ссылок и меню, родитель и дочерние узлы."""
+
+    __slots__ = ("id", "name", "slug", "parent_id", "path", "parent", "children")
+
+    def __init__(self, category_id, name, slug, parent_id, path):
+        self.id = category_id
+        self.name = name
+        self.slug = slug
+        self.parent_id = parent_id
+        self.path = path
+        self.parent = None
+        self.children = []
+
+    @property
+    def ancestors(self):
+        """Предки от корня до родителя — для хлебных крошек."""
+        ancestors = []
+        node = self.parent
+        while node is not None:
+            ancestors.append(node)
+            node = node.parent
+        ancestors.reverse()
+        return ancestors
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return f"<CategoryNode {self.name}>"
+
+
+class CategoryTree:
+    """
+    Дерево категорий одной версии: узлы по id и slug, корни и id поддеревьев.
+    Строится одним запросом и дальше не обращается к БД.
+    """
+
+    def __init__(self, rows):
+        self.nodes = [CategoryNode(*row) for row in rows]
+        self.by_id = {node.id: node for node in self.nodes}
+        self.by_slug = {node.slug: node for node in self.nodes if node.slug}
+        self.roots = []
+        for node in self.nodes:
+            parent = self.by_id.get(node.parent_id)
+            if parent is None:
+                self.roots.append(node)
+            else:
+                node.parent = parent
+                parent.children.append(node)
+        # В меню — по названию
+        order = lambda node: (node.name.casefold(), node.id)
+        self.roots.sort(key=order)
+        for node in self.nodes:
+            node.children.sort(key=order)
+        # id поддерева (сама категория и все потомки) — по префиксам путей
+        self.subtrees = {node.id: [] for node in self.nodes}
+        for node in self.nodes:
+            for ancestor_id in (node.path or f"{node.id}/").split("/")[:-1]:
+                subtree = self.subtrees.get(int(ancestor_id))
+                if subtree is not None:
+                    subtree.append(node.id)
+
+    def get(self, category_id):
+        return self.by_id.get(category_id)
+
+    def subtree_ids(self, category_id):
+        """id категории и всех ее потомков; неизвестная категория — только ее id."""
+        return self.subtrees.get(category_id) or [category_id]
+
+
+class CategoryService:
+    """
+    Дерево категорий в памяти процесса. Версия дерева хранится в кэше и
+    меняется после коммита, затронувшего категории; процесс перечитывает
+    дерево одним запросом, только когда версия сменилась. Без общего кэша
+    версии нет, и дерево читается один раз на запрос или задачу.
+    """
+
+    _tree = None
+    _version = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def current_version():
+        try:
+            if not cache_is_shared():
+                return None  # Смену версии в другом процессе здесь не увидеть
+            version = cache.get(TREE_VERSION_KEY)
+            if version is None:
+                version = time.time_ns()
+                cache.set(TREE_VERSION_KEY, version, timeout=0)
+            return version
+        except:
+            return None  # Без кэша дерево читается заново в каждом запросе
+
+    @staticmethod
+    def invalidate():
+        if has_app_context():
+            g.pop("category_tree", None)
+        try:
+            cache.set(TREE_VERSION_KEY, time.time_ns(), timeout=0)
+        except:
+            pass  # Игнорируем ошибку кэша
+
+    @classmethod
+    def tree(cls):
+        # Версия читается до запроса: изменение во время чтения даст новую версию
+        version = cls.current_version()
+        if version is None:
+            # Дерево из памяти процесса могло устареть — читаем заново, но
+            # не чаще одного раза в контексте приложения (запрос, задача)
+            if not has_app_context():
+                return cls._load()
+            if "category_tree" not in g:
+                g.category_tree = cls._load()
+            return g.category_tree
+        tree = cls._tree
+        if tree is not None and cls._version == version:
+            return tree
+        with cls._lock:
+            if cls._tree is not None and cls._version == version:
+                return cls._tree
+            tree = cls._load()
+            cls._tree, cls._version = tree, version
+        return tree
+
+    @staticmethod
+    def _load():
+        return CategoryTree(
+            db.session.execute(
+                select(
+                    Category.id, Category.name, Category.slug, Category.parent_id, Category.path
+                ).order_by(Category.id)
+            )
+        )
+
+    @staticmethod
+    def subtree_ids(category_id):
+        return CategoryService.tree().subtree_ids(category_id)
+
+    @staticmethod
+    def product_filter(column, category_id):
+        """Условие «товар в категории или ее потомках» — один IN по индексу category_id."""
+        return column.in_(CategoryService.subtree_ids(category_id))
+
+    @staticmethod
+    def sync_paths(connection):
+        """
+        Пересчитывает path всех категорий по parent_id и записывает
+        изменившиеся. Категорий немного, поэтому читается вся таблица —
+        так же переносятся поддеревья при смене родителя. Возвращает {id: path}.
+        """
+        rows = connection.execute(
+            select(CATEGORY_TABLE.c.id, CATEGORY_TABLE.c.parent_id, CATEGORY_TABLE.c.path)
+        ).all()
+        paths = build_paths({category_id: parent_id for category_id, parent_id, _ in rows})
+        changed = {category_id: paths[category_id] for category_id, _, path in rows if paths[category_id] != path}
+        if changed:
+            connection.execute(
+                update(CATEGORY_TABLE)
+                .where(CATEGORY_TABLE.c.id == bindparam("category_id"))
+                .values(path=bindparam("new_path")),
+                [{"category_id": category_id, "new_path": path} for category_id, path in changed.items()],
+            )
+        return changed
+
+
+@event.listens_for(db.session, "after_flush")
+def sync_category_paths(session, flush_context):
+    """Новые и перенесенные категории получают пути в той же транзакции."""
+    categories = [
+        obj for obj in chain(session.new, session.dirty, session.deleted) if isinstance(obj, Category)
+    ]
+    if not categories:
+        return
+    session.info["category_tree_changed"] = True
+    if not any(
+        obj in session.new
+        or db.inspect(obj).attrs.parent_id.history.has_changes()
+        or db.inspect(obj).attrs.parent.history.has_changes()
+        for obj in categories
+        if obj not in session.deleted
+    ):
+        return
+    changed = CategoryService.sync_paths(session.connection())
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, Category) and obj.id in changed:
+            set_committed_value(obj, "path", changed[obj.id])
+
+
+@event.listens_for(db.session, "after_rollback")
+def _discard_category_changes(session):
+    session.info.pop("category_tree_changed", None)
+
+
+@event.listens_for(db.session, "after_commit")
+def _publish_category_changes(session):
+    if session.info.pop("category_tree_changed", None):
+        CategoryService.invalidate()
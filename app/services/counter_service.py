@@ -0,0 +1,76 @@
+from sqlalchemy import func
+from app import db, cache
+from app.models import wishlist_items
+
+COUNTERS = ("cart", "wishlist")
+COUNTER_TIMEOUT = 24 * 3600
+
+
+class CounterService:
+    """
+    Счетчики для шапки сайта (позиции корзины и избранное) в кэше по
+    пользователю. Операции записи меняют их атомарным inc/dec после
+    коммита, шаблоны только читают. Если значения в кэше нет (истекло,
+    кэш очищен, запись сбросила его), оно пересчитывается одним COUNT.
+    """
+
+    @staticmethod
+    def cache_key(user_id, name):
+        return f"header_count_{name}_{user_id}"
+
+    @staticmethod
+    def _recount(user_id, name):
+        if name == "cart":
+            # Позиции — из настроенного хранилища корзин (таблица или Redis)
+            from app.services.cart_service import CartService
+
+            return CartService.store().positions(user_id)
+        query = db.session.query(func.count()).select_from(wishlist_items).filter(
+            wishlist_items.c.user_id == user_id
+        )
+        return query.scalar() or 0
+
+    @staticmethod
+    def get(user_id):
+        """{"cart": n, "wishlist": n} для пользователя."""
+        keys = [CounterService.cache_key(user_id, name) for name in COUNTERS]
+        try:
+            values = cache.get_many(*keys)
+        except:
+            values = [None] * len(keys)
+        counters = {}
+        for name, key, value in zip(COUNTERS, keys, values):
+            if value is None:
+                value = CounterService._recount(user_id, name)
+                try:
+                    cache.set(key, value, timeout=COUNTER_TIMEOUT)
+                except:
+                    pass  # Игнорируем ошибку кэша
+            counters[name] = int(value)
+        return counters
+
+    @staticmethod
+    def adjust(user_id, name, delta):
+        """
+        Меняет счетчик на delta (вызывать после коммита). Отсутствующий
+        счетчик не создается: его пересчитает следующее чтение.
+        """
+        if not delta:
+            return
+        key = CounterService.cache_key(user_id, name)
+        try:
+            if cache.has(key):
+                value = cache.cache.inc(key, delta)
+                if value is None or value < 0:
+                    cache.delete(key)
+        except:
+            pass  # Игнорируем ошибку кэша
+
+    @staticmethod
+    def reset(user_id, name=None):
+        """Сбрасывает счетчики после массовых изменений (оформление заказа, слияние корзин)."""
+        names = COUNTERS if name is None else (name,)
+        try:
+            cache.delete_many(*[CounterService.cache_key(user_id, n) for n in names])
+        except:
+            pass  # Игнорируем ошибку кэша
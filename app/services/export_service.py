@@ -0,0 +1,225 @@
+import os
+import io
+import csv
+import gzip
+import json
+from collections import defaultdict
+from datetime import datetime
+from urllib.parse import quote
+from flask import current_app
+from sqlalchemy import select, func
+from app import db, celery
+from app.models import Product, Category, Brand, ProductImage, ExportJob
+
+EXPORT_BATCH_SIZE = 1000
+# Сколько последних готовых файлов хранится в EXPORT_DIR
+KEEP_EXPORT_FILES = 5
+# Колонки совпадают с форматом импорта (image_urls при импорте игнорируется)
+EXPORT_COLUMNS = [
+    "id",
+    "name",
+    "slug",
+    "description",
+    "price",
+    "old_price",
+    "sku",
+    "in_stock",
+    "category_name",
+    "brand_name",
+    "meta_title",
+    "meta_description",
+    "country",
+    "warranty",
+    "specifications",
+    "image_urls",
+]
+
+
+def _csv_row(record):
+    specifications = record["specifications"]
+    values = dict(
+        record,
+        specifications=json.dumps(specifications, ensure_ascii=False) if specifications is not None else None,
+        image_urls=" ".join(record["image_urls"]),
+    )
+    return ["" if values[column] is None else values[column] for column in EXPORT_COLUMNS]
+
+
+def _json_value(value):
+    # Decimal — строкой, чтобы цена не теряла точность
+    return value if value is None or isinstance(value, (int, str, dict, list)) else str(value)
+
+
+def format_csv(batches):
+    """Куски CSV: заголовок и по одному куску на порцию товаров."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in batches:
+        writer.writerows(_csv_row(record) for record in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def format_jsonl(batches):
+    """Куски JSON Lines: объект товара на строку."""
+    for batch in batches:
+        yield "".join(
+            json.dumps({column: _json_value(record[column]) for column in EXPORT_COLUMNS}, ensure_ascii=False) + "\n"
+            for record in batch
+        )
+
+
+# Формат: (генератор кусков, MIME-тип, расширение файла)
+EXPORT_FORMATS = {
+    "csv": (format_csv, "text/csv", "csv"),
+    "jsonl": (format_jsonl, "application/x-ndjson", "jsonl"),
+}
+
+
+class ExportService:
+    @staticmethod
+    def export_dir():
+        return current_app.config.get("EXPORT_DIR") or os.path.join(
+            current_app.instance_path, "exports"
+        )
+
+    @staticmethod
+    def iter_batches(image_prefix, batch_size=EXPORT_BATCH_SIZE):
+        """
+        Товары порциями по первичному ключу (id > последнего): в памяти одна
+        порция, и между порциями соединение свободно для запроса изображений —
+        серверный курсор MySQL этого бы не позволил. Записи — словари
+        EXPORT_COLUMNS; image_urls — URL в порядке галереи.
+        """
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                select(
+                    Product.id,
+                    Product.name,
+                    Product.slug,
+                    Product.description,
+                    Product.price,
+                    Product.old_price,
+                    Product.sku,
+                    Product.in_stock,
+                    Category.name.label("category_name"),
+                    Brand.name.label("brand_name"),
+                    Product.meta_title,
+                    Product.meta_description,
+                    Product.country,
+                    Product.warranty,
+                    Product.specifications,
+                )
+                .outerjoin(Category, Category.id == Product.category_id)
+                .outerjoin(Brand, Brand.id == Product.brand_id)
+                .where(Product.id > last_id)
+                .order_by(Product.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                return
+            images = defaultdict(list)
+            for product_id, image_url in db.session.execute(
+                select(ProductImage.product_id, ProductImage.image_url)
+                .where(ProductImage.product_id.in_([row.id for row in rows]))
+                .order_by(
+                    ProductImage.product_id,
+                    func.coalesce(ProductImage.sort_order, 0),
+                    ProductImage.id,
+                )
+            ):
+                images[product_id].append(image_prefix + quote(image_url))
+            yield [dict(row._mapping, image_urls=images[row.id]) for row in rows]
+            last_id = rows[-1].id
+
+    @staticmethod
+    def stream(fmt, image_prefix):
+        """Генератор кусков выгрузки для потокового ответа."""
+        formatter = EXPORT_FORMATS[fmt][0]
+        return formatter(ExportService.iter_batches(image_prefix))
+
+    @staticmethod
+    def start(fmt, image_prefix, user_id=None):
+        """Ставит выгрузку в .gz в очередь Celery; при недоступной очереди — failed и исключение."""
+        job = ExportJob(format=fmt, user_id=user_id)
+        db.session.add(job)
+        db.session.commit()
+        try:
+            export_products.delay(job.id, image_prefix)
+        except Exception as e:
+            job.status, job.message, job.finished_at = "failed", f"Очередь задач недоступна: {e}", datetime.utcnow()
+            db.session.commit()
+            raise
+        return job
+
+    @staticmethod
+    def run(job_id, image_prefix):
+        """Пишет выгрузку во временный .gz и атомарно публикует его."""
+        job = db.session.get(ExportJob, job_id)
+        if job is None or job.status != "pending":
+            return None
+        job.status = "running"
+        db.session.commit()
+        directory = ExportService.export_dir()
+        os.makedirs(directory, exist_ok=True)
+        extension = EXPORT_FORMATS[job.format][2]
+        path = os.path.join(directory, f"products_export_{job.id}.{extension}.gz")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        rows = 0
+
+        def counted(batches):
+            nonlocal rows
+            for batch in batches:
+                rows += len(batch)
+                yield batch
+
+        try:
+            with gzip.open(tmp_path, "wt", encoding="utf-8", newline="") as out:
+                formatter = EXPORT_FORMATS[job.format][0]
+                for piece in formatter(counted(ExportService.iter_batches(image_prefix))):
+                    out.write(piece)
+            os.replace(tmp_path, path)
+            job.status, job.path, job.size_bytes = "done", path, os.path.getsize(path)
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.exception(f"Выгрузка {job_id} прервана")
+            job.status, job.message = "failed", f"Выгрузка прервана: {e}"
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        job.rows_exported, job.finished_at = rows, datetime.utcnow()
+        db.session.commit()
+        ExportService.remove_old_files()
+        return job
+
+    @staticmethod
+    def remove_old_files(keep=KEEP_EXPORT_FILES):
+        """Удаляет файлы готовых выгрузок, кроме keep последних."""
+        stale = (
+            ExportJob.query.filter(ExportJob.path.isnot(None))
+            .order_by(ExportJob.id.desc())
+            .offset(keep)
+            .all()
+        )
+        for job in stale:
+            try:
+                os.remove(job.path)
+            except OSError:
+                pass  # Файл уже удален
+            job.path = None
+        db.session.commit()
+
+    @staticmethod
+    def recent_jobs(limit=5):
+        return ExportJob.query.order_by(ExportJob.id.desc()).limit(limit).all()
+
+
+@celery.task
+def export_products(job_id, image_prefix):
+    """Фоновая задача Celery: выгрузка каталога в сжатый файл."""
+    job = ExportService.run(job_id, image_prefix)
+    return job.status if job else None
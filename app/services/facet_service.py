@@ -0,0 +1,416 @@
+import hashlib
+import json
+from collections import Counter
+from sqlalchemy import event, inspect, and_, not_, func
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import configure_mappers
+from app import db, celery, cache
+from app.models import Product, ProductSpec, SpecFacet
+from app.services.spec_service import SpecService
+from app.services.search_service import SearchService
+from app.services.category_service import CategoryService
+from app.utils import get_catalog_version
+
+FACET_TABLE = SpecFacet.__table__
+REBUILD_CHUNK_SIZE = 1000
+HISTOGRAM_BUCKETS = 10
+SUMMARY_CACHE_TIMEOUT = 300
+SUMMARY_COLUMNS = ("kind", "number", "spec_group", "spec_key", "spec_value", "count", "low", "high")
+
+
+class FacetService:
+    @staticmethod
+    def get_category_facets(category_id, live_counts=None):
+        """
+        Возвращает фасеты категории вместе с подкатегориями одним запросом
+        по индексу: {группа: {характеристика: [(значение, кол-во товаров), ...]}}.
+        Если переданы live_counts, количество берется из них (с учетом уже
+        примененных фильтров), а не из общего индекса.
+        """
+        columns = (SpecFacet.spec_group, SpecFacet.spec_key, SpecFacet.spec_value)
+        rows = (
+            db.session.query(*columns, func.sum(SpecFacet.product_count))
+            .filter(CategoryService.product_filter(SpecFacet.category_id, category_id))
+            .group_by(*columns)
+            .all()
+        )
+        facets = {}
+        for group, key, value, count in rows:
+            if live_counts is not None:
+                count = live_counts.get((group, key, value), 0)
+            facets.setdefault(group, {}).setdefault(key, []).append((value, count))
+        for group in facets:
+            for key in facets[group]:
+                facets[group][key].sort(key=lambda item: item[0])
+        return facets
+
+    @staticmethod
+    def apply_filters(query, filters, exclude=None):
+        """
+        Применяет к запросу товаров фильтры из parse_catalog_filters.
+        exclude — фасет, фильтр которого не применяется: "brand", "price"
+        или (группа, характеристика) — для дизъюнктивных счетчиков.
+        """
+        if filters["category_id"]:
+            query = query.filter(Product.category_id.in_(filters["category_ids"]))
+        if filters["brand_ids"] and exclude != "brand":
+            query = query.filter(Product.brand_id.in_(filters["brand_ids"]))
+        if exclude != "price":
+            if filters["min_price"] is not None:
+                query = query.filter(Product.price >= filters["min_price"])
+            if filters["max_price"] is not None:
+                query = query.filter(Product.price <= filters["max_price"])
+        if filters["search"]:
+            query = SearchService.filter_query(query, filters["search"])
+        spec_filters = {
+            spec: values for spec, values in filters["specs"].items() if spec != exclude
+        }
+        return SpecService.filter_query(query, spec_filters)
+
+    @staticmethod
+    def get_price_bounds(category_id=None):
+        """Минимальная и максимальная цена категории (границы гистограммы)."""
+        key = f"price_bounds_{category_id or 'all'}_{get_catalog_version()}"
+        try:
+            bounds = cache.get(key)
+        except:
+            bounds = None
+        if bounds is None:
+            query = db.session.query(func.min(Product.price), func.max(Product.price))
+            if category_id:
+                query = query.filter(CategoryService.product_filter(Product.category_id, category_id))
+            low, high = query.one()
+            bounds = (float(low or 0), float(high or 0))
+            try:
+                cache.set(key, bounds, timeout=SUMMARY_CACHE_TIMEOUT)
+            except:
+                pass  # Игнорируем ошибку кэша
+        return bounds
+
+    @staticmethod
+    def get_filter_summary(filters):
+        """
+        Сводка для боковой панели каталога при текущих фильтрах:
+        {"brands": {brand_id: кол-во}, "price": {"min", "max", "histogram"},
+         "specs": {(группа, характеристика, значение): кол-во} или None}.
+
+        Все счетчики дизъюнктивные (каждый фасет считается без собственного
+        фильтра) и собираются одним запросом UNION ALL из сгруппированных
+        частей. Результат кэшируется по нормализованным фильтрам и версии
+        каталога. specs равен None, если фильтров нет: тогда точные
+        значения уже есть в индексе фасетов.
+        """
+        cache_key = "filter_summary_" + hashlib.md5(
+            json.dumps(
+                [_filters_fingerprint(filters), get_catalog_version()], ensure_ascii=False
+            ).encode()
+        ).hexdigest()
+        try:
+            summary = cache.get(cache_key)
+        except:
+            summary = None
+        if summary is not None:
+            return summary
+
+        low, high = FacetService.get_price_bounds(filters["category_id"])
+        width = (high - low) / HISTOGRAM_BUCKETS or 1
+        with_specs = bool(filters["category_id"]) and any(
+            (
+                filters["brand_ids"],
+                filters["min_price"] is not None,
+                filters["max_price"] is not None,
+                filters["search"],
+                filters["specs"],
+            )
+        )
+
+        def part(kind, number, spec_columns, exclude, *criteria, group_by):
+            # Все части UNION ALL имеют одинаковый набор колонок
+            spec_columns = spec_columns or [
+                db.cast(db.null(), db.String(100)),
+                db.cast(db.null(), db.String(100)),
+                db.cast(db.null(), db.String(255)),
+            ]
+            price_columns = (
+                [func.min(Product.price), func.max(Product.price)]
+                if kind == "price"
+                else [db.cast(db.null(), Product.price.type)] * 2
+            )
+            columns = [db.literal(kind), number, *spec_columns, func.count(), *price_columns]
+            query = db.session.query(
+                *[column.label(name) for column, name in zip(columns, SUMMARY_COLUMNS)]
+            )
+            if spec_columns[0] is ProductSpec.spec_group:
+                query = query.select_from(ProductSpec).join(
+                    Product, Product.id == ProductSpec.product_id
+                )
+            query = FacetService.apply_filters(query, filters, exclude=exclude)
+            return query.filter(*criteria).group_by(*group_by).statement
+
+        # FLOOR до CAST: в MySQL CAST AS SIGNED округляет, а не отбрасывает дробную часть
+        bucket = db.cast(func.floor((Product.price - low) / width), db.Integer)
+        bucket = db.case(
+            (bucket < 0, 0), (bucket >= HISTOGRAM_BUCKETS, HISTOGRAM_BUCKETS - 1), else_=bucket
+        )
+        parts = [
+            part("price", bucket, None, "price", group_by=[bucket]),
+            part("brand", Product.brand_id, None, "brand", group_by=[Product.brand_id]),
+        ]
+        if with_specs:
+            # Характеристики без фильтра — одной частью, с фильтром — по одной
+            spec_columns = [ProductSpec.spec_group, ProductSpec.spec_key, ProductSpec.spec_value]
+            parts.append(
+                part(
+                    "spec",
+                    db.cast(db.null(), db.Integer),
+                    spec_columns,
+                    None,
+                    *[
+                        not_(and_(ProductSpec.spec_group == group, ProductSpec.spec_key == key))
+                        for group, key in filters["specs"]
+                    ],
+                    group_by=spec_columns,
+                )
+            )
+            for group, key in filters["specs"]:
+                parts.append(
+                    part(
+                        "spec",
+                        db.cast(db.null(), db.Integer),
+                        spec_columns,
+                        (group, key),
+                        ProductSpec.spec_group == group,
+                        ProductSpec.spec_key == key,
+                        group_by=spec_columns,
+                    )
+                )
+
+        histogram = [0] * HISTOGRAM_BUCKETS
+        price_min = price_max = None
+        brands, specs = {}, Counter() if with_specs else None
+        for kind, number, group, spec_key, value, count, low_price, high_price in db.session.execute(
+            db.union_all(*parts)
+        ):
+            if kind == "price":
+                histogram[int(number)] += count
+                price_min = low_price if price_min is None else min(price_min, low_price)
+                price_max = high_price if price_max is None else max(price_max, high_price)
+            elif kind == "brand":
+                brands[number] = count
+            else:
+                specs[(group, spec_key, value)] = count
+
+        summary = {
+            "brands": brands,
+            "price": {
+                "min": float(price_min) if price_min is not None else None,
+                "max": float(price_max) if price_max is not None else None,
+                "histogram": [
+                    {
+                        "from": round(low + width * i, 2),
+                        "to": round(low + width * (i + 1), 2),
+                        "count": count,
+                    }
+                    for i, count in enumerate(histogram)
+                ],
+            },
+            "specs": specs,
+        }
+        try:
+            cache.set(cache_key, summary, timeout=SUMMARY_CACHE_TIMEOUT)
+        except:
+            pass  # Игнорируем ошибку кэша
+        return summary
+
+    @staticmethod
+    def rebuild(category_id=None):
+        """
+        Полностью перестраивает индекс фасетов (для всех или одной категории)
+        одним агрегатным запросом по product_spec.
+        """
+        query = (
+            db.session.query(
+                Product.category_id,
+                ProductSpec.spec_group,
+                ProductSpec.spec_key,
+                ProductSpec.spec_value,
+                func.count(ProductSpec.product_id),
+            )
+            .join(Product, Product.id == ProductSpec.product_id)
+            .group_by(
+                Product.category_id,
+                ProductSpec.spec_group,
+                ProductSpec.spec_key,
+                ProductSpec.spec_value,
+            )
+        )
+        if category_id:
+            query = query.filter(Product.category_id == category_id)
+        rows = [
+            {
+                "category_id": cat_id,
+                "spec_group": group,
+                "spec_key": key,
+                "spec_value": value,
+                "product_count": count,
+            }
+            for cat_id, group, key, value, count in query
+        ]
+
+        delete_query = SpecFacet.query
+        if category_id:
+            delete_query = delete_query.filter(SpecFacet.category_id == category_id)
+        delete_query.delete(synchronize_session=False)
+
+        for start in range(0, len(rows), REBUILD_CHUNK_SIZE):
+            db.session.execute(
+                FACET_TABLE.insert(), rows[start:start + REBUILD_CHUNK_SIZE]
+            )
+        db.session.commit()
+        return len(rows)
+
+    @staticmethod
+    def apply_deltas(connection, deltas):
+        """
+        Инкрементально применяет изменения счетчиков к индексу фасетов:
+        прибавляет их к существующим строкам и вставляет новые одним
+        upsert'ом, затем удаляет строки с нулевым счетчиком.
+        """
+        touched_categories = set()
+        rows = []
+        # Строки в порядке ключа — параллельные транзакции блокируют их в одном порядке
+        for (cat_id, group, key, value), delta in sorted(
+            item for item in deltas.items() if item[1] and item[0][0] is not None
+        ):
+            touched_categories.add(cat_id)
+            rows.append(
+                {
+                    "category_id": cat_id,
+                    "spec_group": group,
+                    "spec_key": key,
+                    "spec_value": value,
+                    "product_count": delta,
+                }
+            )
+        for start in range(0, len(rows), REBUILD_CHUNK_SIZE):
+            _upsert_facets(connection, rows[start:start + REBUILD_CHUNK_SIZE])
+        if touched_categories:
+            connection.execute(
+                FACET_TABLE.delete().where(
+                    FACET_TABLE.c.category_id.in_(touched_categories),
+                    FACET_TABLE.c.product_count <= 0,
+                )
+            )
+
+
+def _upsert_facets(connection, rows):
+    """
+    Многострочный INSERT в spec_facet, прибавляющий product_count при
+    совпадении uq_spec_facet_value: ON DUPLICATE KEY UPDATE в MySQL,
+    ON CONFLICT в SQLite. Две транзакции, добавляющие одно и то же новое
+    значение, не падают на уникальном ключе, как UPDATE + INSERT.
+    """
+    if connection.dialect.name == "mysql":
+        statement = mysql_insert(FACET_TABLE).values(rows)
+        statement = statement.on_duplicate_key_update(
+            product_count=FACET_TABLE.c.product_count + statement.inserted.product_count
+        )
+    else:
+        statement = sqlite_insert(FACET_TABLE).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=["category_id", "spec_group", "spec_key", "spec_value"],
+            set_={"product_count": FACET_TABLE.c.product_count + statement.excluded.product_count},
+        )
+    connection.execute(statement)
+
+
+def _filters_fingerprint(filters):
+    """Фильтры в виде, пригодном для JSON и не зависящем от порядка."""
+    fingerprint = dict(filters)
+    fingerprint["specs"] = sorted(
+        [group, key, sorted(values)] for (group, key), values in filters["specs"].items()
+    )
+    return fingerprint
+
+
+def _previous_value(attr_state):
+    """Значение атрибута до текущего flush (или None, если не изменялся)."""
+    history = attr_state.history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return None
+
+
+def _previous_category_id(state):
+    history = state.attrs.category_id.history
+    if history.deleted:
+        return history.deleted[0]
+    relation_history = state.attrs.category.history
+    if relation_history.deleted and relation_history.deleted[0] is not None:
+        return relation_history.deleted[0].id
+    return state.attrs.category_id.value
+
+
+def _count(deltas, category_id, specifications, sign):
+    if not category_id:
+        return
+    for group, key, value in SpecService.iter_spec_values(specifications):
+        deltas[(category_id, group, key, value)] += sign
+
+
+def _load_previous(target, value, oldvalue, initiator):
+    return value
+
+
+# Прежние характеристики и категория нужны, чтобы вычесть старый вклад: с
+# active_history они загружаются при присваивании, даже если товар истек после
+# коммита. Product.category — обратная ссылка, она появляется после настройки мапперов
+configure_mappers()
+for name in ("specifications", "category_id", "category"):
+    event.listen(getattr(Product, name), "set", _load_previous, active_history=True)
+
+
+@event.listens_for(db.session, "after_flush")
+def update_facet_index(session, flush_context):
+    """Поддерживает индекс фасетов в актуальном состоянии при записи товаров."""
+    deltas = Counter()
+    for obj in session.new:
+        if isinstance(obj, Product):
+            _count(deltas, obj.category_id, obj.specifications, 1)
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            state = inspect(obj)
+            _count(
+                deltas,
+                _previous_category_id(state),
+                _previous_value(state.attrs.specifications),
+                -1,
+            )
+    for obj in session.dirty:
+        if not isinstance(obj, Product):
+            continue
+        state = inspect(obj)
+        if not (
+            state.attrs.specifications.history.has_changes()
+            or state.attrs.category_id.history.has_changes()
+            or state.attrs.category.history.has_changes()
+        ):
+            continue
+        _count(
+            deltas,
+            _previous_category_id(state),
+            _previous_value(state.attrs.specifications),
+            -1,
+        )
+        _count(deltas, obj.category_id, obj.specifications, 1)
+    if deltas:
+        FacetService.apply_deltas(session.connection(), deltas)
+
+
+@celery.task
+def rebuild_facet_index(category_id=None):
+    """Фоновая задача Celery для полной перестройки индекса фасетов."""
+    return FacetService.rebuild(category_id)
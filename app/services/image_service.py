@@ -0,0 +1,261 @@
+import os
+import hashlib
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app, url_for
+from sqlalchemy import event, select, update, func, and_
+from PIL import Image, ImageOps
+from app import db, celery
+from app.models import Product, ProductImage
+from app.utils import enqueue_task
+
+# Ширины производных (px); крупнее оригинала не увеличиваем
+SIZE_BUCKETS = (160, 320, 640, 1280)
+# Формат Pillow, расширение файла, параметры сохранения
+FORMATS = {
+    "jpeg": ("jpg", {"quality": 82, "optimize": True, "progressive": True}),
+    "webp": ("webp", {"quality": 80, "method": 4}),
+}
+DERIVATIVES_SUBDIR = "derivatives"
+BACKFILL_CHUNK_SIZE = 500
+PRIMARY_SYNC_CHUNK_SIZE = 5000
+PRODUCT_TABLE = Product.__table__
+IMAGE_TABLE = ProductImage.__table__
+
+
+def derivative_name(content_hash, width, fmt):
+    """Путь производной относительно static/images; имя зависит только от содержимого."""
+    extension = FORMATS[fmt][0]
+    return f"{DERIVATIVES_SUBDIR}/{content_hash[:2]}/{content_hash}-{width}.{extension}"
+
+
+def target_widths(original_width):
+    return sorted({min(width, original_width) for width in SIZE_BUCKETS})
+
+
+def build_derivatives(source_path, images_dir):
+    """
+    Строит производные одного файла: все ширины SIZE_BUCKETS в JPEG и WebP.
+    Не требует контекста приложения (запускается и в пуле процессов).
+    Одинаковые файлы дают одинаковый хэш, и уже готовые производные
+    не пересчитываются. Возвращает (хэш содержимого, [ширины]).
+    """
+    with open(source_path, "rb") as source:
+        content_hash = hashlib.sha1(source.read()).hexdigest()
+    with Image.open(source_path) as original:
+        # Ширина после поворота по EXIF (ориентации 5–8 меняют стороны местами)
+        rotated = original.getexif().get(0x0112, 1) in (5, 6, 7, 8)
+        widths = target_widths(original.height if rotated else original.width)
+        missing = [
+            (width, fmt)
+            for width in widths
+            for fmt in FORMATS
+            if not os.path.exists(os.path.join(images_dir, derivative_name(content_hash, width, fmt)))
+        ]
+        if not missing:
+            return content_hash, widths
+        os.makedirs(os.path.join(images_dir, DERIVATIVES_SUBDIR, content_hash[:2]), exist_ok=True)
+        # JPEG декодируется сразу в уменьшенном масштабе, если нужна только малая ширина
+        original.draft("RGB", (max(width for width, _ in missing),) * 2)
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        # От большего к меньшему: каждая ширина уменьшается из предыдущей
+        for width in sorted({width for width, _ in missing}, reverse=True):
+            if width < image.width:
+                height = max(1, round(image.height * width / image.width))
+                image = image.resize((width, height), Image.LANCZOS, reducing_gap=2.0)
+            for fmt in FORMATS:
+                if (width, fmt) not in missing:
+                    continue
+                extension, options = FORMATS[fmt]
+                path = os.path.join(images_dir, derivative_name(content_hash, width, fmt))
+                frame = image
+                if fmt == "jpeg" and image.mode == "RGBA":
+                    frame = Image.new("RGB", image.size, (255, 255, 255))
+                    frame.paste(image, mask=image.getchannel("A"))
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                frame.save(tmp_path, format=fmt.upper(), **options)
+                os.replace(tmp_path, path)
+    return content_hash, widths
+
+
+class ImageService:
+    @staticmethod
+    def images_dir():
+        return os.path.join(current_app.static_folder, "images")
+
+    @staticmethod
+    def srcset(image, fmt="jpeg", external=False):
+        """Значение srcset для ProductImage (пустая строка, пока производных нет)."""
+        if image is None or not image.content_hash or not image.derivative_widths:
+            return ""
+        return ", ".join(
+            url_for(
+                "static",
+                filename="images/" + derivative_name(image.content_hash, width, fmt),
+                _external=external,
+            )
+            + f" {width}w"
+            for width in image.derivative_widths
+        )
+
+    @staticmethod
+    def thumbnail_url(image, width=SIZE_BUCKETS[0]):
+        """URL ближайшей производной не уже width или оригинала."""
+        if image is None:
+            return url_for("static", filename="images/default_product.png")
+        if image.content_hash and image.derivative_widths:
+            fitting = [w for w in image.derivative_widths if w >= width] or image.derivative_widths[-1:]
+            return url_for(
+                "static", filename="images/" + derivative_name(image.content_hash, fitting[0], "jpeg")
+            )
+        return url_for("static", filename="images/" + image.image_url)
+
+    @staticmethod
+    def sync_primary_images(connection, product_ids=None, chunk_size=PRIMARY_SYNC_CHUNK_SIZE, echo=None):
+        """
+        Пересчитывает Product.primary_image_id (первое изображение по
+        sort_order, id) для product_ids или всех товаров диапазонами id.
+        Возвращает число товаров.
+        """
+        first_image = (
+            select(IMAGE_TABLE.c.id)
+            .where(IMAGE_TABLE.c.product_id == PRODUCT_TABLE.c.id)
+            .order_by(func.coalesce(IMAGE_TABLE.c.sort_order, 0), IMAGE_TABLE.c.id)
+            .limit(1)
+            .scalar_subquery()
+        )
+        statement = update(PRODUCT_TABLE).values(primary_image_id=first_image)
+        if product_ids is not None:
+            product_ids = sorted(product_ids)
+            for start in range(0, len(product_ids), chunk_size):
+                connection.execute(
+                    statement.where(PRODUCT_TABLE.c.id.in_(product_ids[start:start + chunk_size]))
+                )
+            return len(product_ids)
+        max_id = connection.execute(select(func.max(PRODUCT_TABLE.c.id))).scalar() or 0
+        for low_id in range(0, max_id, chunk_size):
+            connection.execute(
+                statement.where(
+                    and_(PRODUCT_TABLE.c.id > low_id, PRODUCT_TABLE.c.id <= low_id + chunk_size)
+                )
+            )
+            if echo:
+                echo(f"Главные изображения обновлены до id {min(low_id + chunk_size, max_id)}")
+        return max_id
+
+    @staticmethod
+    def process(image_ids):
+        """Строит производные изображений и сохраняет хэш и ширины. Возвращает число обработанных."""
+        images_dir = ImageService.images_dir()
+        processed = 0
+        for image in ProductImage.query.filter(ProductImage.id.in_(image_ids)):
+            try:
+                content_hash, widths = build_derivatives(
+                    os.path.join(images_dir, image.image_url), images_dir
+                )
+            except (OSError, ValueError, Image.DecompressionBombError) as e:
+                current_app.logger.warning(f"Производные для {image.image_url} не построены: {e}")
+                continue
+            image.content_hash, image.derivative_widths = content_hash, widths
+            processed += 1
+        db.session.commit()
+        return processed
+
+    @staticmethod
+    def backfill(workers=None, force=False, echo=None):
+        """
+        Строит производные для всей библиотеки в пуле процессов
+        (декодирование и сжатие упираются в CPU). Возвращает
+        (обработано, ошибок).
+        """
+        images_dir = ImageService.images_dir()
+        query = ProductImage.query.order_by(ProductImage.id)
+        if not force:
+            query = query.filter(ProductImage.content_hash.is_(None))
+        pending = query.with_entities(ProductImage.id, ProductImage.image_url).all()
+        processed = failed = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for start in range(0, len(pending), BACKFILL_CHUNK_SIZE):
+                chunk = pending[start:start + BACKFILL_CHUNK_SIZE]
+                futures = [
+                    (image_id, pool.submit(build_derivatives, os.path.join(images_dir, image_url), images_dir))
+                    for image_id, image_url in chunk
+                ]
+                results = {}
+                for image_id, future in futures:
+                    try:
+                        results[image_id] = future.result()
+                    except (OSError, ValueError, Image.DecompressionBombError):
+                        failed += 1
+                for image in ProductImage.query.filter(ProductImage.id.in_(list(results))):
+                    image.content_hash, image.derivative_widths = results[image.id]
+                db.session.commit()
+                processed += len(results)
+                if echo:
+                    echo(f"Обработано {processed} из {len(pending)} (ошибок: {failed})")
+        return processed, failed
+
+
+@celery.task
+def generate_image_derivatives(image_ids):
+    """Фоновая задача Celery: производные новых и замененных изображений."""
+    return ImageService.process(image_ids)
+
+
+@event.listens_for(db.session, "after_flush")
+def _collect_changed_images(session, flush_context):
+    """Новые изображения и замена файла (image_url); запись хэша задачей не учитывается."""
+    changed = {obj.id for obj in session.new if isinstance(obj, ProductImage)}
+    changed.update(
+        obj.id
+        for obj in session.dirty
+        if isinstance(obj, ProductImage) and db.inspect(obj).attrs.image_url.history.has_changes()
+    )
+    if changed:
+        session.info.setdefault("images_changed", set()).update(changed)
+
+
+def _load_previous(target, value, oldvalue, initiator):
+    return value
+
+
+# Прежний товар изображения нужен, чтобы пересчитать и его: с active_history он
+# загружается при присваивании, даже если изображение истекло после коммита
+event.listen(ProductImage.product_id, "set", _load_previous, active_history=True)
+
+
+@event.listens_for(db.session, "after_flush")
+def sync_primary_images(session, flush_context):
+    """Добавление, удаление, перестановка и перенос изображений меняют главное изображение товара."""
+    product_ids = set()
+    for obj in chain(session.new, session.deleted):
+        if isinstance(obj, ProductImage):
+            product_ids.add(obj.product_id)
+    for obj in session.dirty:
+        if not isinstance(obj, ProductImage):
+            continue
+        attrs = db.inspect(obj).attrs
+        if attrs.sort_order.history.has_changes() or attrs.product_id.history.has_changes():
+            product_ids.add(obj.product_id)
+            product_ids.update(attrs.product_id.history.deleted)
+    product_ids.discard(None)
+    if product_ids:
+        ImageService.sync_primary_images(session.connection(), product_ids)
+
+
+@event.listens_for(db.session, "after_rollback")
+def _discard_changed_images(session):
+    session.info.pop("images_changed", None)
+
+
+@event.listens_for(db.session, "after_commit")
+def _schedule_image_derivatives(session):
+    image_ids = session.info.pop("images_changed", None)
+    if not image_ids:
+        return
+    try:
+        enqueue_task(generate_image_derivatives, sorted(image_ids))
+    except Exception as e:
+        current_app.logger.warning(f"Не удалось запланировать обработку изображений: {e}")
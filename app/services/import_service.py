@@ -0,0 +1,479 @@
+import os
+import io
+import csv
+import gzip
+import json
+import uuid
+from collections import Counter
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from flask import current_app
+from sqlalchemy import select, update, insert, bindparam
+from sqlalchemy.exc import SQLAlchemyError
+from app import db, cache, celery
+from app.models import Product, Category, Brand, ImportJob
+from app.services.spec_service import SpecService
+from app.services.facet_service import FacetService
+from app.services.search_service import SearchService
+from app.services.slug_service import SlugService
+from app.services.category_service import CategoryService
+
+IMPORT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 200
+# Попыток записать порцию при конфликте уникального индекса slug
+SLUG_RETRY_ATTEMPTS = 3
+MAX_PRICE = Decimal("99999999.99")  # Numeric(10, 2)
+PRODUCT_TABLE = Product.__table__
+CATEGORY_TABLE = Category.__table__
+BRAND_TABLE = Brand.__table__
+JOB_TABLE = ImportJob.__table__
+# Текстовые колонки CSV и их максимальная длина (None — без ограничения)
+TEXT_COLUMNS = {
+    "name": 255,
+    "sku": 100,
+    "description": None,
+    "meta_title": 255,
+    "meta_description": 255,
+    "country": 100,
+    "warranty": 50,
+}
+# Колонки нового товара, которых нет в файле или строке
+INSERT_DEFAULTS = {
+    "sku": None,
+    "description": None,
+    "old_price": None,
+    "in_stock": 0,
+    "meta_title": None,
+    "meta_description": None,
+    "country": None,
+    "warranty": None,
+}
+
+
+class RowError(ValueError):
+    """Ошибка в одной строке файла: строка пропускается, импорт продолжается."""
+
+
+def _parse_decimal(value, column):
+    try:
+        number = Decimal(value.replace(",", ".").replace(" ", ""))
+    except InvalidOperation:
+        raise RowError(f"{column}: «{value}» — не число")
+    if not number.is_finite() or number < 0 or number > MAX_PRICE:
+        raise RowError(f"{column}: значение вне диапазона 0–{MAX_PRICE}")
+    return number.quantize(Decimal("0.01"))
+
+
+def parse_row(row):
+    """
+    Разбирает строку CSV в (id, значения колонок товара, категория, бренд, slug).
+    Пустые и отсутствующие колонки не попадают в значения — у существующего
+    товара они не меняются.
+    """
+    raw = {key: (value or "").strip() for key, value in row.items() if key}
+    product_id = None
+    if raw.get("id"):
+        try:
+            product_id = int(raw["id"])
+        except ValueError:
+            raise RowError(f"id: «{raw['id']}» — не целое число")
+    values = {}
+    for column, max_length in TEXT_COLUMNS.items():
+        if raw.get(column):
+            if max_length and len(raw[column]) > max_length:
+                raise RowError(f"{column}: длиннее {max_length} символов")
+            values[column] = raw[column]
+    if raw.get("price"):
+        values["price"] = _parse_decimal(raw["price"], "price")
+    if raw.get("old_price"):
+        values["old_price"] = _parse_decimal(raw["old_price"], "old_price")
+    if raw.get("in_stock"):
+        try:
+            values["in_stock"] = int(raw["in_stock"])
+        except ValueError:
+            raise RowError(f"in_stock: «{raw['in_stock']}» — не целое число")
+    if raw.get("specifications"):
+        try:
+            specifications = json.loads(raw["specifications"])
+        except ValueError:
+            raise RowError("specifications: некорректный JSON")
+        if not isinstance(specifications, dict):
+            raise RowError("specifications: ожидается объект {группа: {характеристика: значение}}")
+        values["specifications"] = specifications
+    slug = raw.get("slug") or None
+    if slug and len(slug) > 255:
+        raise RowError("slug: длиннее 255 символов")
+    category_name, brand_name = raw.get("category_name"), raw.get("brand_name")
+    if category_name and len(category_name) > 100:
+        raise RowError("category_name: длиннее 100 символов")
+    if brand_name and len(brand_name) > 100:
+        raise RowError("brand_name: длиннее 100 символов")
+    return product_id, values, category_name, brand_name, slug
+
+
+class ProductImporter:
+    """
+    Потоковый импорт товаров: строки читаются из файла порциями по
+    chunk_size и записываются пакетными INSERT/UPDATE, по транзакции на
+    порцию. Категории и бренды разрешаются по словарям в памяти, slug
+    выделяются пачкой. Запись идет в обход ORM, поэтому product_spec,
+    фасеты, поисковый индекс и версия каталога обновляются здесь явно.
+    """
+
+    def __init__(self, job_id, chunk_size=IMPORT_CHUNK_SIZE):
+        self.job_id = job_id
+        self.chunk_size = chunk_size
+        self.stats = Counter()
+        self.errors = []
+        # Категория с повторяющимся названием — первая по id, как в прежнем импорте
+        self.categories = {}
+        for category_id, name in db.session.execute(
+            select(Category.id, Category.name).order_by(Category.id.desc())
+        ):
+            self.categories[name] = category_id
+        self.brands = {}
+        for brand_id, name in db.session.execute(
+            select(Brand.id, Brand.name).order_by(Brand.id.desc())
+        ):
+            self.brands[name] = brand_id
+
+    def add_error(self, line, message):
+        self.stats["errors"] += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def run(self, binary_file, size_bytes, echo=None):
+        """Читает CSV (или .csv.gz) из открытого бинарного файла."""
+        raw = binary_file
+        if binary_file.read(2) == b"\x1f\x8b":
+            binary_file.seek(0)
+            raw = gzip.GzipFile(fileobj=binary_file)
+        else:
+            binary_file.seek(0)
+        text = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+        reader = csv.DictReader(text)
+        columns = set(reader.fieldnames or ())
+        if not columns & {"id", "name"}:
+            raise ValueError("В заголовке файла нет колонок id и name")
+
+        chunk, chunk_ids = [], set()
+        for row in reader:
+            line = reader.line_num
+            self.stats["rows"] += 1
+            try:
+                parsed = parse_row(row)
+            except RowError as e:
+                self.add_error(line, str(e))
+                continue
+            # Повтор id внутри порции — следующая порция, чтобы строки применились по порядку
+            if parsed[0] is not None and parsed[0] in chunk_ids:
+                self._flush(chunk, binary_file.tell())
+                chunk, chunk_ids = [], set()
+            chunk.append((line,) + parsed)
+            if parsed[0] is not None:
+                chunk_ids.add(parsed[0])
+            if len(chunk) >= self.chunk_size:
+                self._flush(chunk, binary_file.tell())
+                chunk, chunk_ids = [], set()
+                if echo:
+                    echo(
+                        f"Строк: {self.stats['rows']}, создано {self.stats['created']}, "
+                        f"обновлено {self.stats['updated']}, ошибок {self.stats['errors']}"
+                    )
+        self._flush(chunk, size_bytes)
+        return self.stats
+
+    def _flush(self, chunk, position):
+        """Записывает порцию одной транзакцией вместе с прогрессом задачи."""
+        if chunk:
+            for attempt in range(1, SLUG_RETRY_ATTEMPTS + 1):
+                self.accepted_lines = []
+                try:
+                    row_errors = self._write_chunk(chunk)
+                except SQLAlchemyError as e:
+                    db.session.rollback()
+                    # Выделенный slug заняла параллельная запись — порция пишется заново
+                    if SlugService.is_conflict(e) and attempt < SLUG_RETRY_ATTEMPTS:
+                        continue
+                    current_app.logger.warning(f"Импорт {self.job_id}: порция не записана: {e}")
+                    message = f"Порция строк {chunk[0][0]}–{chunk[-1][0]} не записана: {e.__class__.__name__}"
+                    for line in self.accepted_lines:
+                        self.add_error(line, message)
+                else:
+                    for line, message in row_errors:
+                        self.add_error(line, message)
+                    self._remember_resolved()
+                break
+        db.session.execute(
+            update(JOB_TABLE)
+            .where(JOB_TABLE.c.id == self.job_id)
+            .values(
+                processed_bytes=position,
+                rows_processed=self.stats["rows"],
+                created_count=self.stats["created"],
+                updated_count=self.stats["updated"],
+                error_count=self.stats["errors"],
+                errors=self.errors,
+            )
+        )
+        db.session.commit()
+
+    def _write_chunk(self, chunk):
+        """
+        Пишет порцию в текущей транзакции; возвращает ошибки строк
+        [(строка, сообщение)]. Разобранные значения не меняются, поэтому
+        после отката порцию можно записать повторно.
+        """
+        connection = db.session.connection()
+        self.new_categories, self.new_brands = {}, {}
+        existing = {
+            row.id: row
+            for row in connection.execute(
+                select(
+                    Product.id, Product.name, Product.slug, Product.category_id, Product.specifications
+                ).where(Product.id.in_([product_id for _, product_id, *_ in chunk if product_id]))
+            )
+        }
+        owners = self._owners(connection, chunk)
+
+        inserts, updates, accepted, row_errors = [], [], [], []
+        explicit_slugs = set()
+        for line, product_id, values, category_name, brand_name, slug in chunk:
+            values = dict(values)
+            current = existing.get(product_id)
+            # Как и прежде: id, которого нет в базе, создает новый товар с новым id.
+            # Новые товары порции в проверке уникальности — отрицательный номер строки
+            target = current.id if current else -line
+            try:
+                if current is None:
+                    missing = [name for name in ("name", "price") if name not in values]
+                    missing += [name for name, value in (("category_name", category_name), ("brand_name", brand_name)) if not value]
+                    if missing:
+                        raise RowError(f"для нового товара обязательны: {', '.join(missing)}")
+                for column, value in (("sku", values.get("sku")), ("slug", slug)):
+                    if value is None:
+                        continue
+                    owner = owners[column].setdefault(value, target)
+                    if owner != target:
+                        where = f"товаром {owner}" if owner > 0 else f"в строке {-owner} файла"
+                        raise RowError(f"{column} «{value}» уже занят {where}")
+            except RowError as e:
+                row_errors.append((line, str(e)))
+                continue
+            if category_name:
+                values["category_id"] = self._resolve(connection, category_name, self.categories, self.new_categories, CATEGORY_TABLE)
+            if brand_name:
+                values["brand_id"] = self._resolve(connection, brand_name, self.brands, self.new_brands, BRAND_TABLE)
+            if slug:
+                values["slug"] = slug
+                explicit_slugs.add(slug)
+            accepted.append((current, values))
+            self.accepted_lines.append(line)
+            if current is None:
+                inserts.append(values)
+            else:
+                updates.append((current, values))
+
+        self._allocate_slugs(connection, accepted, explicit_slugs)
+
+        # Новые товары: id читаются обратно по уникальному slug (без RETURNING в MySQL).
+        # Без характеристик колонка не передается: JSON None записался бы как 'null'
+        groups = {}
+        for values in inserts:
+            row = dict(INSERT_DEFAULTS, **values)
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        for rows in groups.values():
+            connection.execute(insert(PRODUCT_TABLE), rows)
+        if inserts:
+            new_ids = dict(
+                connection.execute(
+                    select(Product.slug, Product.id).where(Product.slug.in_([values["slug"] for values in inserts]))
+                ).all()
+            )
+            for values in inserts:
+                values["id"] = new_ids[values["slug"]]
+        # Обновления группируются по набору колонок: один executemany на группу
+        groups = {}
+        for current, values in updates:
+            groups.setdefault(tuple(sorted(values)), []).append(
+                dict({"b_id": current.id}, **{f"b_{key}": value for key, value in values.items()})
+            )
+        for keys, params in groups.items():
+            connection.execute(
+                update(PRODUCT_TABLE)
+                .where(PRODUCT_TABLE.c.id == bindparam("b_id"))
+                .values({key: bindparam(f"b_{key}") for key in keys}),
+                params,
+            )
+
+        self._sync_indexes(connection, inserts, updates)
+        self.stats["created"] += len(inserts)
+        self.stats["updated"] += len(updates)
+        return row_errors
+
+    def _owners(self, connection, chunk):
+        """Текущие владельцы sku и явно заданных slug порции: {значение: id товара}."""
+        skus = {values["sku"] for _, _, values, _, _, _ in chunk if "sku" in values}
+        slugs = {slug for *_, slug in chunk if slug}
+        owners = {"sku": {}, "slug": {}}
+        if skus:
+            owners["sku"] = dict(connection.execute(select(Product.sku, Product.id).where(Product.sku.in_(skus))).all())
+        if slugs:
+            owners["slug"] = dict(connection.execute(select(Product.slug, Product.id).where(Product.slug.in_(slugs))).all())
+        return owners
+
+    def _resolve(self, connection, name, known, created, table):
+        """id категории или бренда по названию; новые создаются в транзакции порции."""
+        if name in known:
+            return known[name]
+        if name not in created:
+            values = {"name": name}
+            if table is CATEGORY_TABLE:
+                values["slug"] = SlugService.allocate(
+                    connection, table, [SlugService.base_slug(name, "category")]
+                )[0]
+            created[name] = connection.execute(insert(table).values(**values)).inserted_primary_key[0]
+            if table is CATEGORY_TABLE:
+                # Новая категория — корневая, путь из одного id
+                connection.execute(
+                    update(table).where(table.c.id == created[name]).values(path=f"{created[name]}/")
+                )
+        return created[name]
+
+    def _remember_resolved(self):
+        """Созданные категории и бренды попадают в словари только после коммита порции."""
+        if self.new_categories or self.new_brands:
+            self.categories.update(self.new_categories)
+            self.brands.update(self.new_brands)
+            if self.new_categories:
+                CategoryService.invalidate()
+            try:
+                cache.delete("cached_brands")
+            except:
+                pass  # Игнорируем ошибку кэша
+
+    def _allocate_slugs(self, connection, accepted, explicit_slugs):
+        """
+        Slug из названия — новым товарам и переименованным товарам, чей slug
+        построен не из нового названия (как при сохранении через ORM). Один запрос на порцию.
+        """
+        pending = []
+        for current, values in accepted:
+            if "slug" in values:
+                continue
+            name = values.get("name") or current.name
+            base = SlugService.base_slug(name, "product")
+            if current is not None and current.slug and (
+                "name" not in values or values["name"] == current.name or SlugService.matches(current.slug, base)
+            ):
+                continue
+            pending.append((values, base))
+        if not pending:
+            return
+        slugs = SlugService.allocate(
+            connection, PRODUCT_TABLE, [base for _, base in pending], reserved=explicit_slugs
+        )
+        for (values, _), slug in zip(pending, slugs):
+            values["slug"] = slug
+
+    def _sync_indexes(self, connection, inserts, updates):
+        """product_spec, фасеты, поиск и изменения каталога для записанной порции."""
+        specs = [(values["id"], values["specifications"]) for values in inserts if "specifications" in values]
+        deltas = Counter()
+        for values in inserts:
+            for group, key, value in SpecService.iter_spec_values(values.get("specifications")):
+                deltas[(values["category_id"], group, key, value)] += 1
+        for current, values in updates:
+            if "specifications" in values:
+                specs.append((current.id, values["specifications"]))
+            if "specifications" not in values and values.get("category_id", current.category_id) == current.category_id:
+                continue
+            for group, key, value in SpecService.iter_spec_values(current.specifications):
+                deltas[(current.category_id, group, key, value)] -= 1
+            for group, key, value in SpecService.iter_spec_values(values.get("specifications", current.specifications)):
+                deltas[(values.get("category_id", current.category_id), group, key, value)] += 1
+        if specs:
+            SpecService.sync_products(connection, specs)
+        if deltas:
+            FacetService.apply_deltas(connection, deltas)
+        product_ids = [values["id"] for values in inserts] + [current.id for current, _ in updates]
+        if product_ids:
+            SearchService.backend().index_products(connection, product_ids)
+            # Версия каталога и журналы изменений — после коммита (app.utils._publish_catalog_change)
+            db.session.info.setdefault("catalog_changed", set()).update(product_ids)
+
+
+class ImportService:
+    @staticmethod
+    def upload_dir():
+        return current_app.config.get("IMPORT_DIR") or os.path.join(
+            current_app.instance_path, "imports"
+        )
+
+    @staticmethod
+    def start(file, user_id=None):
+        """
+        Сохраняет загруженный файл на диск и ставит импорт в очередь Celery.
+        Возвращает ImportJob; если очередь недоступна, задача помечается
+        как failed и исключение пробрасывается.
+        """
+        directory = ImportService.upload_dir()
+        os.makedirs(directory, exist_ok=True)
+        extension = ".csv.gz" if file.filename.lower().endswith(".gz") else ".csv"
+        path = os.path.join(directory, uuid.uuid4().hex + extension)
+        file.save(path)
+        job = ImportJob(
+            filename=file.filename[:255],
+            path=path,
+            size_bytes=os.path.getsize(path),
+            user_id=user_id,
+        )
+        db.session.add(job)
+        db.session.commit()
+        try:
+            import_products.delay(job.id)
+        except Exception as e:
+            job.status, job.message, job.finished_at = "failed", f"Очередь задач недоступна: {e}", datetime.utcnow()
+            db.session.commit()
+            os.remove(path)
+            raise
+        return job
+
+    @staticmethod
+    def run(job_id, chunk_size=IMPORT_CHUNK_SIZE, remove_file=True, echo=None):
+        """Выполняет импорт задачи; повторный запуск завершенной задачи ничего не делает."""
+        job = db.session.get(ImportJob, job_id)
+        if job is None or job.status != "pending":
+            return None
+        job.status, job.started_at = "running", datetime.utcnow()
+        db.session.commit()
+        path = job.path
+        try:
+            with open(path, "rb") as binary_file:
+                ProductImporter(job_id, chunk_size).run(binary_file, job.size_bytes, echo=echo)
+            job.status = "done"
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.exception(f"Импорт {job_id} прерван")
+            job.status, job.message = "failed", f"Импорт прерван: {e}"
+        job.finished_at = datetime.utcnow()
+        if remove_file:
+            job.path = None
+        db.session.commit()
+        if remove_file:
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # Файл уже удален
+        return job
+
+    @staticmethod
+    def recent_jobs(limit=10):
+        return ImportJob.query.order_by(ImportJob.id.desc()).limit(limit).all()
+
+
+@celery.task
+def import_products(job_id, chunk_size=IMPORT_CHUNK_SIZE):
+    """Фоновая задача Celery: импорт товаров из загруженного файла."""
+    job = ImportService.run(job_id, chunk_size)
+    return job.status if job else None
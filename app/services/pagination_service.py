@@ -0,0 +1,214 @@
+import base64
+import hashlib
+import json
+from sqlalchemy import and_, or_, select, func
+from app import db, cache
+from app.models import Product
+from app.utils import get_catalog_version
+
+# Допустимые сортировки: ключ -> (колонка, по убыванию). Product.id — вторичный ключ
+SORT_KEYS = {
+    "price_asc": (Product.price, False),
+    "price_desc": (Product.price, True),
+    "name_asc": (Product.name, False),
+    "name_desc": (Product.name, True),
+    "id_asc": (Product.id, False),
+    "id_desc": (Product.id, True),
+    "rating": (Product.rating_avg, True),
+}
+COUNT_CACHE_TIMEOUT = 600
+# До какой страницы переход по номеру (OFFSET) считается дешевым
+MAX_OFFSET_PAGE = 10
+
+
+def encode_cursor(state):
+    raw = json.dumps(state, separators=(",", ":"), ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """Разбирает курсор; при любой ошибке — ValueError."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        state = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Некорректный курсор") from e
+    if not isinstance(state, dict):
+        raise ValueError("Некорректный курсор")
+    return state
+
+
+class KeysetPage:
+    """Страница выдачи, по атрибутам совместимая с Pagination из Flask-SQLAlchemy."""
+
+    def __init__(self, items, page, per_page, total, next_cursor, prev_cursor):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    @property
+    def pages(self):
+        if not self.total:
+            return 0
+        return -(-self.total // self.per_page)
+
+    def page_numbers(self):
+        """Номера страниц, на которые можно дешево перейти по OFFSET."""
+        return range(1, min(self.pages, MAX_OFFSET_PAGE) + 1)
+
+
+class PaginationService:
+    @staticmethod
+    def cached_count(query):
+        """
+        COUNT(*) по отфильтрованному запросу с кэшированием. Ключ включает
+        SQL, параметры и версию каталога, поэтому после изменения товаров
+        счетчик пересчитывается сам.
+        """
+        count_query = query.with_entities(Product.id).order_by(None)
+        compiled = count_query.statement.compile()
+        fingerprint = f"{compiled}|{sorted(compiled.params.items(), key=str)}|{get_catalog_version()}"
+        key = "count_" + hashlib.md5(fingerprint.encode()).hexdigest()
+        try:
+            total = cache.get(key)
+        except:
+            total = None
+        if total is None:
+            total = db.session.execute(
+                select(func.count()).select_from(count_query.subquery())
+            ).scalar()
+            try:
+                cache.set(key, total, timeout=COUNT_CACHE_TIMEOUT)
+            except:
+                pass  # Игнорируем ошибку кэша
+        return total
+
+    @staticmethod
+    def paginate(query, sort_by=None, cursor=None, per_page=20, page=None):
+        """
+        Постраничная выдача по курсору.
+
+        Для сортировок из SORT_KEYS используется seek-пагинация
+        (строки после (значение, id) последнего товара) вместо
+        OFFSET, поэтому глубокие страницы не медленнее первых. Если sort_by
+        не задан (например, выдача отсортирована по релевантности), курсор
+        хранит смещение. Номер страницы без курсора обслуживается OFFSET.
+        Некорректный курсор — ValueError.
+        """
+        state = decode_cursor(cursor) if cursor else None
+        total = PaginationService.cached_count(query)
+
+        offset_mode = (
+            sort_by not in SORT_KEYS
+            or (state is None and page and page > 1)
+            or (state is not None and "o" in state)
+        )
+        if offset_mode:
+            return PaginationService._paginate_offset(query, sort_by, state, per_page, page, total)
+
+        column, descending = SORT_KEYS[sort_by]
+        if state is not None and state.get("s") != sort_by:
+            state = None  # Курсор от другой сортировки — начинаем сначала
+        backwards = state is not None and state.get("d") == "prev"
+        if column is Product.id:
+            order = [column.desc() if descending != backwards else column.asc()]
+        else:
+            direction = "desc" if descending != backwards else "asc"
+            order = [getattr(column, direction)(), getattr(Product.id, direction)()]
+
+        seek_query = query
+        if state is not None:
+            try:
+                value = column.type.python_type(state["v"])
+                last_id = int(state["id"])
+            except (KeyError, TypeError, ValueError, ArithmeticError) as e:
+                raise ValueError("Некорректный курсор") from e
+            # Форма "col >= v AND (col > v OR id > last)" дает диапазон по индексу
+            # и в MySQL, и в SQLite (в отличие от "col > v OR (col = v AND ...)")
+            if descending == backwards:
+                condition = and_(column >= value, or_(column > value, Product.id > last_id))
+            else:
+                condition = and_(column <= value, or_(column < value, Product.id < last_id))
+            seek_query = seek_query.filter(condition)
+
+        rows = seek_query.order_by(None).order_by(*order).limit(per_page + 1).all()
+        more = len(rows) > per_page
+        items = rows[:per_page]
+        current_page = int(state.get("p", 1)) if state is not None else 1
+        if backwards:
+            items.reverse()
+            current_page -= 1
+            has_prev, has_next = more, True
+        else:
+            if state is not None:
+                current_page += 1
+            has_prev, has_next = state is not None and current_page > 1, more
+
+        def cursor_for(product, direction):
+            return encode_cursor({
+                "s": sort_by,
+                "v": str(getattr(product, column.key)),
+                "id": product.id,
+                "d": direction,
+                "p": current_page,
+            })
+
+        return KeysetPage(
+            items,
+            current_page,
+            per_page,
+            total,
+            cursor_for(items[-1], "next") if has_next and items else None,
+            cursor_for(items[0], "prev") if has_prev and items else None,
+        )
+
+    @staticmethod
+    def _paginate_offset(query, sort_by, state, per_page, page, total):
+        if state is not None:
+            try:
+                offset = max(int(state["o"]), 0)
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError("Некорректный курсор") from e
+        else:
+            offset = (max(page or 1, 1) - 1) * per_page
+        if sort_by in SORT_KEYS:
+            column, descending = SORT_KEYS[sort_by]
+            direction = "desc" if descending else "asc"
+            query = query.order_by(None).order_by(
+                getattr(column, direction)(), getattr(Product.id, direction)()
+            )
+        rows = query.offset(offset).limit(per_page + 1).all()
+        items = rows[:per_page]
+
+        def cursor_for(new_offset):
+            # "s" позволяет продолжить по ключу, если сортировка это допускает
+            if sort_by in SORT_KEYS and new_offset > offset:
+                column, _ = SORT_KEYS[sort_by]
+                return encode_cursor({
+                    "s": sort_by,
+                    "v": str(getattr(items[-1], column.key)),
+                    "id": items[-1].id,
+                    "d": "next",
+                    "p": offset // per_page + 1,
+                })
+            return encode_cursor({"o": new_offset})
+
+        return KeysetPage(
+            items,
+            offset // per_page + 1,
+            per_page,
+            total,
+            cursor_for(offset + per_page) if len(rows) > per_page else None,
+            cursor_for(max(offset - per_page, 0)) if offset > 0 else None,
+        )
@@ -0,0 +1,145 @@
+from collections import defaultdict
+from itertools import chain
+from sqlalchemy import event, select, update, func, case, and_
+from app import db
+from app.models import Product, Review
+
+PRODUCT_TABLE = Product.__table__
+REVIEW_TABLE = Review.__table__
+STARS = range(1, 6)
+REPAIR_CHUNK_SIZE = 5000
+
+
+def _histogram_columns():
+    return [PRODUCT_TABLE.c[f"rating_{stars}"] for stars in STARS]
+
+
+class RatingService:
+    @staticmethod
+    def apply_deltas(connection, deltas):
+        """
+        Применяет изменения числа оценок к агрегатам товаров.
+        deltas — {product_id: {звезды: изменение}}. Обновление делается
+        одним UPDATE на товар с инкрементами в SQL, поэтому параллельные
+        отзывы не теряются.
+        """
+        for product_id, changes in deltas.items():
+            changes = {stars: delta for stars, delta in changes.items() if delta and stars in STARS}
+            if not changes:
+                continue
+            old_sum = sum(stars * column for stars, column in zip(STARS, _histogram_columns()))
+            new_count = PRODUCT_TABLE.c.rating_count + sum(changes.values())
+            new_sum = old_sum + sum(stars * delta for stars, delta in changes.items())
+            values = [
+                # Первым: MySQL вычисляет SET слева направо уже с новыми значениями
+                (
+                    PRODUCT_TABLE.c.rating_avg,
+                    case((new_count > 0, new_sum * 1.0 / new_count), else_=0),
+                ),
+                (PRODUCT_TABLE.c.rating_count, new_count),
+            ] + [
+                (PRODUCT_TABLE.c[f"rating_{stars}"], PRODUCT_TABLE.c[f"rating_{stars}"] + delta)
+                for stars, delta in sorted(changes.items())
+            ]
+            connection.execute(
+                update(PRODUCT_TABLE)
+                .where(PRODUCT_TABLE.c.id == product_id)
+                .ordered_values(*values)
+            )
+
+    @staticmethod
+    def recompute(product_ids=None, chunk_size=REPAIR_CHUNK_SIZE, echo=None):
+        """
+        Пересчитывает агрегаты из таблицы review (все товары порциями
+        по id или только product_ids). Возвращает число товаров.
+        """
+
+        def star_count(stars):
+            return (
+                select(func.count())
+                .where(REVIEW_TABLE.c.product_id == PRODUCT_TABLE.c.id, REVIEW_TABLE.c.rating == stars)
+                .scalar_subquery()
+            )
+
+        values = {f"rating_{stars}": star_count(stars) for stars in STARS}
+        values["rating_count"] = (
+            select(func.count())
+            .where(REVIEW_TABLE.c.product_id == PRODUCT_TABLE.c.id)
+            .scalar_subquery()
+        )
+        values["rating_avg"] = (
+            select(func.coalesce(func.avg(REVIEW_TABLE.c.rating), 0))
+            .where(REVIEW_TABLE.c.product_id == PRODUCT_TABLE.c.id)
+            .scalar_subquery()
+        )
+        statement = update(PRODUCT_TABLE).values(**values)
+
+        if product_ids is not None:
+            product_ids = sorted(set(product_ids))
+            for start in range(0, len(product_ids), chunk_size):
+                db.session.execute(
+                    statement.where(PRODUCT_TABLE.c.id.in_(product_ids[start:start + chunk_size]))
+                )
+            db.session.commit()
+            return len(product_ids)
+
+        last_id = 0
+        max_id = db.session.query(func.max(Product.id)).scalar() or 0
+        while last_id < max_id:
+            db.session.execute(
+                statement.where(
+                    and_(PRODUCT_TABLE.c.id > last_id, PRODUCT_TABLE.c.id <= last_id + chunk_size)
+                )
+            )
+            db.session.commit()
+            last_id += chunk_size
+            if echo:
+                echo(f"Пересчитано до id {min(last_id, max_id)}")
+        return db.session.query(func.count(Product.id)).scalar()
+
+
+def _load_previous(target, value, oldvalue, initiator):
+    return value
+
+
+# Прежние оценка и товар нужны, чтобы вычесть старый вклад: с active_history
+# они загружаются при присваивании, даже если отзыв истек после коммита
+for name in ("rating", "product_id"):
+    event.listen(getattr(Review, name), "set", _load_previous, active_history=True)
+
+
+@event.listens_for(db.session, "after_flush")
+def sync_product_ratings(session, flush_context):
+    """Поддерживает агрегаты рейтинга товара при добавлении, изменении и удалении отзывов."""
+    deltas = defaultdict(lambda: defaultdict(int))
+    for obj in session.new:
+        if isinstance(obj, Review):
+            deltas[obj.product_id][obj.rating] += 1
+    for obj in session.deleted:
+        if isinstance(obj, Review):
+            deltas[obj.product_id][obj.rating] -= 1
+    for obj in session.dirty:
+        if not isinstance(obj, Review):
+            continue
+        attrs = db.inspect(obj).attrs
+        rating, product_id = attrs.rating.history, attrs.product_id.history
+        if not (rating.has_changes() or product_id.has_changes()):
+            continue
+        old_rating = rating.deleted[0] if rating.deleted else obj.rating
+        old_product_id = product_id.deleted[0] if product_id.deleted else obj.product_id
+        deltas[old_product_id][old_rating] -= 1
+        deltas[obj.product_id][obj.rating] += 1
+    # Рейтинг и отзывы — часть карточек и страницы товара: версия каталога
+    # меняется после коммита (см. app.utils._publish_catalog_change)
+    changed = {
+        obj.product_id
+        for obj in chain(session.new, session.dirty, session.deleted)
+        if isinstance(obj, Review)
+    }
+    changed.update(deltas)
+    changed.discard(None)
+    if changed:
+        session.info.setdefault("catalog_changed", set()).update(changed)
+    deltas.pop(None, None)
+    if deltas:
+        RatingService.apply_deltas(session.connection(), deltas)
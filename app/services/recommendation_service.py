@@ -0,0 +1,336 @@
+import os
+import time
+from itertools import chain
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select, delete, insert, and_
+from app import db, cache, celery
+from app.models import Product, Order, OrderItem, ProductRecommendation, wishlist_items
+
+try:
+    import numpy as np
+except ImportError:  # Без NumPy рекомендации не пересчитываются, блок берет товары категории
+    np = None
+
+TOP_K = 12
+WISHLIST_WEIGHT = 0.3  # вклад пары из одного списка желаний относительно совместной покупки
+SUPPORT_DAMPING = 2.0  # пары с малым числом совпадений получают меньший вес
+MAX_BASKET_SIZE = 50  # крупные (оптовые) заказы обрезаются: пар в корзине ~ k^2
+READ_CHUNK_SIZE = 500000
+WRITE_CHUNK_SIZE = 10000
+# Позиции заказов моложе этого не читаются: их транзакции могут быть еще не закоммичены
+SAFETY_LAG = timedelta(minutes=5)
+RECOMMENDATION_TABLE = ProductRecommendation.__table__
+VERSION_KEY = "recommendations_version"
+
+
+def basket_pairs(baskets, products):
+    """
+    Векторный подсчет совместных вхождений товаров в корзины.
+    baskets, products — массивы одинаковой длины (корзина, товар).
+    Возвращает (ключи пар a << 32 | b при a < b, число корзин с парой,
+    id товаров, число корзин с товаром).
+    """
+    order = np.lexsort((products, baskets))
+    baskets, products = baskets[order], products[order]
+    # Повтор товара в корзине считается один раз
+    keep = np.ones(len(baskets), dtype=bool)
+    keep[1:] = (baskets[1:] != baskets[:-1]) | (products[1:] != products[:-1])
+    baskets, products = baskets[keep], products[keep]
+    if not len(products):
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, empty
+
+    starts = np.flatnonzero(np.r_[True, baskets[1:] != baskets[:-1]])
+    sizes = np.diff(np.r_[starts, len(baskets)])
+    position = np.arange(len(products)) - np.repeat(starts, sizes)
+    if sizes.max() > MAX_BASKET_SIZE:
+        products = products[position < MAX_BASKET_SIZE]
+        sizes = np.minimum(sizes, MAX_BASKET_SIZE)
+        starts = np.r_[0, np.cumsum(sizes)[:-1]]
+
+    # Для каждого элемента корзины размера k — k пар со всеми элементами той же корзины
+    element_sizes = np.repeat(sizes, sizes)
+    element_starts = np.repeat(starts, sizes)
+    left = np.repeat(np.arange(len(products)), element_sizes)
+    offsets = np.cumsum(element_sizes) - element_sizes
+    right = np.repeat(element_starts, element_sizes) + (
+        np.arange(len(left)) - np.repeat(offsets, element_sizes)
+    )
+    a, b = products[left].astype(np.int64), products[right].astype(np.int64)
+    mask = a < b
+    pair_keys, pair_counts = np.unique((a[mask] << 32) | b[mask], return_counts=True)
+    item_ids, item_counts = np.unique(products, return_counts=True)
+    return pair_keys, pair_counts, item_ids, item_counts
+
+
+def merge_counts(keys, weights, new_keys, new_weights):
+    """Складывает два разреженных вектора счетчиков (отсортированные ключи)."""
+    if not len(keys):
+        return new_keys, np.asarray(new_weights, dtype=np.float64)
+    merged, inverse = np.unique(np.concatenate([keys, new_keys]), return_inverse=True)
+    return merged, np.bincount(inverse, weights=np.concatenate([weights, new_weights]))
+
+
+class CoPurchaseState:
+    """
+    Накопленные с прошлых запусков счетчики по заказам: пары товаров,
+    число заказов с товаром и id последней обработанной позиции заказа.
+    Хранится в одном .npz, поэтому следующий запуск читает только новые
+    позиции.
+    """
+
+    def __init__(self, pair_keys=None, pair_weights=None, item_ids=None, item_weights=None, last_item_id=0):
+        empty = np.zeros(0, dtype=np.int64)
+        self.pair_keys = empty if pair_keys is None else pair_keys
+        self.pair_weights = np.zeros(0) if pair_weights is None else pair_weights
+        self.item_ids = empty if item_ids is None else item_ids
+        self.item_weights = np.zeros(0) if item_weights is None else item_weights
+        self.last_item_id = int(last_item_id)
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return cls()
+        with np.load(path) as data:
+            return cls(
+                data["pair_keys"],
+                data["pair_weights"],
+                data["item_ids"],
+                data["item_weights"],
+                int(data["last_item_id"]),
+            )
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as state_file:
+            np.savez(
+                state_file,
+                pair_keys=self.pair_keys,
+                pair_weights=self.pair_weights,
+                item_ids=self.item_ids,
+                item_weights=self.item_weights,
+                last_item_id=np.int64(self.last_item_id),
+            )
+        os.replace(path + ".tmp", path)
+
+    def add(self, baskets, products, weight=1.0):
+        pair_keys, pair_counts, item_ids, item_counts = basket_pairs(baskets, products)
+        self.pair_keys, self.pair_weights = merge_counts(
+            self.pair_keys, self.pair_weights, pair_keys, pair_counts * weight
+        )
+        self.item_ids, self.item_weights = merge_counts(
+            self.item_ids, self.item_weights, item_ids, item_counts * weight
+        )
+
+
+def top_neighbours(pair_keys, pair_weights, item_ids, item_weights, k=TOP_K):
+    """
+    Top-K соседей каждого товара по косинусной близости корзин
+    w(a, b) / sqrt(n(a) * n(b)), приглушенной для пар с малым числом
+    совпадений. Возвращает массивы (товар, ранг, сосед, оценка),
+    упорядоченные по товару и рангу.
+    """
+    a, b = pair_keys >> 32, pair_keys & 0xFFFFFFFF
+    source, target = np.concatenate([a, b]), np.concatenate([b, a])
+    weights = np.concatenate([pair_weights, pair_weights])
+    popularity = item_weights[np.searchsorted(item_ids, source)] * item_weights[
+        np.searchsorted(item_ids, target)
+    ]
+    scores = weights / np.sqrt(popularity) * (weights / (weights + SUPPORT_DAMPING))
+    order = np.lexsort((target, -scores, source))
+    source, target, scores = source[order], target[order], scores[order]
+    starts = np.flatnonzero(np.r_[True, source[1:] != source[:-1]])
+    sizes = np.diff(np.r_[starts, len(source)])
+    ranks = np.arange(len(source)) - np.repeat(starts, sizes)
+    keep = ranks < k
+    return source[keep], ranks[keep], target[keep], scores[keep]
+
+
+class RecommendationService:
+    @staticmethod
+    def state_path():
+        directory = current_app.config.get("RECOMMENDATIONS_STATE_DIR") or os.path.join(
+            current_app.instance_path, "recommendations"
+        )
+        return os.path.join(directory, "co_purchase.npz")
+
+    @staticmethod
+    def version():
+        """Меняется после каждого пересчета (валидаторы условных GET страниц товара)."""
+        try:
+            return cache.get(VERSION_KEY) or 0
+        except:
+            return 0
+
+    @staticmethod
+    def related_products(product, limit=4, options=()):
+        """
+        Похожие товары: предрасчитанные соседи (чтение по первичному
+        ключу product_recommendation), недостающие — из той же категории.
+        """
+        products = (
+            Product.query.options(*options)
+            .join(ProductRecommendation, ProductRecommendation.recommended_id == Product.id)
+            .filter(ProductRecommendation.product_id == product.id)
+            .order_by(ProductRecommendation.rank)
+            .limit(limit)
+            .all()
+        )
+        if len(products) < limit:
+            exclude = [product.id] + [p.id for p in products]
+            products += (
+                Product.query.options(*options)
+                .filter(Product.category_id == product.category_id, Product.id.notin_(exclude))
+                .limit(limit - len(products))
+                .all()
+            )
+        return products
+
+    @staticmethod
+    def _read_upper_bound():
+        """Последняя позиция заказа, созданного раньше SAFETY_LAG."""
+        last_order_id = db.session.execute(
+            select(Order.id)
+            .where(Order.created_at <= datetime.utcnow() - SAFETY_LAG)
+            .order_by(Order.created_at.desc())
+            .limit(1)
+        ).scalar()
+        if last_order_id is None:
+            return 0
+        return db.session.execute(
+            select(OrderItem.id)
+            .where(OrderItem.order_id == last_order_id)
+            .order_by(OrderItem.id.desc())
+            .limit(1)
+        ).scalar() or 0
+
+    @staticmethod
+    def build(full=False, echo=None):
+        """
+        Пересчитывает рекомендации: добавляет к накопленным счетчикам
+        позиции заказов после последнего запуска, заново считает пары из
+        списков желаний (они меняются и удаляются) и переписывает таблицу
+        product_recommendation. Возвращает статистику запуска.
+        """
+        if np is None:
+            raise RuntimeError("Для расчета рекомендаций нужен numpy")
+        timings = {}
+        started = time.perf_counter()
+        path = RecommendationService.state_path()
+        state = CoPurchaseState() if full else CoPurchaseState.load(path)
+        upper = RecommendationService._read_upper_bound()
+
+        # 1. Новые позиции заказов порциями по id. Хвост последнего заказа
+        # порции переносится в следующую, чтобы корзина не разрывалась
+        carry = np.zeros((0, 3), dtype=np.int64)
+        last_id = state.last_item_id
+        new_items = 0
+        while last_id < upper:
+            chunk_end = min(last_id + READ_CHUNK_SIZE, upper)
+            rows = db.session.execute(
+                select(OrderItem.id, OrderItem.order_id, OrderItem.product_id)
+                .where(and_(OrderItem.id > last_id, OrderItem.id <= chunk_end))
+                .order_by(OrderItem.id)
+            ).all()
+            last_id = chunk_end
+            if not rows:
+                continue
+            new_items += len(rows)
+            # fromiter по плоской последовательности в ~100 раз быстрее np.array(rows)
+            fetched = np.fromiter(
+                chain.from_iterable(rows), dtype=np.int64, count=3 * len(rows)
+            ).reshape(-1, 3)
+            items = np.concatenate([carry, fetched])
+            if chunk_end < upper:
+                tail = items[:, 1] == items[-1, 1]
+                carry, items = items[tail], items[~tail]
+            else:
+                carry = carry[:0]
+            state.add(items[:, 1], items[:, 2])
+            if echo:
+                echo(f"Обработаны позиции заказов до id {chunk_end}")
+        state.last_item_id = max(state.last_item_id, upper)
+        timings["orders"] = time.perf_counter() - started
+
+        # 2. Списки желаний: считаются целиком в каждом запуске, в состояние не попадают
+        step = time.perf_counter()
+        rows = db.session.execute(
+            select(wishlist_items.c.user_id, wishlist_items.c.product_id)
+        ).all()
+        wishlist = np.fromiter(
+            chain.from_iterable(rows), dtype=np.int64, count=2 * len(rows)
+        ).reshape(-1, 2)
+        combined = CoPurchaseState(
+            state.pair_keys, state.pair_weights, state.item_ids, state.item_weights
+        )
+        combined.add(wishlist[:, 0], wishlist[:, 1], weight=WISHLIST_WEIGHT)
+        timings["wishlist"] = time.perf_counter() - step
+
+        step = time.perf_counter()
+        neighbours = top_neighbours(
+            combined.pair_keys, combined.pair_weights, combined.item_ids, combined.item_weights
+        )
+        timings["top_k"] = time.perf_counter() - step
+
+        step = time.perf_counter()
+        RecommendationService._write(*neighbours)
+        state.save(path)
+        try:
+            cache.set(VERSION_KEY, time.time_ns(), timeout=0)
+        except:
+            pass  # Игнорируем ошибку кэша
+        timings["write"] = time.perf_counter() - step
+        timings["total"] = time.perf_counter() - started
+        return {
+            "order_items": new_items,
+            "pairs": len(combined.pair_keys),
+            "products": len(np.unique(neighbours[0])),
+            "rows": len(neighbours[0]),
+            "timings": timings,
+        }
+
+    @staticmethod
+    def _write(sources, ranks, targets, scores):
+        """Переписывает таблицу диапазонами товаров: блокировки держатся недолго."""
+        existing = np.fromiter(db.session.execute(select(Product.id)).scalars(), dtype=np.int64)
+        # Товары, удаленные после покупки, не рекомендуются (ранги могут иметь пропуски)
+        keep = np.isin(sources, existing) & np.isin(targets, existing)
+        sources, ranks, targets, scores = sources[keep], ranks[keep], targets[keep], scores[keep]
+        max_id = int(existing.max()) if len(existing) else 0
+        for low_id in range(0, max_id, WRITE_CHUNK_SIZE):
+            high_id = low_id + WRITE_CHUNK_SIZE
+            start, end = np.searchsorted(sources, [low_id, high_id], side="right")
+            db.session.execute(
+                delete(RECOMMENDATION_TABLE).where(
+                    and_(
+                        RECOMMENDATION_TABLE.c.product_id > low_id,
+                        RECOMMENDATION_TABLE.c.product_id <= high_id,
+                    )
+                )
+            )
+            if end > start:
+                db.session.execute(
+                    insert(RECOMMENDATION_TABLE),
+                    [
+                        {"product_id": s, "rank": r, "recommended_id": t, "score": w}
+                        for s, r, t, w in zip(
+                            sources[start:end].tolist(),
+                            ranks[start:end].tolist(),
+                            targets[start:end].tolist(),
+                            scores[start:end].tolist(),
+                        )
+                    ],
+                )
+            db.session.commit()
+
+
+@celery.task
+def build_recommendations(full=False):
+    """Фоновая задача Celery: инкрементальный пересчет рекомендаций."""
+    result = RecommendationService.build(full=full)
+    current_app.logger.info(
+        f"Рекомендации: {result['order_items']} новых позиций, {result['rows']} строк, "
+        f"{result['timings']['total']:.1f} с"
+    )
+    return {key: value for key, value in result.items() if key != "timings"}
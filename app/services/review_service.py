@@ -0,0 +1,48 @@
+from datetime import datetime
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
+from app.models import Review
+from app.services.pagination_service import encode_cursor, decode_cursor
+
+REVIEWS_PER_PAGE = 10
+MAX_REVIEWS_PER_PAGE = 50
+
+
+class ReviewService:
+    @staticmethod
+    def page(product_id, cursor=None, per_page=REVIEWS_PER_PAGE):
+        """
+        Отзывы товара от новых к старым, по курсору (created_at, id)
+        последнего показанного отзыва. Индекс idx_review_product_created
+        отдает страницу без сортировки всех отзывов товара.
+        Возвращает (отзывы, курсор следующей страницы или None).
+        Некорректный курсор — ValueError.
+        """
+        per_page = max(1, min(per_page, MAX_REVIEWS_PER_PAGE))
+        query = Review.query.options(joinedload(Review.author)).filter(
+            Review.product_id == product_id
+        )
+        if cursor:
+            state = decode_cursor(cursor)
+            try:
+                created_at = datetime.fromisoformat(state["t"])
+                last_id = int(state["id"])
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError("Некорректный курсор") from e
+            query = query.filter(
+                and_(
+                    Review.created_at <= created_at,
+                    or_(Review.created_at < created_at, Review.id < last_id),
+                )
+            )
+        rows = (
+            query.order_by(Review.created_at.desc(), Review.id.desc())
+            .limit(per_page + 1)
+            .all()
+        )
+        reviews = rows[:per_page]
+        next_cursor = None
+        if len(rows) > per_page:
+            last = reviews[-1]
+            next_cursor = encode_cursor({"t": last.created_at.isoformat(), "id": last.id})
+        return reviews, next_cursor
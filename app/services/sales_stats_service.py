@@ -0,0 +1,325 @@
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta
+from sqlalchemy import event, select, insert, update, delete, func, case, and_
+from app import db, celery
+from app.models import Order, OrderItem, User, Product, SalesDaily, ProductSalesDaily, SignupDaily
+
+SALES_TABLE = SalesDaily.__table__
+PRODUCT_SALES_TABLE = ProductSalesDaily.__table__
+SIGNUP_TABLE = SignupDaily.__table__
+# Таблица итогов: (таблица, ключевые колонки, счетчики). Строка удаляется,
+# когда первый счетчик доходит до нуля
+ROLLUPS = {
+    "sales": (SALES_TABLE, ("day", "status"), ("orders_count", "amount")),
+    "products": (PRODUCT_SALES_TABLE, ("day", "product_id"), ("units", "revenue")),
+    "signups": (SIGNUP_TABLE, ("day",), ("users_count",)),
+}
+# Поля, изменение которых меняет вклад записи в итоги
+TRACKED_FIELDS = {
+    Order: ("created_at", "status", "final_amount"),
+    OrderItem: ("order_id", "product_id", "quantity", "price"),
+    User: ("created_at",),
+}
+PAID_STATUS = "Paid"
+# Сколько последних дней периодическая задача сверяет с заказами
+RECONCILE_DAYS = 2
+REBUILD_CHUNK_DAYS = 31
+MONTH_LABELS = ("Янв", "Фев", "Мар", "Апр", "Май", "Июн", "Июл", "Авг", "Сен", "Окт", "Ноя", "Дек")
+
+
+def _new_deltas():
+    return {name: defaultdict(Counter) for name in ROLLUPS}
+
+
+def _paid_amount():
+    return func.coalesce(
+        func.sum(case((SalesDaily.status == PAID_STATUS, SalesDaily.amount), else_=0)), 0
+    )
+
+
+def _period(column, start, end):
+    """Условия на день в пределах [start, end]; None — без границы."""
+    criteria = []
+    if start is not None:
+        criteria.append(column >= start)
+    if end is not None:
+        criteria.append(column <= end)
+    return criteria
+
+
+class SalesStatsService:
+    """
+    Дневные итоги продаж для панели администратора: заказы и сумма по
+    статусам (sales_daily), штуки и сумма по товарам (product_sales_daily),
+    регистрации (signup_daily). Записи заказов через ORM меняют итоги в той
+    же транзакции; периодическая задача сверяет последние дни с заказами,
+    rebuild пересчитывает любой период. Дни — по UTC, как Order.created_at.
+    """
+
+    @staticmethod
+    def apply_deltas(connection, deltas):
+        """
+        Применяет изменения счетчиков: {таблица: {ключ: Counter(счетчик: изменение)}}.
+        Один UPDATE с инкрементом в SQL на ключ, INSERT — если строки еще нет.
+        """
+        for name, changes in deltas.items():
+            table, keys, counters = ROLLUPS[name]
+            touched_days = set()
+            for key, values in changes.items():
+                values = {column: values[column] for column in counters if values[column]}
+                if not values or key[0] is None:
+                    continue
+                touched_days.add(key[0])
+                match = and_(*(table.c[column] == value for column, value in zip(keys, key)))
+                result = connection.execute(
+                    update(table)
+                    .where(match)
+                    .values({column: table.c[column] + delta for column, delta in values.items()})
+                )
+                if result.rowcount == 0:
+                    connection.execute(
+                        insert(table).values(
+                            dict(zip(keys, key), **{column: values.get(column, 0) for column in counters})
+                        )
+                    )
+            if touched_days:
+                connection.execute(
+                    delete(table).where(table.c.day.in_(touched_days), table.c[counters[0]] <= 0)
+                )
+
+    @staticmethod
+    def rebuild(start=None, end=None, echo=None):
+        """
+        Пересчитывает итоги за дни [start, end] из заказов и пользователей
+        порциями по REBUILD_CHUNK_DAYS дней, по транзакции на порцию.
+        Без start — с первого заказа или регистрации. Возвращает число дней.
+        """
+        end = end or datetime.utcnow().date()
+        if start is None:
+            first = [
+                value
+                for value in (
+                    db.session.query(func.min(Order.created_at)).scalar(),
+                    db.session.query(func.min(User.created_at)).scalar(),
+                )
+                if value is not None
+            ]
+            start = min(first).date() if first else end
+        day, days = start, 0
+        while day <= end:
+            last = min(day + timedelta(days=REBUILD_CHUNK_DAYS - 1), end)
+            SalesStatsService._rebuild_range(db.session.connection(), day, last)
+            db.session.commit()
+            days += (last - day).days + 1
+            if echo:
+                echo(f"Итоги пересчитаны по {last.isoformat()}")
+            day = last + timedelta(days=1)
+        return days
+
+    @staticmethod
+    def _rebuild_range(connection, first, last):
+        low = datetime.combine(first, time.min)
+        high = datetime.combine(last + timedelta(days=1), time.min)
+        for table, _, _ in ROLLUPS.values():
+            connection.execute(delete(table).where(table.c.day >= first, table.c.day <= last))
+
+        order_day = func.date(Order.created_at, type_=db.Date)
+        connection.execute(
+            insert(SALES_TABLE).from_select(
+                ["day", "status", "orders_count", "amount"],
+                select(
+                    order_day,
+                    func.coalesce(Order.status, ""),
+                    func.count(),
+                    func.coalesce(func.sum(Order.final_amount), 0),
+                )
+                .where(Order.created_at >= low, Order.created_at < high)
+                .group_by(order_day, func.coalesce(Order.status, "")),
+            )
+        )
+        connection.execute(
+            insert(PRODUCT_SALES_TABLE).from_select(
+                ["day", "product_id", "units", "revenue"],
+                select(
+                    order_day,
+                    OrderItem.product_id,
+                    func.sum(OrderItem.quantity),
+                    func.sum(OrderItem.quantity * OrderItem.price),
+                )
+                .join(Order, Order.id == OrderItem.order_id)
+                .where(Order.created_at >= low, Order.created_at < high)
+                .group_by(order_day, OrderItem.product_id),
+            )
+        )
+        user_day = func.date(User.created_at, type_=db.Date)
+        connection.execute(
+            insert(SIGNUP_TABLE).from_select(
+                ["day", "users_count"],
+                select(user_day, func.count())
+                .where(User.created_at >= low, User.created_at < high)
+                .group_by(user_day),
+            )
+        )
+
+    @staticmethod
+    def refresh_recent(days=RECONCILE_DAYS):
+        """Сверяет итоги последних days дней (включая сегодня) с заказами."""
+        today = datetime.utcnow().date()
+        return SalesStatsService.rebuild(today - timedelta(days=days - 1), today)
+
+    @staticmethod
+    def summary(start=None, end=None):
+        """Итоги за дни [start, end] (None — без границы): заказы, выручка оплаченных, регистрации."""
+        orders, revenue = db.session.query(
+            func.coalesce(func.sum(SalesDaily.orders_count), 0), _paid_amount()
+        ).filter(*_period(SalesDaily.day, start, end)).one()
+        users = (
+            db.session.query(func.coalesce(func.sum(SignupDaily.users_count), 0))
+            .filter(*_period(SignupDaily.day, start, end))
+            .scalar()
+        )
+        return {"orders": int(orders), "revenue": revenue, "new_users": int(users)}
+
+    @staticmethod
+    def daily_series(start, end):
+        """Заказы и выручка оплаченных по каждому дню [start, end], дни без заказов — нули."""
+        rows = {
+            day: (orders, revenue)
+            for day, orders, revenue in db.session.query(
+                SalesDaily.day, func.sum(SalesDaily.orders_count), _paid_amount()
+            )
+            .filter(*_period(SalesDaily.day, start, end))
+            .group_by(SalesDaily.day)
+        }
+        series = []
+        for offset in range((end - start).days + 1):
+            day = start + timedelta(days=offset)
+            orders, revenue = rows.get(day, (0, 0))
+            series.append({"day": day, "orders": int(orders), "revenue": float(revenue)})
+        return series
+
+    @staticmethod
+    def monthly_revenue(months=12):
+        """Выручка оплаченных заказов по месяцам: [(подпись, сумма)], последний — текущий месяц."""
+        today = datetime.utcnow().date()
+        keys = []
+        year, month = today.year, today.month
+        for _ in range(months):
+            keys.append((year, month))
+            year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+        keys.reverse()
+        start = datetime(keys[0][0], keys[0][1], 1).date()
+        totals = Counter()
+        for day, revenue in (
+            db.session.query(SalesDaily.day, _paid_amount())
+            .filter(SalesDaily.day >= start)
+            .group_by(SalesDaily.day)
+        ):
+            totals[(day.year, day.month)] += float(revenue)
+        return [(f"{MONTH_LABELS[month - 1]} {year % 100:02d}", float(totals[(year, month)])) for year, month in keys]
+
+    @staticmethod
+    def status_counts(start=None, end=None):
+        """{статус: число заказов} за дни [start, end]."""
+        return {
+            status: int(count)
+            for status, count in db.session.query(SalesDaily.status, func.sum(SalesDaily.orders_count))
+            .filter(*_period(SalesDaily.day, start, end))
+            .group_by(SalesDaily.status)
+        }
+
+    @staticmethod
+    def top_products(limit=5, start=None, end=None):
+        """Самые продаваемые товары: строки (name, total_sold, revenue)."""
+        total_sold = func.sum(ProductSalesDaily.units)
+        return (
+            db.session.query(
+                Product.name,
+                total_sold.label("total_sold"),
+                func.sum(ProductSalesDaily.revenue).label("revenue"),
+            )
+            .join(Product, Product.id == ProductSalesDaily.product_id)
+            .filter(*_period(ProductSalesDaily.day, start, end))
+            .group_by(Product.id, Product.name)
+            .order_by(total_sold.desc())
+            .limit(limit)
+            .all()
+        )
+
+
+def _contribution(session, obj, current):
+    """
+    Вклад записи в итоги: (таблица, ключ, счетчики). current=False —
+    вклад до изменений текущего flush (прежние значения полей).
+    """
+    state = db.inspect(obj)
+
+    def value(name):
+        if current:
+            return getattr(obj, name)
+        history = state.attrs[name].history
+        return history.deleted[0] if history.deleted else state.attrs[name].value
+
+    if isinstance(obj, Order):
+        created_at = value("created_at")
+        return (
+            "sales",
+            (created_at and created_at.date(), value("status") or ""),
+            {"orders_count": 1, "amount": value("final_amount") or 0},
+        )
+    if isinstance(obj, OrderItem):
+        order = session.get(Order, value("order_id"))
+        quantity, price = value("quantity") or 0, value("price") or 0
+        return (
+            "products",
+            (order and order.created_at and order.created_at.date(), value("product_id")),
+            {"units": quantity, "revenue": quantity * price},
+        )
+    created_at = value("created_at")
+    return "signups", (created_at and created_at.date(),), {"users_count": 1}
+
+
+def _count(deltas, contribution, sign):
+    name, key, values = contribution
+    for column, delta in values.items():
+        deltas[name][key][column] += sign * delta
+
+
+def _load_previous(target, value, oldvalue, initiator):
+    return value
+
+
+# Прежнее значение нужно, чтобы вычесть прежний вклад: с active_history оно
+# загружается при присваивании, даже если атрибут истек после коммита
+for model_class, fields in TRACKED_FIELDS.items():
+    for name in fields:
+        event.listen(getattr(model_class, name), "set", _load_previous, active_history=True)
+
+
+@event.listens_for(db.session, "after_flush")
+def sync_sales_stats(session, flush_context):
+    """Новые, удаленные и измененные заказы, позиции и пользователи меняют дневные итоги."""
+    deltas = _new_deltas()
+    for obj in session.new:
+        if type(obj) in TRACKED_FIELDS:
+            _count(deltas, _contribution(session, obj, True), 1)
+    for obj in session.deleted:
+        if type(obj) in TRACKED_FIELDS:
+            _count(deltas, _contribution(session, obj, False), -1)
+    for obj in session.dirty:
+        fields = TRACKED_FIELDS.get(type(obj))
+        if not fields or obj in session.deleted:
+            continue
+        attrs = db.inspect(obj).attrs
+        if not any(attrs[name].history.has_changes() for name in fields):
+            continue
+        _count(deltas, _contribution(session, obj, False), -1)
+        _count(deltas, _contribution(session, obj, True), 1)
+    if any(deltas.values()):
+        SalesStatsService.apply_deltas(session.connection(), deltas)
+
+
+@celery.task
+def refresh_sales_stats(days=RECONCILE_DAYS):
+    """Фоновая задача Celery: сверка итогов последних дней с заказами."""
+    return SalesStatsService.refresh_recent(days)
@@ -0,0 +1,301 @@
+import re
+from collections import Counter
+from functools import lru_cache
+import snowballstemmer
+from flask import current_app
+from sqlalchemy import event, select, func
+from app import db, celery
+from app.models import Product, Brand, Category, SearchTerm
+from app.utils import enqueue_task
+
+TERM_TABLE = SearchTerm.__table__
+# Вес совпадения в зависимости от поля товара
+FIELD_WEIGHTS = {"name": 10, "sku": 8, "brand": 5, "category": 4, "description": 1}
+# Изменение этих полей товара требует переиндексации
+INDEXED_FIELDS = ("name", "sku", "description", "brand_id", "category_id", "brand", "category")
+MAX_QUERY_TERMS = 6
+MAX_TERM_LENGTH = 64
+REINDEX_CHUNK_SIZE = 1000
+# Словарь каталога невелик: основы слов кэшируются (массовый импорт и переиндексация)
+STEM_CACHE_SIZE = 100000
+
+TOKEN_RE = re.compile(r"[0-9a-zа-я]+")
+CYRILLIC_RE = re.compile(r"[а-я]")
+_stemmers = {
+    "ru": snowballstemmer.stemmer("russian"),
+    "en": snowballstemmer.stemmer("english"),
+}
+
+
+def tokenize(text):
+    """Разбивает текст на слова в нижнем регистре (ё приводится к е)."""
+    if not text:
+        return []
+    return TOKEN_RE.findall(str(text).lower().replace("ё", "е"))
+
+
+def stem(token):
+    """Приводит слово к основе русским или английским стеммером Snowball."""
+    if token.isdigit():
+        return token
+    return _stem_word(token)
+
+
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def _stem_word(token):
+    language = "ru" if CYRILLIC_RE.search(token) else "en"
+    return _stemmers[language].stemWord(token)[:MAX_TERM_LENGTH]
+
+
+def analyze(text):
+    return [stem(token) for token in tokenize(text)]
+
+
+class SqlLikeSearchBackend:
+    """Прежний режим поиска: ILIKE по названию, без индекса."""
+
+    def filter_query(self, query, text):
+        return query.filter(Product.name.ilike(f"%{text}%"))
+
+    def rank_query(self, query, text):
+        return self.filter_query(query, text)
+
+    def search_ids(self, text, limit):
+        rows = self.filter_query(db.session.query(Product.id), text).limit(limit)
+        return [product_id for (product_id,) in rows]
+
+    def index_products(self, connection, product_ids):
+        return 0
+
+    def rebuild(self, chunk_size=REINDEX_CHUNK_SIZE, echo=None):
+        return 0
+
+
+class InvertedIndexSearchBackend:
+    """
+    Встроенный поиск: инвертированный индекс search_term по названию,
+    артикулу, бренду, категории и описанию со стеммингом и ранжированием.
+    """
+
+    def _matches(self, text):
+        """
+        Подзапрос (product_id, score) для товаров, содержащих все слова запроса.
+        Последнее слово ищется по префиксу, чтобы поиск работал во время набора.
+        """
+        terms = analyze(text)[:MAX_QUERY_TERMS]
+        if not terms:
+            return None
+        postings = []
+        for position, term in enumerate(terms):
+            if position == len(terms) - 1:
+                # Префикс как диапазон, чтобы использовался первичный ключ
+                upper = term[:-1] + chr(ord(term[-1]) + 1)
+                condition = db.and_(SearchTerm.term >= term, SearchTerm.term < upper)
+            else:
+                condition = SearchTerm.term == term
+            postings.append(
+                select(
+                    SearchTerm.product_id,
+                    func.max(SearchTerm.weight).label("weight"),
+                )
+                .where(condition)
+                .group_by(SearchTerm.product_id)
+            )
+        # Пересечение списков: товар должен встретиться в каждом из них
+        merged = db.union_all(*postings).subquery() if len(postings) > 1 else postings[0].subquery()
+        return (
+            select(merged.c.product_id, func.sum(merged.c.weight).label("score"))
+            .group_by(merged.c.product_id)
+            .having(func.count() == len(postings))
+            .subquery()
+        )
+
+    def filter_query(self, query, text):
+        matches = self._matches(text)
+        if matches is None:
+            return query.filter(db.false())
+        return query.filter(Product.id.in_(select(matches.c.product_id)))
+
+    def rank_query(self, query, text):
+        matches = self._matches(text)
+        if matches is None:
+            return query.filter(db.false())
+        return query.join(matches, matches.c.product_id == Product.id).order_by(
+            matches.c.score.desc(), Product.id
+        )
+
+    def search_ids(self, text, limit):
+        matches = self._matches(text)
+        if matches is None:
+            return []
+        rows = db.session.execute(
+            select(matches.c.product_id)
+            .order_by(matches.c.score.desc(), matches.c.product_id)
+            .limit(limit)
+        )
+        return [product_id for (product_id,) in rows]
+
+    @staticmethod
+    def document_terms(name, sku, description, brand_name, category_name):
+        """Считает веса основ слов для одного товара."""
+        weights = Counter()
+        fields = (
+            ("name", name),
+            ("sku", sku),
+            ("brand", brand_name),
+            ("category", category_name),
+            ("description", description),
+        )
+        for field, text in fields:
+            for term in set(analyze(text)):
+                weights[term] += FIELD_WEIGHTS[field]
+        sku_term = "".join(tokenize(sku))[:MAX_TERM_LENGTH]
+        if sku_term:
+            weights[sku_term] += FIELD_WEIGHTS["sku"]
+        return weights
+
+    def index_products(self, connection, product_ids):
+        """Переиндексирует переданные товары (удаленные просто исчезают из индекса)."""
+        product_ids = list(product_ids)
+        if not product_ids:
+            return 0
+        connection.execute(
+            TERM_TABLE.delete().where(TERM_TABLE.c.product_id.in_(product_ids))
+        )
+        products = connection.execute(
+            select(
+                Product.id,
+                Product.name,
+                Product.sku,
+                Product.description,
+                Brand.name,
+                Category.name,
+            )
+            .outerjoin(Brand, Brand.id == Product.brand_id)
+            .outerjoin(Category, Category.id == Product.category_id)
+            .where(Product.id.in_(product_ids))
+        )
+        rows = [
+            {"term": term, "product_id": product_id, "weight": weight}
+            for product_id, *fields in products
+            for term, weight in self.document_terms(*fields).items()
+        ]
+        for start in range(0, len(rows), REINDEX_CHUNK_SIZE):
+            connection.execute(TERM_TABLE.insert(), rows[start:start + REINDEX_CHUNK_SIZE])
+        return len(rows)
+
+    def rebuild(self, chunk_size=REINDEX_CHUNK_SIZE, echo=None):
+        """Перестраивает индекс целиком, обходя товары порциями по id."""
+        db.session.execute(TERM_TABLE.delete())
+        db.session.commit()
+        last_id, total = 0, 0
+        while True:
+            product_ids = [
+                product_id
+                for (product_id,) in db.session.query(Product.id)
+                .filter(Product.id > last_id)
+                .order_by(Product.id)
+                .limit(chunk_size)
+            ]
+            if not product_ids:
+                break
+            self.index_products(db.session.connection(), product_ids)
+            db.session.commit()
+            last_id = product_ids[-1]
+            total += len(product_ids)
+            if echo:
+                echo(f"Проиндексировано товаров: {total}")
+        return total
+
+
+SEARCH_BACKENDS = {
+    "sql": SqlLikeSearchBackend,
+    "index": InvertedIndexSearchBackend,
+}
+_backend_instances = {}
+
+
+class SearchService:
+    """Единая точка поиска для каталога, автодополнения и мобильного API."""
+
+    @staticmethod
+    def backend():
+        name = current_app.config.get("SEARCH_BACKEND", "index")
+        if name not in _backend_instances:
+            _backend_instances[name] = SEARCH_BACKENDS[name]()
+        return _backend_instances[name]
+
+    @staticmethod
+    def filter_query(query, text):
+        """Оставляет в запросе товаров только найденные по тексту."""
+        return SearchService.backend().filter_query(query, text)
+
+    @staticmethod
+    def rank_query(query, text):
+        """Фильтрует запрос товаров и сортирует его по релевантности."""
+        return SearchService.backend().rank_query(query, text)
+
+    @staticmethod
+    def search_ids(text, limit=10):
+        """Возвращает id самых релевантных товаров."""
+        return SearchService.backend().search_ids(text, limit)
+
+
+@event.listens_for(db.session, "after_flush")
+def update_search_index(session, flush_context):
+    """Инкрементально обновляет поисковый индекс при записи товаров."""
+    product_ids = set()
+    for obj in session.new:
+        if isinstance(obj, Product):
+            product_ids.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            product_ids.add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, Product):
+            state = db.inspect(obj)
+            if any(state.attrs[field].history.has_changes() for field in INDEXED_FIELDS):
+                product_ids.add(obj.id)
+        elif isinstance(obj, (Brand, Category)):
+            if db.inspect(obj).attrs.name.history.has_changes():
+                key = "search_reindex_brands" if isinstance(obj, Brand) else "search_reindex_categories"
+                session.info.setdefault(key, set()).add(obj.id)
+    if product_ids:
+        SearchService.backend().index_products(session.connection(), product_ids)
+
+
+@event.listens_for(db.session, "after_commit")
+def schedule_search_reindex(session):
+    """Переименование бренда или категории переиндексирует их товары в фоне."""
+    brand_ids = session.info.pop("search_reindex_brands", set())
+    category_ids = session.info.pop("search_reindex_categories", set())
+    if not brand_ids and not category_ids:
+        return
+    try:
+        enqueue_task(
+            reindex_search_products, brand_ids=list(brand_ids), category_ids=list(category_ids)
+        )
+    except Exception as e:
+        current_app.logger.warning(f"Не удалось запланировать переиндексацию поиска: {e}")
+
+
+@event.listens_for(db.session, "after_rollback")
+def discard_search_reindex(session):
+    session.info.pop("search_reindex_brands", None)
+    session.info.pop("search_reindex_categories", None)
+
+
+@celery.task
+def reindex_search_products(brand_ids=(), category_ids=()):
+    """Фоновая задача Celery: переиндексирует товары брендов и категорий."""
+    backend = SearchService.backend()
+    query = db.session.query(Product.id).filter(
+        db.or_(Product.brand_id.in_(brand_ids), Product.category_id.in_(category_ids))
+    )
+    product_ids = [product_id for (product_id,) in query]
+    for start in range(0, len(product_ids), REINDEX_CHUNK_SIZE):
+        backend.index_products(
+            db.session.connection(), product_ids[start:start + REINDEX_CHUNK_SIZE]
+        )
+        db.session.commit()
+    return len(product_ids)
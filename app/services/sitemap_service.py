@@ -0,0 +1,190 @@
+import os
+import json
+import hashlib
+from datetime import datetime
+from urllib.parse import quote
+from xml.sax.saxutils import escape
+from flask import current_app, url_for
+from sqlalchemy import select, func, and_
+from app import db, cache
+from app.models import Product, Category
+
+SHARD_SIZE = 50000  # лимит URL в одном файле по протоколу sitemaps.org
+STREAM_BATCH_SIZE = 2000
+INDEX_CACHE_TIMEOUT = 300
+SITEMAP_NS = "http://www.sitemaps.org/schemas/sitemap/0.9"
+# Статические страницы: (endpoint, priority, changefreq)
+STATIC_PAGES = [
+    ("main.index", "1.0", "daily"),
+    ("main.catalog", "0.9", "daily"),
+    ("main.about", "0.5", "monthly"),
+    ("main.shipping", "0.5", "monthly"),
+    ("main.contact", "0.5", "monthly"),
+]
+
+
+def format_lastmod(value):
+    return value.strftime("%Y-%m-%dT%H:%M:%S+00:00")
+
+
+class SitemapShard:
+    """Готовый файл шарда на диске и его заголовки для условных запросов."""
+
+    def __init__(self, path, etag, last_modified):
+        self.path = path
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class SitemapService:
+    """
+    Sitemap — индекс из шардов: страницы сайта с категориями и товары
+    диапазонами id по SHARD_SIZE. Границы шардов не сдвигаются, поэтому
+    изменение товара перегенерирует только его шард. Шард пишется на диск
+    потоково и переписывается, когда меняется его отпечаток (число
+    товаров и max(updated_at) в диапазоне).
+    """
+
+    @staticmethod
+    def directory():
+        return current_app.config.get("SITEMAP_DIR") or os.path.join(
+            current_app.instance_path, "sitemap"
+        )
+
+    @staticmethod
+    def product_shards():
+        """[(номер шарда, число товаров, max(updated_at))] — один проход по idx_product_id_updated."""
+        shard = (Product.id - 1) // SHARD_SIZE
+        rows = db.session.execute(
+            select(shard, func.count(Product.id), func.max(Product.updated_at))
+            .group_by(shard)
+            .order_by(shard)
+        ).all()
+        return [(int(number), count, updated_at) for number, count, updated_at in rows]
+
+    @staticmethod
+    def index_entries():
+        """[(имя файла, lastmod)] для индекса; кэшируется на INDEX_CACHE_TIMEOUT."""
+        try:
+            entries = cache.get("sitemap_index_entries")
+            if entries is not None:
+                return entries
+        except:
+            pass  # Игнорируем ошибку кэша
+        pages_updated = db.session.execute(select(func.max(Category.updated_at))).scalar()
+        entries = [("sitemap-pages.xml", pages_updated)]
+        entries += [
+            (f"sitemap-products-{number}.xml", updated_at)
+            for number, _, updated_at in SitemapService.product_shards()
+        ]
+        try:
+            cache.set("sitemap_index_entries", entries, timeout=INDEX_CACHE_TIMEOUT)
+        except:
+            pass  # Игнорируем ошибку кэша
+        return entries
+
+    @staticmethod
+    def render_index(base_url):
+        """XML индекса (несколько сотен строк даже для миллионов товаров) и lastmod."""
+        entries = SitemapService.index_entries()
+        lines = [
+            '<?xml version="1.0" encoding="UTF-8"?>',
+            f'<sitemapindex xmlns="{SITEMAP_NS}">',
+        ]
+        for name, updated_at in entries:
+            lastmod = f"<lastmod>{format_lastmod(updated_at)}</lastmod>" if updated_at else ""
+            lines.append(f"<sitemap><loc>{escape(base_url)}/{name}</loc>{lastmod}</sitemap>")
+        lines.append("</sitemapindex>")
+        last_modified = max((updated_at for _, updated_at in entries if updated_at), default=None)
+        return "\n".join(lines) + "\n", last_modified
+
+    @staticmethod
+    def pages_shard(base_url):
+        """Шард статических страниц и категорий."""
+        count, updated_at = db.session.execute(
+            select(func.count(Category.id), func.max(Category.updated_at))
+        ).one()
+
+        def entries():
+            for endpoint, priority, changefreq in STATIC_PAGES:
+                yield url_for(endpoint, _external=True), None, changefreq, priority
+            rows = db.session.execute(
+                select(Category.slug, Category.updated_at)
+                .order_by(Category.id)
+                .execution_options(yield_per=STREAM_BATCH_SIZE)
+            )
+            for slug, category_updated in rows:
+                if slug:
+                    yield (
+                        url_for("main.catalog", slug=slug, _external=True),
+                        category_updated,
+                        "weekly",
+                        "0.8",
+                    )
+
+        return SitemapService._get_shard("pages", (base_url, count, updated_at), updated_at, entries)
+
+    @staticmethod
+    def product_shard(number, base_url):
+        """Шард товаров с id из (number * SHARD_SIZE, (number + 1) * SHARD_SIZE]; None, если пуст."""
+        in_shard = and_(Product.id > number * SHARD_SIZE, Product.id <= (number + 1) * SHARD_SIZE)
+        count, updated_at = db.session.execute(
+            select(func.count(Product.id), func.max(Product.updated_at)).where(in_shard)
+        ).one()
+        if not count:
+            return None
+
+        def entries():
+            # Префикс строится один раз: url_for на каждый из 50 тыс. товаров заметно дороже
+            prefix = url_for("main.product", slug="-", _external=True)[:-1]
+            rows = db.session.execute(
+                select(Product.slug, Product.updated_at)
+                .where(in_shard)
+                .order_by(Product.id)
+                .execution_options(yield_per=STREAM_BATCH_SIZE)
+            )
+            for slug, product_updated in rows:
+                if slug:
+                    yield prefix + quote(slug), product_updated, "monthly", "0.6"
+
+        return SitemapService._get_shard(
+            f"products-{number}", (base_url, count, updated_at), updated_at, entries
+        )
+
+    @staticmethod
+    def _get_shard(name, fingerprint, updated_at, entries):
+        """Возвращает шард с диска или перегенерирует его при смене отпечатка."""
+        directory = SitemapService.directory()
+        path = os.path.join(directory, f"{name}.xml")
+        meta_path = os.path.join(directory, f"{name}.json")
+        etag = hashlib.sha1(repr(fingerprint).encode("utf-8")).hexdigest()[:20]
+        try:
+            with open(meta_path, encoding="utf-8") as meta_file:
+                meta = json.load(meta_file)
+            if meta.get("etag") == etag and os.path.exists(path):
+                return SitemapShard(path, etag, updated_at)
+        except (OSError, ValueError):
+            pass  # Шард еще не строился или метаданные повреждены
+
+        os.makedirs(directory, exist_ok=True)
+        SitemapService._write_urlset(path, entries())
+        tmp_meta = f"{meta_path}.{os.getpid()}.tmp"
+        with open(tmp_meta, "w", encoding="utf-8") as meta_file:
+            json.dump({"etag": etag, "generated_at": datetime.utcnow().isoformat()}, meta_file)
+        os.replace(tmp_meta, meta_path)
+        return SitemapShard(path, etag, updated_at)
+
+    @staticmethod
+    def _write_urlset(path, entries):
+        """Потоково пишет urlset во временный файл и атомарно подменяет шард."""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as out:
+            out.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{SITEMAP_NS}">\n')
+            for loc, lastmod, changefreq, priority in entries:
+                lastmod = f"<lastmod>{format_lastmod(lastmod)}</lastmod>" if lastmod else ""
+                out.write(
+                    f"<url><loc>{escape(loc)}</loc>{lastmod}"
+                    f"<changefreq>{changefreq}</changefreq><priority>{priority}</priority></url>\n"
+                )
+            out.write("</urlset>\n")
+        os.replace(tmp_path, path)
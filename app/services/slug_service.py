@@ -0,0 +1,84 @@
+import re
+from collections import Counter
+from sqlalchemy import select, or_, and_
+from sqlalchemy.exc import IntegrityError
+from slugify import slugify
+
+# Сколько оснований проверяется одним запросом (условия OR по диапазонам)
+LOOKUP_CHUNK_SIZE = 500
+
+
+class SlugService:
+    @staticmethod
+    def base_slug(value, fallback):
+        """Основа slug из названия; fallback — для названий без букв и цифр."""
+        return slugify(value or "") or fallback
+
+    @staticmethod
+    def matches(slug, base):
+        """slug уже построен из этого названия (base или base-N)."""
+        return bool(slug) and (slug == base or re.fullmatch(re.escape(base) + r"-\d+", slug) is not None)
+
+    @staticmethod
+    def is_conflict(exc):
+        """
+        Нарушение уникальности slug: параллельная запись заняла выделенный
+        slug между проверкой и вставкой — выделение нужно повторить.
+        """
+        return isinstance(exc, IntegrityError) and "slug" in str(exc.orig).lower()
+
+    @staticmethod
+    def taken_slugs(connection, table, bases, repeated=()):
+        """
+        Занятые slug вида base и base-N. Сначала одним IN проверяются сами
+        основания; суффиксы -N нужны только занятым и повторяющимся
+        (repeated) основаниям — для них один запрос на LOOKUP_CHUNK_SIZE
+        оснований. Префикс «base-» задан диапазоном ["base-", "base."):
+        это тот же LIKE 'base-%' ('.' идет сразу за '-'), но по уникальному
+        индексу slug и в SQLite, где LIKE без учета регистра читает всю таблицу.
+        """
+        bases = sorted(set(bases))
+        taken = set()
+        for start in range(0, len(bases), LOOKUP_CHUNK_SIZE):
+            chunk = bases[start:start + LOOKUP_CHUNK_SIZE]
+            taken.update(
+                slug for (slug,) in connection.execute(select(table.c.slug).where(table.c.slug.in_(chunk)))
+            )
+        suffixed = sorted(taken.union(repeated))
+        for start in range(0, len(suffixed), LOOKUP_CHUNK_SIZE):
+            chunk = suffixed[start:start + LOOKUP_CHUNK_SIZE]
+            rows = connection.execute(
+                select(table.c.slug).where(
+                    or_(*(and_(table.c.slug > f"{base}-", table.c.slug < f"{base}.") for base in chunk))
+                )
+            )
+            taken.update(slug for (slug,) in rows)
+        return taken
+
+    @staticmethod
+    def allocate(connection, table, bases, reserved=()):
+        """
+        Свободные slug для списка оснований (порядок сохраняется, повторы
+        получают суффиксы -1, -2, ... как при сохранении через ORM). reserved — slug,
+        уже занятые в текущей пачке, но еще не записанные в таблицу.
+        """
+        counts = Counter(bases)
+        repeated = {base for base, count in counts.items() if count > 1}
+        # Явно заданный в пачке slug занимает основание так же, как записанный
+        repeated.update(base for base in counts if base in reserved)
+        taken = SlugService.taken_slugs(connection, table, counts, repeated)
+        taken.update(reserved)
+        next_suffix = {}
+        slugs = []
+        for base in bases:
+            if base not in taken:
+                slug = base
+            else:
+                counter = next_suffix.get(base, 1)
+                while f"{base}-{counter}" in taken:
+                    counter += 1
+                slug = f"{base}-{counter}"
+                next_suffix[base] = counter + 1
+            taken.add(slug)
+            slugs.append(slug)
+        return slugs
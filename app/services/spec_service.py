@@ -0,0 +1,113 @@
+from sqlalchemy import event
+from app import db
+from app.models import Product, ProductSpec
+
+SPEC_TABLE = ProductSpec.__table__
+BACKFILL_CHUNK_SIZE = 1000
+
+
+class SpecService:
+    @staticmethod
+    def iter_spec_values(specifications):
+        """Разворачивает JSON характеристик в тройки (группа, ключ, значение)."""
+        if not isinstance(specifications, dict):
+            return
+        for group, attrs in specifications.items():
+            if not isinstance(attrs, dict):
+                continue
+            for key, value in attrs.items():
+                if value is None or value == "":
+                    continue
+                yield str(group)[:100], str(key)[:100], str(value)[:255]
+
+    @staticmethod
+    def filter_query(query, spec_filters):
+        """
+        Добавляет к запросу товаров фильтры по характеристикам в виде
+        полусоединений с индексом idx_product_spec_lookup (MySQL и SQLite).
+        """
+        for (group, key), values in spec_filters.items():
+            query = query.filter(
+                Product.id.in_(
+                    db.select(ProductSpec.product_id).where(
+                        ProductSpec.spec_group == group,
+                        ProductSpec.spec_key == key,
+                        ProductSpec.spec_value.in_(list(values)),
+                    )
+                )
+            )
+        return query
+
+    @staticmethod
+    def sync_products(connection, products, deleted_ids=()):
+        """
+        Переписывает строки product_spec для переданных товаров.
+        products — пары (product_id, specifications).
+        """
+        product_ids = [product_id for product_id, _ in products]
+        stale_ids = product_ids + list(deleted_ids)
+        if stale_ids:
+            connection.execute(
+                SPEC_TABLE.delete().where(SPEC_TABLE.c.product_id.in_(stale_ids))
+            )
+        rows = [
+            {
+                "product_id": product_id,
+                "spec_group": group,
+                "spec_key": key,
+                "spec_value": value,
+            }
+            for product_id, specifications in products
+            for group, key, value in SpecService.iter_spec_values(specifications)
+        ]
+        if rows:
+            connection.execute(SPEC_TABLE.insert(), rows)
+        return len(rows)
+
+    @staticmethod
+    def backfill(chunk_size=BACKFILL_CHUNK_SIZE, echo=None):
+        """
+        Заполняет product_spec для всех существующих товаров, читая их
+        порциями по первичному ключу (без загрузки всей таблицы в память).
+        """
+        last_id = 0
+        total_products, total_rows = 0, 0
+        while True:
+            chunk = (
+                db.session.query(Product.id, Product.specifications)
+                .filter(Product.id > last_id)
+                .order_by(Product.id)
+                .limit(chunk_size)
+                .all()
+            )
+            if not chunk:
+                break
+            total_rows += SpecService.sync_products(
+                db.session.connection(), [tuple(row) for row in chunk]
+            )
+            db.session.commit()
+            last_id = chunk[-1][0]
+            total_products += len(chunk)
+            if echo:
+                echo(f"Обработано товаров: {total_products} (последний id {last_id})")
+        return total_products, total_rows
+
+
+@event.listens_for(db.session, "after_flush")
+def sync_product_specs(session, flush_context):
+    """Синхронизирует product_spec с Product.specifications при записи товаров."""
+    changed, deleted_ids = [], []
+    for obj in session.new:
+        if isinstance(obj, Product):
+            changed.append((obj.id, obj.specifications))
+    for obj in session.dirty:
+        if (
+            isinstance(obj, Product)
+            and db.inspect(obj).attrs.specifications.history.has_changes()
+        ):
+            changed.append((obj.id, obj.specifications))
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            deleted_ids.append(obj.id)
+    if changed or deleted_ids:
+        SpecService.sync_products(session.connection(), changed, deleted_ids)
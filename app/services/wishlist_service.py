@@ -0,0 +1,56 @@
+from sqlalchemy import select
+from app import db, cache
+from app.models import wishlist_items
+
+WISHLIST_CACHE_TIMEOUT = 3600
+
+
+class WishlistService:
+    """
+    Принадлежность товаров избранному для сеток товаров: вместо
+    current_user.wishlist.all() на каждую карточку шаблон получает
+    множество id, собранное одним запросом (или из кэша).
+    """
+
+    @staticmethod
+    def cache_key(user_id):
+        return f"wishlist_ids_{user_id}"
+
+    @staticmethod
+    def get_ids(user_id):
+        """Множество id товаров в избранном пользователя (пустое для гостя)."""
+        if not user_id:
+            return frozenset()
+        user_id = int(user_id)  # identity из JWT приходит строкой
+        key = WishlistService.cache_key(user_id)
+        try:
+            ids = cache.get(key)
+        except:
+            ids = None
+        if ids is None:
+            # Покрывается первичным ключом (user_id, product_id)
+            ids = frozenset(
+                db.session.execute(
+                    select(wishlist_items.c.product_id).where(
+                        wishlist_items.c.user_id == user_id
+                    )
+                ).scalars()
+            )
+            try:
+                cache.set(key, ids, timeout=WISHLIST_CACHE_TIMEOUT)
+            except:
+                pass  # Игнорируем ошибку кэша
+        return ids
+
+    @staticmethod
+    def ids_for_user(user):
+        """То же для current_user (анонимный пользователь — пустое множество)."""
+        return WishlistService.get_ids(user.id if user.is_authenticated else None)
+
+    @staticmethod
+    def invalidate(user_id):
+        """Вызывается после коммита изменений избранного пользователя."""
+        try:
+            cache.delete(WishlistService.cache_key(user_id))
+        except:
+            pass  # Игнорируем ошибку кэша
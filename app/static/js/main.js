@@ -160,8 +160,15 @@ document.addEventListener('DOMContentLoaded', () => {
                 this.classList.add('active');
                 // Change main image source
                 const newSrc = this.getAttribute('data-image-url');
+                // srcset wins over src, so swap it too (or drop it) to show the new photo
+                const newSrcset = this.getAttribute('data-image-srcset');
                 mainImage.style.opacity = '0.5';
                 setTimeout(() => {
+                    if (newSrcset) {
+                        mainImage.srcset = newSrcset;
+                    } else {
+                        mainImage.removeAttribute('srcset');
+                    }
                     mainImage.src = newSrc;
                     mainImage.style.opacity = '1';
                 }, 200);
@@ -272,4 +279,55 @@ document.addEventListener('DOMContentLoaded', () => {
             })
             .catch(error => console.error('Error:', error));
     });
+
+    // --- 7. Reviews: "Показать еще" (страницы по курсору) ---
+    const loadReviewsBtn = document.querySelector('.btn-load-reviews');
+    const reviewsList = document.getElementById('reviews-list');
+
+    function renderReview(review) {
+        // Текст вставляем через textContent: комментарии приходят от пользователей
+        const card = document.createElement('div');
+        card.className = 'review-card';
+        card.innerHTML = `
+            <div class="d-flex justify-content-between align-items-start mb-3">
+                <div class="d-flex align-items-center">
+                    <div class="review-avatar me-3"></div>
+                    <div>
+                        <h6 class="mb-0 fw-bold"></h6>
+                        <small class="text-muted"></small>
+                    </div>
+                </div>
+                <div class="text-warning">${'<i class="fas fa-star"></i>'.repeat(review.rating)}</div>
+            </div>
+            <p class="mb-0"></p>`;
+        const author = review.author || '';
+        card.querySelector('.review-avatar').textContent = author.charAt(0).toUpperCase();
+        card.querySelector('h6').textContent = author;
+        card.querySelector('small').textContent = review.created_at
+            ? new Date(review.created_at).toLocaleDateString('ru-RU') : '';
+        card.querySelector('p').textContent = review.comment || '';
+        return card;
+    }
+
+    if (loadReviewsBtn && reviewsList) {
+        loadReviewsBtn.addEventListener('click', function () {
+            const url = `${loadReviewsBtn.dataset.url}?cursor=${encodeURIComponent(loadReviewsBtn.dataset.cursor)}`;
+            loadReviewsBtn.disabled = true;
+            fetch(url)
+                .then(response => response.json())
+                .then(data => {
+                    (data.items || []).forEach(review => reviewsList.appendChild(renderReview(review)));
+                    if (data.next_cursor) {
+                        loadReviewsBtn.dataset.cursor = data.next_cursor;
+                        loadReviewsBtn.disabled = false;
+                    } else {
+                        loadReviewsBtn.parentElement.remove();
+                    }
+                })
+                .catch(error => {
+                    console.error('Error:', error);
+                    loadReviewsBtn.disabled = false;
+                });
+        });
+    }
 });
\ No newline at end of file
@@ -1,24 +1,23 @@
-from app import cache
-from app.models import Product, Category, Brand, db
-from sqlalchemy import func
+import time
+import hashlib
+from functools import wraps
+from itertools import chain
+from flask import request, session, make_response, current_app
+from sqlalchemy import event
+from app import cache, celery, cache_is_shared
+from app.models import Product, Category, Brand, ProductImage, db
+from app.services.spec_service import SpecService
+from app.services.category_service import CategoryService
+
+CATALOG_VERSION_KEY = "catalog_version"
+CATALOG_MODELS = (Product, Category, Brand, ProductImage)
+_catalog_change_callbacks = []
+# Сколько секунд ждать брокер, ставя задачу из хука после коммита
+ENQUEUE_CONNECT_TIMEOUT = 2
 
 def get_cached_categories():
-    """Возвращает все категории с кэшированием или без кэширования при ошибке."""
-    try:
-        # Попробуем получить закэшированные данные
-        cached_result = cache.get('cached_categories')
-        if cached_result is None:
-            # Если данных в кэше нет, получаем их из БД и сохраняем в кэш
-            categories = Category.query.all()
-            try:
-                cache.set('cached_categories', categories, timeout=300)
-            except:
-                pass  # Игнорируем ошибку сохранения в кэш
-            return categories
-        return cached_result
-    except:
-        # Если кэш недоступен, получаем данные напрямую
-        return Category.query.all()
+    """Все категории (узлы дерева из памяти процесса, по id) — без запросов к БД."""
+    return CategoryService.tree().nodes
 
 def get_cached_brands():
     """Возвращает все бренды с кэшированием или без кэширования при ошибке."""
@@ -38,38 +37,177 @@ def get_cached_brands():
         # Если кэш недоступен, получаем данные напрямую
         return Brand.query.all()
 
-def get_category_filters(category_id):
-    """Собирает доступные фильтры для категории (без изменений)."""
-    products = Product.query.filter_by(category_id=category_id).all()
-    filters = {}
-    for product in products:
-        if not product.specifications: continue
-        for group, attrs in product.specifications.items():
-            if group not in filters: filters[group] = {}
-            for k, v in attrs.items():
-                if k not in filters[group]: filters[group][k] = set()
-                filters[group][k].add(v)
-    for g in filters:
-        for k in filters[g]: filters[g][k] = sorted(list(filters[g][k]))
-    return filters
+def parse_spec_filters(request_args):
+    """Извлекает фильтры spec__Группа__Ключ из параметров запроса."""
+    spec_filters = {}
+    for param, values in request_args.lists():
+        if param.startswith("spec__"):
+            parts = param.split("__")
+            if len(parts) == 3 and values:
+                spec_filters[(parts[1], parts[2])] = set(values)
+    return spec_filters
+
+def parse_catalog_filters(request_args, category_id=None):
+    """
+    Нормализованный набор фильтров каталога: одинаковые по смыслу запросы
+    дают одинаковый набор (порядок brand_id, регистр и пробелы в поиске).
+    """
+    min_price = request_args.get("min_price", type=float)
+    max_price = request_args.get("max_price", type=float)
+    search = request_args.get("search_query", type=str)
+    return {
+        "category_id": category_id,
+        # Категория вместе с подкатегориями
+        "category_ids": CategoryService.subtree_ids(category_id) if category_id else [],
+        "brand_ids": sorted(set(request_args.getlist("brand_id", type=int))),
+        "min_price": min_price if min_price is not None and min_price >= 0 else None,
+        "max_price": max_price if max_price is not None and max_price >= 0 else None,
+        "search": " ".join(search.lower().split()) if search else None,
+        "specs": parse_spec_filters(request_args),
+    }
 
 def filter_products_by_specs(query, request_args):
     """
     ПРОДАКШЕН ФИЛЬТРАЦИЯ:
-    Использует MySQL JSON_EXTRACT для фильтрации на стороне сервера БД.
+    Фильтры spec__Группа__Ключ превращаются в индексные полусоединения
+    с таблицей product_spec (работает и в MySQL, и в SQLite).
     """
-    for param, values in request_args.lists():
-        if param.startswith("spec__"):
-            parts = param.split("__")
-            if len(parts) == 3:
-                group, key = parts[1], parts[2]
-
-                # Формируем JSON путь для MySQL: $.Group.Key
-                json_path = f'$.\"{group}\".\"{key}\"'
-
-                # Используем JSON_EXTRACT и фильтруем через оператор IN
-                # Мы используем func.json_unquote, чтобы убрать лишние кавычки при сравнении
-                query = query.filter(
-                    func.json_unquote(func.json_extract(Product.specifications, json_path)).in_(values)
-                )
-    return query
\ No newline at end of file
+    return SpecService.filter_query(query, parse_spec_filters(request_args))
+
+
+def get_catalog_version():
+    """Версия каталога: меняется после каждого коммита, затрагивающего товары."""
+    try:
+        version = cache.get(CATALOG_VERSION_KEY)
+        if version is None:
+            version = time.time_ns()
+            cache.set(CATALOG_VERSION_KEY, version, timeout=0)
+        return version
+    except:
+        return 0
+
+def bump_catalog_version():
+    try:
+        cache.set(CATALOG_VERSION_KEY, time.time_ns(), timeout=0)
+    except:
+        pass  # Игнорируем ошибку кэша
+
+def on_catalog_change(callback):
+    """
+    Регистрирует функцию, вызываемую после коммита изменений каталога.
+    Она получает множество id измененных (в т.ч. удаленных) товаров.
+    """
+    _catalog_change_callbacks.append(callback)
+    return callback
+
+def enqueue_task(task, *args, countdown=None, **kwargs):
+    """
+    Ставит задачу Celery в очередь из хука после коммита так, чтобы
+    недоступный брокер не задерживал запрос: одна попытка соединения не
+    дольше ENQUEUE_CONNECT_TIMEOUT секунд, без повторов публикации и без
+    подписки на результат (redis-бэкенд результатов иначе переподключается
+    с повторами). Ошибка брокера — исключением, вызывающий пишет ее в лог.
+    """
+    with celery.connection_for_write(
+        connect_timeout=ENQUEUE_CONNECT_TIMEOUT, transport_options={"max_retries": 0}
+    ) as connection:
+        return task.apply_async(
+            args, kwargs, countdown=countdown, connection=connection, retry=False, ignore_result=True
+        )
+
+def touches_catalog(session):
+    return any(
+        isinstance(obj, CATALOG_MODELS)
+        for obj in chain(session.new, session.dirty, session.deleted)
+    )
+
+@event.listens_for(db.session, "after_flush")
+def _mark_catalog_changed(session, flush_context):
+    if touches_catalog(session):
+        session.info.setdefault("catalog_changed", set()).update(
+            obj.id
+            for obj in chain(session.new, session.dirty, session.deleted)
+            if isinstance(obj, Product)
+        )
+
+@event.listens_for(db.session, "after_rollback")
+def _discard_catalog_changed(session):
+    session.info.pop("catalog_changed", None)
+
+@event.listens_for(db.session, "after_commit")
+def _publish_catalog_change(session):
+    product_ids = session.info.pop("catalog_changed", None)
+    if product_ids is not None:
+        bump_catalog_version()
+        for callback in _catalog_change_callbacks:
+            callback(product_ids)
+
+def conditional_get(validator, personalize=None):
+    """
+    Условный GET по ETag. validator получает аргументы представления и
+    возвращает дешевый отпечаток содержимого (версия каталога, параметры
+    запроса) без тяжелых запросов или None, если ответ не кэшируется.
+    personalize() добавляет части, зависящие от пользователя. Совпадение
+    с If-None-Match — 304 без вызова представления. Без общего кэша ETag
+    не выдается: версию каталога, сменившуюся в другом процессе, этот
+    процесс не увидит и отдавал бы 304 на устаревшие страницы.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            # Флеш-сообщения показываются один раз — такой ответ всегда рендерится
+            if request.method != "GET" or session.get("_flashes") or not cache_is_shared():
+                return view(*args, **kwargs)
+            def current_etag():
+                parts = validator(*args, **kwargs)
+                if parts is None:
+                    return None
+                if personalize is not None:
+                    parts = (parts, personalize())
+                return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:20]
+
+            etag = current_etag()
+            if etag is None:
+                return view(*args, **kwargs)
+            if request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                # Рендер мог создать секрет CSRF в сессии — тег по состоянию после него
+                etag = current_etag()
+            response.set_etag(etag)
+            # Ответ зависит от пользователя: только кэш браузера и всегда с проверкой
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return wrapped
+    return decorator
+
+def page_personalization():
+    """
+    Все, что HTML-страница показывает конкретному посетителю: счетчики
+    шапки, избранное и CSRF-токен (секрет сессии и окно, в котором
+    выданный токен еще действителен).
+    """
+    from flask_login import current_user
+    from app.services.counter_service import CounterService
+    from app.services.wishlist_service import WishlistService
+    from app.services.cart_service import CartService
+
+    if current_user.is_authenticated:
+        counters = CounterService.get(current_user.id)
+        wishlist_ids = sorted(WishlistService.get_ids(current_user.id))
+    else:
+        counters = {"cart": CartService.guest_positions(), "wishlist": 0}
+        wishlist_ids = []
+    csrf_limit = current_app.config.get("WTF_CSRF_TIME_LIMIT", 3600)
+    csrf_window = int(time.time() // (csrf_limit / 2)) if csrf_limit else None
+    return (
+        current_user.get_id(),
+        sorted(counters.items()),
+        wishlist_ids,
+        session.get("csrf_token"),
+        csrf_window,
+    )
@@ -1,4 +1,5 @@
 import os
+from celery.schedules import crontab
 from dotenv import load_dotenv
 
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -28,6 +29,33 @@ class Config:
     CACHE_TYPE = os.environ.get("CACHE_TYPE") or "SimpleCache"
     CACHE_DEFAULT_TIMEOUT = 300
     CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL") or "redis://redis:6379/0"
+    # Общий ли кэш для всех процессов; по умолчанию — по CACHE_TYPE (SimpleCache
+    # живет в памяти процесса, и ETag, версия дерева категорий и колоночный
+    # движок без общего кэша отключаются)
+    CACHE_SHARED = None
+
+    # Поиск: "index" — встроенный инвертированный индекс, "sql" — ILIKE по названию
+    SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND") or "index"
+    # Каталог снимков индекса автодополнения (по умолчанию instance/autocomplete)
+    AUTOCOMPLETE_SNAPSHOT_DIR = os.environ.get("AUTOCOMPLETE_SNAPSHOT_DIR")
+    # Фильтрация и сортировка каталога: "sql" или "columnar" (снимок в памяти, нужен numpy)
+    CATALOG_ENGINE = os.environ.get("CATALOG_ENGINE") or "sql"
+    CATALOG_SNAPSHOT_DIR = os.environ.get("CATALOG_SNAPSHOT_DIR")
+    # Накопленные счетчики совместных покупок (по умолчанию instance/recommendations)
+    RECOMMENDATIONS_STATE_DIR = os.environ.get("RECOMMENDATIONS_STATE_DIR")
+    # Файлы шардов sitemap (по умолчанию instance/sitemap)
+    SITEMAP_DIR = os.environ.get("SITEMAP_DIR")
+    # Загруженные файлы импорта товаров (по умолчанию instance/imports);
+    # каталог должен быть общим для веб-процессов и воркеров Celery
+    IMPORT_DIR = os.environ.get("IMPORT_DIR")
+    # Фоновые выгрузки каталога (.gz, по умолчанию instance/exports)
+    EXPORT_DIR = os.environ.get("EXPORT_DIR")
+    # Хранилище корзин: "sql" — таблица cart (гости — в сессии), "redis" — хэши
+    # Redis для всех с периодической записью корзин пользователей в таблицу cart
+    CART_BACKEND = os.environ.get("CART_BACKEND") or "sql"
+    CART_REDIS_URL = os.environ.get("CART_REDIS_URL") or "redis://redis:6379/1"
+    # Гостевая корзина в Redis живет столько секунд после последнего изменения
+    CART_GUEST_TTL = int(os.environ.get("CART_GUEST_TTL") or 7 * 24 * 3600)
 
     # YooKassa
     YOOKASSA_SHOP_ID = os.environ.get("YOOKASSA_SHOP_ID")
@@ -47,6 +75,30 @@ class Config:
     CELERY_RESULT_BACKEND = (
         os.environ.get("CELERY_RESULT_BACKEND") or "redis://redis:6379/0"
     )
+    # Периодические задачи (celery beat)
+    CELERYBEAT_SCHEDULE = {
+        "rebuild-facet-index": {
+            "task": "app.services.facet_service.rebuild_facet_index",
+            "schedule": crontab(hour=3, minute=0),
+        },
+        "build-catalog-snapshot": {
+            "task": "app.services.catalog_engine.build_catalog_snapshot",
+            "schedule": crontab(hour=3, minute=30),
+        },
+        "build-recommendations": {
+            "task": "app.services.recommendation_service.build_recommendations",
+            "schedule": crontab(minute=15),
+        },
+        "refresh-sales-stats": {
+            "task": "app.services.sales_stats_service.refresh_sales_stats",
+            "schedule": crontab(minute=45),
+        },
+        # Только для CART_BACKEND = "redis" (иначе задача ничего не делает)
+        "flush-carts": {
+            "task": "app.services.cart_service.flush_carts",
+            "schedule": crontab(),
+        },
+    }
 
     # Sentry DSN для мониторинга ошибок
     SENTRY_DSN = os.environ.get("SENTRY_DSN")
@@ -59,6 +111,18 @@ class DevelopmentConfig(Config):
     ) or "sqlite:///" + os.path.join(basedir, "dev.db")
 
 
+class TestingConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    WTF_CSRF_ENABLED = False
+    RATELIMIT_ENABLED = False
+    CACHE_TYPE = "SimpleCache"
+    # Тесты идут в одном процессе, его кэш и есть общий
+    CACHE_SHARED = True
+    # Шаблоны ссылаются на исходные файлы ассетов без сборки бандлов
+    ASSETS_DEBUG = True
+
+
 class ProductionConfig(Config):
     DEBUG = False
     TESTING = False
@@ -79,6 +143,7 @@ class ProductionConfig(Config):
 
 config = {
     "development": DevelopmentConfig,
+    "testing": TestingConfig,
     "production": ProductionConfig,
     "default": ProductionConfig,
 }
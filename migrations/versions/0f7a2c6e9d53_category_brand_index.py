@@ -0,0 +1,23 @@
+"""category brand facet index
+
+Revision ID: 0f7a2c6e9d53
+Revises: e5b8c3d1f046
+Create Date: 2026-10-17 20:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0f7a2c6e9d53'
+down_revision = 'e5b8c3d1f046'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('idx_product_category_brand', 'product', ['category_id', 'brand_id', 'price'], unique=False)
+
+
+def downgrade():
+    op.drop_index('idx_product_category_brand', table_name='product')
@@ -0,0 +1,35 @@
+"""spec facet index
+
+Revision ID: 3f1c2a9d7b10
+Revises: 
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d7b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'spec_facet',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('category_id', sa.Integer(), nullable=False),
+        sa.Column('spec_group', sa.String(length=100), nullable=False),
+        sa.Column('spec_key', sa.String(length=100), nullable=False),
+        sa.Column('spec_value', sa.String(length=255), nullable=False),
+        sa.Column('product_count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['category_id'], ['category.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('category_id', 'spec_group', 'spec_key', 'spec_value', name='uq_spec_facet_value')
+    )
+
+
+def downgrade():
+    op.drop_table('spec_facet')
@@ -0,0 +1,34 @@
+"""product recommendation table
+
+Revision ID: 4e7a1b9c3d25
+Revises: 9c2d7a4e6b18
+Create Date: 2026-10-18 01:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e7a1b9c3d25'
+down_revision = '9c2d7a4e6b18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'product_recommendation',
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('rank', sa.SmallInteger(), autoincrement=False, nullable=False),
+        sa.Column('recommended_id', sa.Integer(), nullable=False),
+        sa.Column('score', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['product_id'], ['product.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['recommended_id'], ['product.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('product_id', 'rank')
+    )
+    # Данные заполняются задачей build_recommendations или командой: flask catalog build-recommendations
+
+
+def downgrade():
+    op.drop_table('product_recommendation')
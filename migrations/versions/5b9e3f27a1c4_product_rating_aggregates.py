@@ -0,0 +1,48 @@
+"""product rating aggregates
+
+Revision ID: 5b9e3f27a1c4
+Revises: 0f7a2c6e9d53
+Create Date: 2026-10-17 23:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b9e3f27a1c4'
+down_revision = '0f7a2c6e9d53'
+branch_labels = None
+depends_on = None
+
+RATING_COLUMNS = ['rating_count', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5']
+
+
+def upgrade():
+    op.add_column('product', sa.Column('rating_avg', sa.Numeric(precision=3, scale=2), server_default='0', nullable=False))
+    for column in RATING_COLUMNS:
+        op.add_column('product', sa.Column(column, sa.Integer(), server_default='0', nullable=False))
+    op.create_index('idx_product_rating', 'product', ['rating_avg', 'id'], unique=False)
+    op.create_index('idx_product_category_rating', 'product', ['category_id', 'rating_avg', 'id'], unique=False)
+
+    # Заполняем агрегаты только для товаров с отзывами (остальные уже 0).
+    # Повторно пересчитать можно командой: flask catalog repair-ratings
+    stars = ', '.join(
+        f'rating_{n} = (SELECT COUNT(*) FROM review WHERE review.product_id = product.id AND review.rating = {n})'
+        for n in range(1, 6)
+    )
+    op.execute(
+        'UPDATE product SET '
+        'rating_avg = (SELECT COALESCE(AVG(rating), 0) FROM review WHERE review.product_id = product.id), '
+        'rating_count = (SELECT COUNT(*) FROM review WHERE review.product_id = product.id), '
+        f'{stars} '
+        'WHERE id IN (SELECT product_id FROM review)'
+    )
+
+
+def downgrade():
+    op.drop_index('idx_product_category_rating', table_name='product')
+    op.drop_index('idx_product_rating', table_name='product')
+    for column in reversed(RATING_COLUMNS):
+        op.drop_column('product', column)
+    op.drop_column('product', 'rating_avg')
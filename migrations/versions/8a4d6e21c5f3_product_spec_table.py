@@ -0,0 +1,96 @@
+"""normalized product specifications
+
+Revision ID: 8a4d6e21c5f3
+Revises: 3f1c2a9d7b10
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a4d6e21c5f3'
+down_revision = '3f1c2a9d7b10'
+branch_labels = None
+depends_on = None
+
+BACKFILL_CHUNK_SIZE = 1000
+
+
+def spec_rows(product_id, specifications):
+    """Строки product_spec из JSON характеристик (как SpecService.iter_spec_values)."""
+    if isinstance(specifications, str):
+        try:
+            specifications = json.loads(specifications)
+        except ValueError:
+            return
+    if not isinstance(specifications, dict):
+        return
+    for group, attrs in specifications.items():
+        if not isinstance(attrs, dict):
+            continue
+        for key, value in attrs.items():
+            if value is None or value == '':
+                continue
+            yield {
+                'product_id': product_id,
+                'spec_group': str(group)[:100],
+                'spec_key': str(key)[:100],
+                'spec_value': str(value)[:255],
+            }
+
+
+def upgrade():
+    op.create_table(
+        'product_spec',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('spec_group', sa.String(length=100), nullable=False),
+        sa.Column('spec_key', sa.String(length=100), nullable=False),
+        sa.Column('spec_value', sa.String(length=255), nullable=False),
+        sa.ForeignKeyConstraint(['product_id'], ['product.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('idx_product_spec_lookup', 'product_spec', ['spec_group', 'spec_key', 'spec_value', 'product_id'], unique=False)
+    op.create_index('idx_product_spec_product', 'product_spec', ['product_id', 'spec_group', 'spec_key'], unique=False)
+
+    # Переносим характеристики существующих товаров порциями по id и
+    # пересчитываем фасеты: они теперь строятся по product_spec.
+    # Повторно заполнить можно командой: flask catalog backfill-specs
+    connection = op.get_bind()
+    insert = sa.text(
+        'INSERT INTO product_spec (product_id, spec_group, spec_key, spec_value) '
+        'VALUES (:product_id, :spec_group, :spec_key, :spec_value)'
+    )
+    last_id = 0
+    while True:
+        chunk = connection.execute(
+            sa.text(
+                'SELECT id, specifications FROM product WHERE id > :last_id ORDER BY id LIMIT :limit'
+            ),
+            {'last_id': last_id, 'limit': BACKFILL_CHUNK_SIZE},
+        ).all()
+        if not chunk:
+            break
+        rows = [row for product_id, specifications in chunk for row in spec_rows(product_id, specifications)]
+        if rows:
+            connection.execute(insert, rows)
+        last_id = chunk[-1][0]
+    op.execute('DELETE FROM spec_facet')
+    op.execute(
+        'INSERT INTO spec_facet (category_id, spec_group, spec_key, spec_value, product_count) '
+        'SELECT product.category_id, product_spec.spec_group, product_spec.spec_key, '
+        'product_spec.spec_value, COUNT(product_spec.product_id) '
+        'FROM product_spec JOIN product ON product.id = product_spec.product_id '
+        'WHERE product.category_id IS NOT NULL '
+        'GROUP BY product.category_id, product_spec.spec_group, product_spec.spec_key, product_spec.spec_value'
+    )
+
+
+def downgrade():
+    op.drop_index('idx_product_spec_product', table_name='product_spec')
+    op.drop_index('idx_product_spec_lookup', table_name='product_spec')
+    op.drop_table('product_spec')
@@ -0,0 +1,23 @@
+"""review pagination index
+
+Revision ID: 9c2d7a4e6b18
+Revises: 5b9e3f27a1c4
+Create Date: 2026-10-18 00:30:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9c2d7a4e6b18'
+down_revision = '5b9e3f27a1c4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('idx_review_product_created', 'review', ['product_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('idx_review_product_created', table_name='review')
@@ -0,0 +1,42 @@
+"""export job table
+
+Revision ID: a5c1e8f3b702
+Revises: f7b2d9e4a1c6
+Create Date: 2026-10-18 04:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a5c1e8f3b702'
+down_revision = 'f7b2d9e4a1c6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'export_job',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('format', sa.String(length=10), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('path', sa.String(length=500), nullable=True),
+        sa.Column('rows_exported', sa.Integer(), nullable=False),
+        sa.Column('size_bytes', sa.BigInteger(), nullable=False),
+        sa.Column('message', sa.Text(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_export_job_status'), 'export_job', ['status'], unique=False)
+    op.create_index(op.f('ix_export_job_created_at'), 'export_job', ['created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_export_job_created_at'), table_name='export_job')
+    op.drop_index(op.f('ix_export_job_status'), table_name='export_job')
+    op.drop_table('export_job')
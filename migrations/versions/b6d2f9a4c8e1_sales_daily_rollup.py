@@ -0,0 +1,70 @@
+"""daily sales rollup tables
+
+Revision ID: b6d2f9a4c8e1
+Revises: a5c1e8f3b702
+Create Date: 2026-10-18 06:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6d2f9a4c8e1'
+down_revision = 'a5c1e8f3b702'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'sales_daily',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('status', sa.String(length=50), nullable=False),
+        sa.Column('orders_count', sa.Integer(), nullable=False),
+        sa.Column('amount', sa.Numeric(precision=14, scale=2), nullable=False),
+        sa.PrimaryKeyConstraint('day', 'status')
+    )
+    op.create_table(
+        'product_sales_daily',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('units', sa.Integer(), nullable=False),
+        sa.Column('revenue', sa.Numeric(precision=14, scale=2), nullable=False),
+        sa.ForeignKeyConstraint(['product_id'], ['product.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('day', 'product_id')
+    )
+    op.create_index(op.f('ix_product_sales_daily_product_id'), 'product_sales_daily', ['product_id'], unique=False)
+    op.create_table(
+        'signup_daily',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('users_count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('day')
+    )
+
+    # Заполняем итоги из существующих заказов и пользователей.
+    # Повторно пересчитать можно командой: flask catalog rebuild-sales-stats
+    op.execute(
+        'INSERT INTO sales_daily (day, status, orders_count, amount) '
+        "SELECT DATE(created_at), COALESCE(status, ''), COUNT(*), COALESCE(SUM(final_amount), 0) "
+        'FROM `order` WHERE created_at IS NOT NULL '
+        "GROUP BY DATE(created_at), COALESCE(status, '')"
+    )
+    op.execute(
+        'INSERT INTO product_sales_daily (day, product_id, units, revenue) '
+        'SELECT DATE(o.created_at), i.product_id, SUM(i.quantity), SUM(i.quantity * i.price) '
+        'FROM order_item i JOIN `order` o ON o.id = i.order_id WHERE o.created_at IS NOT NULL '
+        'GROUP BY DATE(o.created_at), i.product_id'
+    )
+    op.execute(
+        'INSERT INTO signup_daily (day, users_count) '
+        'SELECT DATE(created_at), COUNT(*) FROM `user` WHERE created_at IS NOT NULL '
+        'GROUP BY DATE(created_at)'
+    )
+
+
+def downgrade():
+    op.drop_table('signup_daily')
+    op.drop_index(op.f('ix_product_sales_daily_product_id'), table_name='product_sales_daily')
+    op.drop_table('product_sales_daily')
+    op.drop_table('sales_daily')
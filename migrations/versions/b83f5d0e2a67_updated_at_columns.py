@@ -0,0 +1,41 @@
+"""updated_at for product and category
+
+Revision ID: b83f5d0e2a67
+Revises: 4e7a1b9c3d25
+Create Date: 2026-10-18 01:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b83f5d0e2a67'
+down_revision = '4e7a1b9c3d25'
+branch_labels = None
+depends_on = None
+
+TABLES = ['product', 'category']
+
+
+def upgrade():
+    # SQLite не добавляет столбец с CURRENT_TIMESTAMP по умолчанию:
+    # сначала nullable, заполнение, затем NOT NULL через batch
+    for table in TABLES:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.execute(f'UPDATE {table} SET updated_at = CURRENT_TIMESTAMP')
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column(
+                'updated_at',
+                existing_type=sa.DateTime(),
+                nullable=False,
+                server_default=sa.text('CURRENT_TIMESTAMP'),
+            )
+    op.create_index('idx_product_id_updated', 'product', ['id', 'updated_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('idx_product_id_updated', table_name='product')
+    for table in reversed(TABLES):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
@@ -0,0 +1,46 @@
+"""category materialized path
+
+Revision ID: c3e7a1f5b920
+Revises: b6d2f9a4c8e1
+Create Date: 2026-10-18 07:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3e7a1f5b920'
+down_revision = 'b6d2f9a4c8e1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('category', sa.Column('path', sa.String(length=255), nullable=True))
+    op.create_index(op.f('ix_category_path'), 'category', ['path'], unique=False)
+
+    # Пути "1/5/12/" по parent_id. Повторно пересчитать можно командой:
+    # flask catalog rebuild-category-paths
+    connection = op.get_bind()
+    parents = dict(connection.execute(sa.text('SELECT id, parent_id FROM category')).all())
+    paths = {}
+    for category_id in parents:
+        chain_ids = []
+        current = category_id
+        while current is not None and current not in paths and current not in chain_ids:
+            chain_ids.append(current)
+            current = parents.get(current)
+        prefix = paths.get(current, '')
+        for node_id in reversed(chain_ids):
+            prefix = paths[node_id] = f'{prefix}{node_id}/'
+    if paths:
+        connection.execute(
+            sa.text('UPDATE category SET path = :path WHERE id = :id'),
+            [{'id': category_id, 'path': path} for category_id, path in paths.items()],
+        )
+
+
+def downgrade():
+    op.drop_index(op.f('ix_category_path'), table_name='category')
+    op.drop_column('category', 'path')
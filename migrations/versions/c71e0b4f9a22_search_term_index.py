@@ -0,0 +1,108 @@
+"""inverted search index
+
+Revision ID: c71e0b4f9a22
+Revises: 8a4d6e21c5f3
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+import re
+from collections import Counter
+
+from alembic import op
+import snowballstemmer
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c71e0b4f9a22'
+down_revision = '8a4d6e21c5f3'
+branch_labels = None
+depends_on = None
+
+# Анализатор на момент миграции (как в app/services/search_service.py)
+FIELD_WEIGHTS = {'name': 10, 'sku': 8, 'brand': 5, 'category': 4, 'description': 1}
+MAX_TERM_LENGTH = 64
+BACKFILL_CHUNK_SIZE = 1000
+TOKEN_RE = re.compile(r'[0-9a-zа-я]+')
+CYRILLIC_RE = re.compile(r'[а-я]')
+
+
+def document_terms(stemmers, name, sku, description, brand_name, category_name):
+    """Веса основ слов одного товара."""
+
+    def tokenize(text):
+        return TOKEN_RE.findall(str(text).lower().replace('ё', 'е')) if text else []
+
+    def stem(token):
+        if token.isdigit():
+            return token
+        language = 'ru' if CYRILLIC_RE.search(token) else 'en'
+        return stemmers[language].stemWord(token)[:MAX_TERM_LENGTH]
+
+    weights = Counter()
+    fields = (
+        ('name', name),
+        ('sku', sku),
+        ('brand', brand_name),
+        ('category', category_name),
+        ('description', description),
+    )
+    for field, text in fields:
+        for term in {stem(token) for token in tokenize(text)}:
+            weights[term] += FIELD_WEIGHTS[field]
+    sku_term = ''.join(tokenize(sku))[:MAX_TERM_LENGTH]
+    if sku_term:
+        weights[sku_term] += FIELD_WEIGHTS['sku']
+    return weights
+
+
+def upgrade():
+    op.create_table(
+        'search_term',
+        sa.Column('term', sa.String(length=64).with_variant(mysql.VARCHAR(length=64, collation='utf8mb4_bin'), 'mysql'), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('weight', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['product_id'], ['product.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('term', 'product_id')
+    )
+    op.create_index(op.f('ix_search_term_product_id'), 'search_term', ['product_id'], unique=False)
+
+    # Индексируем существующие товары порциями по id, иначе поиск по
+    # умолчанию (SEARCH_BACKEND = "index") ничего не найдет.
+    # Повторно перестроить можно командой: flask catalog rebuild-search
+    connection = op.get_bind()
+    stemmers = {
+        'ru': snowballstemmer.stemmer('russian'),
+        'en': snowballstemmer.stemmer('english'),
+    }
+    insert = sa.text(
+        'INSERT INTO search_term (term, product_id, weight) VALUES (:term, :product_id, :weight)'
+    )
+    last_id = 0
+    while True:
+        chunk = connection.execute(
+            sa.text(
+                'SELECT product.id, product.name, product.sku, product.description, '
+                'brand.name, category.name FROM product '
+                'LEFT JOIN brand ON brand.id = product.brand_id '
+                'LEFT JOIN category ON category.id = product.category_id '
+                'WHERE product.id > :last_id ORDER BY product.id LIMIT :limit'
+            ),
+            {'last_id': last_id, 'limit': BACKFILL_CHUNK_SIZE},
+        ).all()
+        if not chunk:
+            break
+        rows = [
+            {'term': term, 'product_id': product_id, 'weight': weight}
+            for product_id, *fields in chunk
+            for term, weight in document_terms(stemmers, *fields).items()
+        ]
+        if rows:
+            connection.execute(insert, rows)
+        last_id = chunk[-1][0]
+
+
+def downgrade():
+    op.drop_index(op.f('ix_search_term_product_id'), table_name='search_term')
+    op.drop_table('search_term')
@@ -0,0 +1,29 @@
+"""product image derivatives
+
+Revision ID: d41a6c8e5f90
+Revises: b83f5d0e2a67
+Create Date: 2026-10-18 02:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41a6c8e5f90'
+down_revision = 'b83f5d0e2a67'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('product_image', sa.Column('content_hash', sa.String(length=40), nullable=True))
+    op.add_column('product_image', sa.Column('derivative_widths', sa.JSON(), nullable=True))
+    op.create_index(op.f('ix_product_image_content_hash'), 'product_image', ['content_hash'], unique=False)
+    # Производные существующих изображений: flask catalog build-image-derivatives
+
+
+def downgrade():
+    op.drop_index(op.f('ix_product_image_content_hash'), table_name='product_image')
+    op.drop_column('product_image', 'derivative_widths')
+    op.drop_column('product_image', 'content_hash')
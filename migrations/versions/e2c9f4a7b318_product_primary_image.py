@@ -0,0 +1,44 @@
+"""product primary image
+
+Revision ID: e2c9f4a7b318
+Revises: d41a6c8e5f90
+Create Date: 2026-10-18 02:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2c9f4a7b318'
+down_revision = 'd41a6c8e5f90'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 5000
+
+
+def upgrade():
+    op.add_column('product', sa.Column('primary_image_id', sa.Integer(), nullable=True))
+    op.create_index('idx_product_image_order', 'product_image', ['product_id', 'sort_order', 'id'], unique=False)
+
+    # Заполнение диапазонами id, чтобы не держать блокировку всей таблицы.
+    # Повторно пересчитать можно командой: flask catalog repair-primary-images
+    connection = op.get_bind()
+    max_id = connection.execute(sa.text('SELECT MAX(id) FROM product')).scalar() or 0
+    for low_id in range(0, max_id, BATCH_SIZE):
+        connection.execute(
+            sa.text(
+                'UPDATE product SET primary_image_id = ('
+                'SELECT product_image.id FROM product_image '
+                'WHERE product_image.product_id = product.id '
+                'ORDER BY COALESCE(product_image.sort_order, 0), product_image.id LIMIT 1'
+                ') WHERE product.id > :low AND product.id <= :high'
+            ),
+            {'low': low_id, 'high': low_id + BATCH_SIZE},
+        )
+
+
+def downgrade():
+    op.drop_index('idx_product_image_order', table_name='product_image')
+    op.drop_column('product', 'primary_image_id')
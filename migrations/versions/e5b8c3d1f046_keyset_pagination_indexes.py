@@ -0,0 +1,25 @@
+"""keyset pagination indexes
+
+Revision ID: e5b8c3d1f046
+Revises: c71e0b4f9a22
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b8c3d1f046'
+down_revision = 'c71e0b4f9a22'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('idx_product_category_price', 'product', ['category_id', 'price', 'id'], unique=False)
+    op.create_index('idx_product_category_name', 'product', ['category_id', 'name', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('idx_product_category_name', table_name='product')
+    op.drop_index('idx_product_category_price', table_name='product')
@@ -0,0 +1,48 @@
+"""import job table
+
+Revision ID: f7b2d9e4a1c6
+Revises: e2c9f4a7b318
+Create Date: 2026-10-18 03:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7b2d9e4a1c6'
+down_revision = 'e2c9f4a7b318'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'import_job',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('filename', sa.String(length=255), nullable=False),
+        sa.Column('path', sa.String(length=500), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('size_bytes', sa.BigInteger(), nullable=False),
+        sa.Column('processed_bytes', sa.BigInteger(), nullable=False),
+        sa.Column('rows_processed', sa.Integer(), nullable=False),
+        sa.Column('created_count', sa.Integer(), nullable=False),
+        sa.Column('updated_count', sa.Integer(), nullable=False),
+        sa.Column('error_count', sa.Integer(), nullable=False),
+        sa.Column('errors', sa.JSON(), nullable=True),
+        sa.Column('message', sa.Text(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_import_job_status'), 'import_job', ['status'], unique=False)
+    op.create_index(op.f('ix_import_job_created_at'), 'import_job', ['created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_import_job_created_at'), table_name='import_job')
+    op.drop_index(op.f('ix_import_job_status'), table_name='import_job')
+    op.drop_table('import_job')
@@ -0,0 +1,125 @@
+import os
+from contextlib import contextmanager
+
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
+# Задачи из хуков после коммита уходят в брокер в памяти и не выполняются
+os.environ["CELERY_BROKER_URL"] = "memory://"
+os.environ["CELERY_RESULT_BACKEND"] = "cache+memory://"
+
+import pytest
+from sqlalchemy import event
+
+from app import create_app, db, cache
+from app.models import User, Category, Brand, Product, ProductImage
+
+
+@pytest.fixture(scope="session")
+def app():
+    # Приложение создается один раз: бандлы ассетов и админка регистрируются глобально
+    return create_app("testing")
+
+
+@pytest.fixture(autouse=True)
+def database(app):
+    """Пустая БД и кэш для каждого теста (SQLite в памяти)."""
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        cache.clear()
+    yield db
+    with app.app_context():
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def count_queries(app):
+    """
+    Контекстный менеджер, собирающий SQL-запросы к БД внутри блока:
+    with count_queries() as statements: ...
+    """
+    with app.app_context():
+        engine = db.engine
+
+    @contextmanager
+    def counter():
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+
+    return counter
+
+
+@pytest.fixture
+def make_catalog(app):
+    """
+    Создает каталог: корневая категория с двумя подкатегориями и count
+    товаров в них (по две картинки у каждого). Возвращает id товаров.
+    """
+
+    def make(count=10, in_stock=5):
+        with app.app_context():
+            root = Category(name="Электроника", slug="electronics")
+            db.session.add(root)
+            db.session.flush()
+            phones = Category(name="Смартфоны", slug="phones", parent_id=root.id)
+            laptops = Category(name="Ноутбуки", slug="laptops", parent_id=root.id)
+            brand = Brand(name="Acme")
+            db.session.add_all([phones, laptops, brand])
+            db.session.flush()
+            products = []
+            for i in range(count):
+                product = Product(
+                    name=f"Товар {i}",
+                    sku=f"SKU-{i}",
+                    price=100 + i,
+                    in_stock=in_stock,
+                    category_id=(phones if i % 2 else laptops).id,
+                    brand_id=brand.id,
+                    specifications={"Память": {"RAM": f"{4 * (1 + i % 2)} GB"}},
+                )
+                product.images = [
+                    ProductImage(image_url=f"p{i}-{n}.jpg", sort_order=n) for n in range(2)
+                ]
+                products.append(product)
+            db.session.add_all(products)
+            db.session.commit()
+            return [product.id for product in products]
+
+    return make
+
+
+@pytest.fixture
+def login(client):
+    """Входит пользователем user_id через сессию Flask-Login."""
+
+    def login_as(user_id):
+        with client.session_transaction() as session:
+            session["_user_id"] = str(user_id)
+            session["_fresh"] = True
+
+    return login_as
+
+
+@pytest.fixture
+def make_user(app):
+    def make(email="user@example.com", password="secret123"):
+        with app.app_context():
+            user = User(email=email, name="Покупатель")
+            user.set_password(password)
+            db.session.add(user)
+            db.session.commit()
+            return user.id
+
+    return make
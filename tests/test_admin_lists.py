@@ -0,0 +1,77 @@
+import pytest
+
+from app import db, cache
+from app.models import Brand, Category, Product, ProductImage, User
+
+
+@pytest.fixture
+def admin(app, make_user, login):
+    user_id = make_user("admin@example.com")
+    with app.app_context():
+        db.session.get(User, user_id).is_admin = True
+        db.session.commit()
+    login(user_id)
+    return user_id
+
+
+def product_counts(statements):
+    """COUNT-запросы к таблице товаров (без счетчиков корзины и избранного в шаблоне)."""
+    return [statement for statement in statements if statement.startswith("SELECT count(") and "FROM product" in statement]
+
+
+def add_products(count):
+    """Еще count товаров с изображением в подкатегориях каталога make_catalog."""
+    categories = Category.query.filter(Category.parent_id.isnot(None)).all()
+    brand_id = Brand.query.one().id
+    for n in range(count):
+        product = Product(
+            name=f"Новый товар {n}",
+            slug=f"new-{n}",
+            sku=f"NEW-{n}",
+            price=10,
+            category_id=categories[n % len(categories)].id,
+            brand_id=brand_id,
+        )
+        product.images.append(ProductImage(image_url=f"new-{n}.jpg", sort_order=0))
+        db.session.add(product)
+    db.session.commit()
+
+
+def test_product_list_queries_do_not_grow_with_page(app, client, make_catalog, count_queries, admin):
+    make_catalog(count=2)
+    # Первый запрос заполняет кэши счетчиков
+    client.get("/admin-panel/product/")
+    with count_queries() as small:
+        assert client.get("/admin-panel/product/").status_code == 200
+
+    with app.app_context():
+        add_products(10)
+    with count_queries() as large:
+        response = client.get("/admin-panel/product/")
+    assert response.status_code == 200
+    # Изображения и категории с родителем — в запросе страницы, а не по запросу на строку
+    assert len(large) == len(small)
+    assert 'src="/static/images/' in response.get_data(as_text=True)
+
+
+def test_unfiltered_list_count_is_cached(app, client, make_catalog, count_queries, admin):
+    make_catalog(count=3)
+    with count_queries() as first:
+        client.get("/admin-panel/product/")
+    assert len(product_counts(first)) == 1
+    with app.app_context():
+        assert cache.get("admin_count_product") == 3
+
+    with count_queries() as second:
+        client.get("/admin-panel/product/")
+    # Число записей взято из кэша
+    assert product_counts(second) == []
+
+    # С поиском — точный COUNT по условиям, кэш не используется и не меняется
+    with count_queries() as searched:
+        response = client.get("/admin-panel/product/?search=SKU-1")
+    assert len(product_counts(searched)) == 1
+    assert "Товар 1" in response.get_data(as_text=True)
+    with app.app_context():
+        assert cache.get("admin_count_product") == 3
+        assert Product.query.count() == 3
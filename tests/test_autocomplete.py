@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from app import cache
+from app.services import autocomplete_service
+from app.services.autocomplete_service import AutocompleteService
+
+
+@pytest.fixture
+def snapshot_dir(app, tmp_path, monkeypatch):
+    """Пустой каталог снимков и сброшенный индекс процесса."""
+    monkeypatch.setitem(app.config, "AUTOCOMPLETE_SNAPSHOT_DIR", str(tmp_path))
+    monkeypatch.setattr(AutocompleteService, "_index", None)
+    monkeypatch.setattr(AutocompleteService, "_name", None)
+    monkeypatch.setattr(AutocompleteService, "_checked_at", 0)
+    return tmp_path
+
+
+def test_without_snapshot_answers_from_search_and_queues_build(app, client, make_catalog, snapshot_dir, monkeypatch):
+    make_catalog(count=3)
+    with app.app_context():
+        # Сборку после изменения каталога уже поставил хук — забываем о ней
+        cache.delete("autocomplete_rebuild_pending")
+    queued = []
+    monkeypatch.setattr(
+        autocomplete_service, "enqueue_task", lambda task, **kwargs: queued.append(task.name)
+    )
+
+    response = client.get("/api/search/autocomplete?q=товар")
+    assert response.status_code == 200
+    assert sorted(item["name"] for item in response.get_json()) == ["Товар 0", "Товар 1", "Товар 2"]
+    assert queued == ["app.services.autocomplete_service.build_autocomplete_snapshot"]
+    # Запрос ничего не строил сам
+    assert os.listdir(snapshot_dir) == []
+
+    # Повторный запрос не ставит вторую сборку
+    client.get("/api/search/autocomplete?q=товар")
+    assert len(queued) == 1
+
+
+def test_snapshot_round_trip_without_pickle(app, client, make_catalog, snapshot_dir):
+    product_ids = make_catalog(count=3)
+    with app.app_context():
+        built = AutocompleteService.build_snapshot()
+        AutocompleteService._checked_at = 0
+        loaded = AutocompleteService.get_index()
+
+    files = os.listdir(snapshot_dir / open(snapshot_dir / "current").read())
+    assert sorted(files) == [
+        "meta.json", "name_starts.bin", "names.bin", "product_ids.bin",
+        "text.bin", "weights.bin", "words.bin",
+    ]
+    assert loaded.__dict__ == built.__dict__
+    assert loaded.complete("тавар 1") == [(product_ids[1], "Товар 1")]
+
+    response = client.get("/api/search/autocomplete?q=Товар 2")
+    assert response.get_json() == [{"name": "Товар 2", "url": f"/product/id/{product_ids[2]}"}]
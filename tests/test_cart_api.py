@@ -0,0 +1,151 @@
+import pytest
+
+from app import db
+from app.models import Cart, Product, User
+
+
+@pytest.fixture
+def cart_user(app, make_catalog, make_user, login):
+    """Пользователь с четырьмя позициями в корзине; возвращает (user_id, product_ids)."""
+    product_ids = make_catalog(count=6, in_stock=10)
+    user_id = make_user()
+    with app.app_context():
+        db.session.add_all(
+            Cart(user_id=user_id, product_id=product_id, quantity=2) for product_id in product_ids[:4]
+        )
+        db.session.commit()
+    login(user_id)
+    return user_id, product_ids
+
+
+def post_counted(client, count_queries, url, payload):
+    with count_queries() as statements:
+        response = client.post(url, json=payload)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json(), len(statements)
+
+
+def test_add_returns_summary(client, count_queries, cart_user):
+    _, product_ids = cart_user
+
+    data, queries = post_counted(client, count_queries, "/api/cart/add", {"product_id": product_ids[4], "quantity": 3})
+    assert data["cart_positions"] == 5
+    assert data["cart_count"] == 11
+    assert data["total_price"] == 2 * (100 + 101 + 102 + 103) + 3 * 104
+    assert {line["product_id"]: line["subtotal"] for line in data["items"]}[product_ids[4]] == 3 * 104
+    # Пользователь, товар, позиция, запись, сводка
+    assert queries == 5
+
+
+def test_update_returns_summary(client, count_queries, cart_user):
+    _, product_ids = cart_user
+
+    data, queries = post_counted(client, count_queries, "/api/cart/update", {"product_id": product_ids[0], "quantity": 5})
+    assert data["cart_positions"] == 4
+    assert data["cart_count"] == 11
+    assert data["total_price"] == 5 * 100 + 2 * (101 + 102 + 103)
+    assert queries == 5
+
+    data, queries = post_counted(client, count_queries, "/api/cart/update", {"product_id": product_ids[0], "quantity": 0})
+    assert data["cart_positions"] == 3
+    assert product_ids[0] not in {line["product_id"] for line in data["items"]}
+    assert queries == 3
+
+
+def test_remove_returns_summary(client, count_queries, cart_user):
+    _, product_ids = cart_user
+
+    data, queries = post_counted(client, count_queries, "/api/cart/remove", {"product_id": product_ids[1]})
+    assert data["cart_positions"] == 3
+    assert data["cart_count"] == 6
+    assert data["total_price"] == 2 * (100 + 102 + 103)
+    # Пользователь, DELETE, сводка
+    assert queries == 3
+
+
+def test_summary_query_count_does_not_depend_on_cart_size(app, client, count_queries, cart_user):
+    user_id, product_ids = cart_user
+    _, with_four = post_counted(client, count_queries, "/api/cart/remove", {"product_id": product_ids[5]})
+    with app.app_context():
+        Cart.query.filter(Cart.product_id.in_(product_ids[1:4])).delete()
+        db.session.commit()
+    data, with_one = post_counted(client, count_queries, "/api/cart/remove", {"product_id": product_ids[5]})
+    assert data["cart_positions"] == 1
+    assert with_one == with_four
+
+
+@pytest.fixture
+def guest_cart(app, client, make_catalog, make_user):
+    """
+    Гостевая корзина в сессии и сохраненная корзина пользователя:
+    товар 0 — в обеих (8 + 5 при остатке 10), товар 1 — только у гостя,
+    товар 2 — без остатка, плюс удаленный из каталога товар.
+    """
+    product_ids = make_catalog(count=4, in_stock=10)
+    user_id = make_user(email="buyer@example.com", password="secret123")
+    with app.app_context():
+        db.session.get(Product, product_ids[2]).in_stock = 0
+        db.session.add_all(
+            [Cart(user_id=user_id, product_id=product_ids[0], quantity=8),
+             Cart(user_id=user_id, product_id=product_ids[3], quantity=1)]
+        )
+        db.session.commit()
+    client.post(f"/cart/add/{product_ids[0]}", data={"quantity": 5})
+    client.post(f"/cart/add/{product_ids[1]}", data={"quantity": 2})
+    with client.session_transaction() as session:
+        session["cart"][str(product_ids[2])] = {"quantity": 1}
+        session["cart"]["999999"] = {"quantity": 1}
+    return user_id, product_ids
+
+
+def saved_cart(app, user_id):
+    with app.app_context():
+        return sorted((line.product_id, line.quantity) for line in Cart.query.filter_by(user_id=user_id))
+
+
+def test_login_merges_guest_cart_with_one_upsert(app, client, count_queries, guest_cart):
+    user_id, product_ids = guest_cart
+
+    with count_queries() as statements:
+        response = client.post("/auth/login", data={"email": "buyer@example.com", "password": "secret123"})
+    assert response.status_code == 302
+
+    # Сумма ограничена остатком, товар без остатка и удаленный пропущены
+    assert saved_cart(app, user_id) == [(product_ids[0], 10), (product_ids[1], 2), (product_ids[3], 1)]
+    upserts = [statement for statement in statements if statement.startswith("INSERT INTO cart")]
+    assert len(upserts) == 1
+    assert "ON CONFLICT" in upserts[0]
+    with client.session_transaction() as session:
+        assert not session.get("cart")
+
+
+def test_merge_never_lowers_saved_quantity(app, client, guest_cart):
+    user_id, product_ids = guest_cart
+    with app.app_context():
+        # Остаток упал ниже уже лежащего в корзине количества
+        db.session.get(Product, product_ids[0]).in_stock = 3
+        db.session.commit()
+
+    client.post("/auth/login", data={"email": "buyer@example.com", "password": "secret123"})
+    assert dict(saved_cart(app, user_id))[product_ids[0]] == 8
+
+
+def test_register_moves_guest_cart_to_new_account(app, client, make_catalog, monkeypatch):
+    # Приветственное письмо не относится к корзине
+    monkeypatch.setattr("app.auth.routes.send_welcome_email", lambda user: None)
+    product_ids = make_catalog(count=2, in_stock=10)
+    client.post(f"/cart/add/{product_ids[1]}", data={"quantity": 3})
+
+    response = client.post(
+        "/auth/register",
+        data={
+            "name": "Новый покупатель",
+            "email": "new@example.com",
+            "password": "secret123",
+            "confirm_password": "secret123",
+        },
+    )
+    assert response.status_code == 302
+    with app.app_context():
+        user_id = User.query.filter_by(email="new@example.com").one().id
+    assert saved_cart(app, user_id) == [(product_ids[1], 3)]
@@ -0,0 +1,82 @@
+import fakeredis
+import pytest
+
+from app import db
+from app.models import Cart
+from app.services.cart_service import CartService, RedisCartStore, USER_CART_KEY, LOADED_FIELD
+
+
+@pytest.fixture
+def redis_cart(app):
+    """CART_BACKEND = "redis" с fakeredis вместо сервера."""
+    client = fakeredis.FakeRedis()
+    previous = app.config["CART_BACKEND"], app.extensions.get("cart_redis")
+    app.config["CART_BACKEND"] = "redis"
+    app.extensions["cart_redis"] = client
+    yield client
+    app.config["CART_BACKEND"], app.extensions["cart_redis"] = previous
+
+
+@pytest.fixture
+def user_with_saved_cart(app, make_catalog, make_user):
+    """Пользователь с двумя позициями в таблице cart и без корзины в Redis."""
+    product_ids = make_catalog(count=4, in_stock=10)
+    user_id = make_user()
+    with app.app_context():
+        db.session.add_all(
+            [Cart(user_id=user_id, product_id=product_ids[0], quantity=1),
+             Cart(user_id=user_id, product_id=product_ids[1], quantity=2)]
+        )
+        db.session.commit()
+    return user_id, product_ids
+
+
+def saved_lines(user_id):
+    db.session.expire_all()
+    return sorted((line.product_id, line.quantity) for line in Cart.query.filter_by(user_id=user_id))
+
+
+@pytest.mark.parametrize("operation", ["add", "set"])
+def test_cart_expiring_after_load_is_reloaded_before_write(
+    app, redis_cart, user_with_saved_cart, monkeypatch, operation
+):
+    user_id, product_ids = user_with_saved_cart
+    load = RedisCartStore._load
+    expired = []
+
+    def load_then_expire(self, owner, key):
+        load(self, owner, key)
+        # Ключ истекает между загрузкой и записью (один раз)
+        if not expired:
+            expired.append(key)
+            self.client.delete(key)
+
+    monkeypatch.setattr(RedisCartStore, "_load", load_then_expire)
+    with app.test_request_context():
+        store = CartService.store()
+        getattr(store, operation)(user_id, product_ids[2], 3)
+        assert store.positions(user_id) == 3
+        CartService.flush()
+        assert saved_lines(user_id) == [(product_ids[0], 1), (product_ids[1], 2), (product_ids[2], 3)]
+
+
+def test_write_restores_missing_loaded_marker(app, redis_cart, user_with_saved_cart):
+    user_id, product_ids = user_with_saved_cart
+    key = USER_CART_KEY.format(user_id)
+    redis_cart.hset(key, mapping={str(product_ids[0]): 1, str(product_ids[1]): 2})
+
+    with app.test_request_context():
+        store = CartService.store()
+        store.add(user_id, product_ids[2], 1)
+        assert redis_cart.hget(key, LOADED_FIELD) == b"1"
+        assert store.positions(user_id) == 3
+
+
+def test_merge_adds_guest_lines_to_saved_cart(app, redis_cart, user_with_saved_cart):
+    user_id, product_ids = user_with_saved_cart
+
+    with app.test_request_context():
+        store = CartService.store()
+        assert store.merge(user_id, {product_ids[1]: 20, product_ids[3]: 1}) == 2
+        CartService.flush()
+        assert saved_lines(user_id) == [(product_ids[0], 1), (product_ids[1], 10), (product_ids[3], 1)]
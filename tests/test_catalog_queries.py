@@ -0,0 +1,58 @@
+from app import db
+from app.models import User, Product, ProductImage
+
+
+def add_products(app, count):
+    """Еще count товаров в категории и бренде первого товара."""
+    with app.app_context():
+        first = db.session.get(Product, 1)
+        for i in range(count):
+            product = Product(
+                name=f"Дополнительный товар {i}",
+                sku=f"EXTRA-{i}",
+                price=500 + i,
+                in_stock=3,
+                category_id=first.category_id,
+                brand_id=first.brand_id,
+            )
+            product.images = [ProductImage(image_url=f"extra-{i}.jpg", sort_order=0)]
+            db.session.add(product)
+        db.session.commit()
+
+
+def catalog_queries(client, count_queries, url):
+    client.get(url)  # прогрев кэшей дерева категорий, брендов и избранного
+    with count_queries() as statements:
+        response = client.get(url)
+    assert response.status_code == 200
+    return response, len(statements)
+
+
+def test_catalog_query_count_does_not_depend_on_page_size(app, client, make_catalog, make_user, login, count_queries):
+    make_catalog(count=1)
+    user_id = make_user()
+    with app.app_context():
+        db.session.get(User, user_id).wishlist.append(db.session.get(Product, 1))
+        db.session.commit()
+    login(user_id)
+
+    response, one_card = catalog_queries(client, count_queries, "/catalog/")
+    assert response.data.count(b'class="product-card ') == 1
+    assert response.data.count(b"fas fa-heart text-danger") == 1
+
+    add_products(app, 30)
+    response, full_page = catalog_queries(client, count_queries, "/catalog/")
+    # Страница — 24 карточки, избранное — одним набором id на всю страницу
+    assert response.data.count(b'class="product-card ') == 24
+    assert response.data.count(b"fas fa-heart text-danger") == 1
+    assert full_page == one_card
+
+
+def test_product_page_query_count_does_not_depend_on_related_products(app, client, make_catalog, make_user, login, count_queries):
+    product_ids = make_catalog(count=2)
+    login(make_user())
+
+    _, few_related = catalog_queries(client, count_queries, f"/product/id/{product_ids[0]}")
+    add_products(app, 10)
+    _, more_related = catalog_queries(client, count_queries, f"/product/id/{product_ids[0]}")
+    assert more_related == few_related
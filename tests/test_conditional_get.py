@@ -0,0 +1,86 @@
+import pytest
+
+from app import db
+from app.models import Product
+
+
+def revalidate(client, url, count_queries):
+    """Первый GET, затем повтор с If-None-Match; возвращает ответы и запросы повтора."""
+    first = client.get(url)
+    assert first.status_code == 200
+    assert first.headers["ETag"]
+    with count_queries() as statements:
+        second = client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+    return first, second, statements
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "/catalog/",
+        "/catalog/phones?sort_by=price_asc",
+        "/product/id/{product_id}",
+        "/api/mobile/products",
+        "/api/mobile/products/{product_id}",
+        "/api/mobile/categories",
+    ],
+)
+def test_revalidation_returns_304_without_queries(client, make_catalog, count_queries, url):
+    product_ids = make_catalog(count=5)
+
+    first, second, statements = revalidate(client, url.format(product_id=product_ids[0]), count_queries)
+    assert second.status_code == 304
+    assert second.headers["ETag"] == first.headers["ETag"]
+    assert second.data == b""
+    assert statements == []
+
+
+def test_catalog_change_invalidates_etag(app, client, make_catalog):
+    product_ids = make_catalog(count=3)
+    first = client.get("/api/mobile/products")
+
+    with app.app_context():
+        db.session.get(Product, product_ids[0]).price = 1
+        db.session.commit()
+
+    second = client.get("/api/mobile/products", headers={"If-None-Match": first.headers["ETag"]})
+    assert second.status_code == 200
+    assert second.headers["ETag"] != first.headers["ETag"]
+
+
+def test_not_modified_product_is_still_recorded_as_viewed(app, client, make_catalog, count_queries):
+    product_ids = make_catalog(count=3)
+    with app.app_context():
+        slug = db.session.get(Product, product_ids[1]).slug
+
+    by_id = client.get(f"/product/id/{product_ids[0]}")
+    by_slug = client.get(f"/product/{slug}")
+    client.get(f"/product/id/{product_ids[2]}")
+    with client.session_transaction() as session:
+        assert session["viewed_products"] == [product_ids[2], product_ids[1], product_ids[0]]
+
+    response = client.get(f"/product/id/{product_ids[0]}", headers={"If-None-Match": by_id.headers["ETag"]})
+    assert response.status_code == 304
+    with count_queries() as statements:
+        response = client.get(f"/product/{slug}", headers={"If-None-Match": by_slug.headers["ETag"]})
+    assert response.status_code == 304
+    # Только id товара по slug
+    assert len(statements) == 1
+    with client.session_transaction() as session:
+        assert session["viewed_products"] == [product_ids[1], product_ids[0], product_ids[2]]
+
+
+def test_process_local_cache_disables_etag(app, client, make_catalog, count_queries, monkeypatch):
+    make_catalog(count=3)
+    monkeypatch.setitem(app.config, "CACHE_SHARED", None)
+
+    first = client.get("/catalog/")
+    assert first.status_code == 200
+    assert "ETag" not in first.headers
+    second = client.get("/catalog/", headers={"If-None-Match": '"anything"'})
+    assert second.status_code == 200
+
+    # Дерево категорий без общей версии читается заново, но раз за запрос
+    with count_queries() as statements:
+        client.get("/catalog/phones")
+    assert sum("FROM category" in statement for statement in statements) == 1
@@ -0,0 +1,51 @@
+from app import db, cache
+from app.models import Cart
+from app.services.counter_service import CounterService
+
+
+def cached(app, user_id):
+    with app.app_context():
+        return {name: cache.get(CounterService.cache_key(user_id, name)) for name in ("cart", "wishlist")}
+
+
+def test_writes_adjust_cached_counters_without_recount(app, client, make_catalog, make_user, login, count_queries):
+    product_ids = make_catalog(count=4, in_stock=10)
+    user_id = make_user()
+    with app.app_context():
+        db.session.add(Cart(user_id=user_id, product_id=product_ids[0], quantity=1))
+        db.session.commit()
+        assert CounterService.get(user_id) == {"cart": 1, "wishlist": 0}
+    login(user_id)
+
+    # Новая позиция +1, повторное добавление того же товара — без изменений
+    client.post("/api/cart/add", json={"product_id": product_ids[1]})
+    client.post("/api/cart/add", json={"product_id": product_ids[1]})
+    client.post("/api/wishlist/toggle", json={"product_id": product_ids[2]})
+    client.post("/api/wishlist/toggle", json={"product_id": product_ids[3]})
+    assert cached(app, user_id) == {"cart": 2, "wishlist": 2}
+
+    client.post("/api/wishlist/toggle", json={"product_id": product_ids[2]})
+    client.post("/api/cart/remove", json={"product_id": product_ids[0]})
+    assert cached(app, user_id) == {"cart": 1, "wishlist": 1}
+
+    # Чтение берет счетчики из кэша, без COUNT
+    with app.app_context():
+        with count_queries() as statements:
+            assert CounterService.get(user_id) == {"cart": 1, "wishlist": 1}
+    assert statements == []
+
+
+def test_missing_counter_is_recounted_not_created_by_adjust(app, make_catalog, make_user):
+    product_ids = make_catalog(count=2, in_stock=10)
+    user_id = make_user()
+    with app.app_context():
+        db.session.add_all(Cart(user_id=user_id, product_id=product_id, quantity=1) for product_id in product_ids)
+        db.session.commit()
+
+        CounterService.adjust(user_id, "cart", 1)
+        assert cache.get(CounterService.cache_key(user_id, "cart")) is None
+        assert CounterService.get(user_id)["cart"] == 2
+
+        # Уход в минус — признак рассинхронизации: счетчик сбрасывается
+        CounterService.adjust(user_id, "cart", -5)
+        assert cache.get(CounterService.cache_key(user_id, "cart")) is None
@@ -0,0 +1,81 @@
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+from app import db
+from app.models import ExportJob, User
+from app.services.export_service import ExportService, EXPORT_COLUMNS, format_csv
+
+
+@pytest.fixture
+def admin(app, make_user, login):
+    user_id = make_user("admin@example.com")
+    with app.app_context():
+        db.session.get(User, user_id).is_admin = True
+        db.session.commit()
+    login(user_id)
+    return user_id
+
+
+def test_batches_are_streamed_with_constant_queries(app, make_catalog, count_queries):
+    product_ids = make_catalog(count=5)
+    with app.app_context():
+        with count_queries() as statements:
+            pieces = list(format_csv(ExportService.iter_batches("http://img/", batch_size=2)))
+
+    # Заголовок с первой порцией, затем по куску на порцию
+    assert len(pieces) == 3
+    # По два запроса на порцию (товары и их изображения) и пустой конец
+    assert len(statements) == 3 * 2 + 1
+    rows = list(csv.DictReader(io.StringIO("".join(pieces))))
+    assert [int(row["id"]) for row in rows] == product_ids
+    assert rows[1]["category_name"] == "Смартфоны"
+    assert rows[1]["brand_name"] == "Acme"
+    assert rows[1]["price"] == "101.00"
+    assert rows[1]["image_urls"] == "http://img/p1-0.jpg http://img/p1-1.jpg"
+    assert json.loads(rows[1]["specifications"]) == {"Память": {"RAM": "8 GB"}}
+
+
+def test_admin_export_streams_csv_and_jsonl(client, make_catalog, admin):
+    make_catalog(count=3)
+
+    response = client.get("/admin-panel/import-export/export?format=csv")
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.headers["Content-Disposition"] == "attachment;filename=products_export.csv"
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines[0] == ",".join(EXPORT_COLUMNS)
+    assert len(lines) == 4
+
+    response = client.get("/admin-panel/import-export/export?format=jsonl")
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [record["name"] for record in records] == ["Товар 0", "Товар 1", "Товар 2"]
+    # Цена строкой — без потери точности
+    assert records[0]["price"] == "100.00"
+
+    assert client.get("/admin-panel/import-export/export?format=xml").status_code == 404
+
+
+def test_background_export_writes_gzip_and_removes_old_files(app, make_catalog, tmp_path, monkeypatch):
+    make_catalog(count=3)
+    monkeypatch.setitem(app.config, "EXPORT_DIR", str(tmp_path))
+
+    with app.app_context():
+        paths = []
+        for fmt in ("jsonl", "csv", "csv"):
+            job = ExportJob(format=fmt)
+            db.session.add(job)
+            db.session.commit()
+            job = ExportService.run(job.id, "http://img/")
+            assert (job.status, job.rows_exported) == ("done", 3)
+            paths.append(job.path)
+
+        with gzip.open(paths[-1], "rt", encoding="utf-8") as export_file:
+            assert len(list(csv.DictReader(export_file))) == 3
+        ExportService.remove_old_files(keep=2)
+        # Старше двух последних — файл удален, путь забыт
+        assert sorted(p.name for p in tmp_path.iterdir()) == sorted(p.rsplit("/", 1)[1] for p in paths[1:])
+        assert ExportJob.query.order_by(ExportJob.id).first().path is None
@@ -0,0 +1,76 @@
+from werkzeug.datastructures import MultiDict
+
+from app import db
+from app.models import Category, Product, SpecFacet
+from app.services.facet_service import FacetService, HISTOGRAM_BUCKETS
+from app.utils import parse_catalog_filters
+
+
+def facet_counts(category_id):
+    return {
+        facet.spec_value: facet.product_count
+        for facet in SpecFacet.query.filter_by(category_id=category_id, spec_key="RAM")
+    }
+
+
+def test_price_histogram_floors_bucket_numbers(app, make_catalog, count_queries):
+    # Цены 100..109: ширина корзины 0.9, дробная часть номера вплоть до .89
+    make_catalog(count=10)
+    with app.app_context():
+        with count_queries() as statements:
+            summary = FacetService.get_filter_summary(parse_catalog_filters(MultiDict()))
+
+    histogram = summary["price"]["histogram"]
+    assert len(histogram) == HISTOGRAM_BUCKETS
+    assert [bucket["count"] for bucket in histogram] == [1] * HISTOGRAM_BUCKETS
+    assert (summary["price"]["min"], summary["price"]["max"]) == (100, 109)
+    # Округление при CAST (MySQL) перенесло бы 105..108 в соседние корзины
+    assert any("floor(" in statement.lower() for statement in statements)
+
+
+def test_facet_deltas_are_one_upsert(app, make_catalog, count_queries):
+    make_catalog(count=4)
+    with app.app_context():
+        phones = Category.query.filter_by(slug="phones").one()
+        # Нечетные товары — смартфоны с 8 GB
+        assert facet_counts(phones.id) == {"8 GB": 2}
+
+        with count_queries() as statements:
+            with db.engine.begin() as connection:
+                FacetService.apply_deltas(connection, {
+                    (phones.id, "Память", "RAM", "8 GB"): 1,
+                    (phones.id, "Память", "RAM", "16 GB"): 3,
+                    (phones.id, "Память", "RAM", "32 GB"): 0,
+                    (None, "Память", "RAM", "8 GB"): 1,
+                })
+        inserts = [statement for statement in statements if statement.startswith("INSERT INTO spec_facet")]
+        assert len(inserts) == 1
+        assert "ON CONFLICT" in inserts[0]
+        assert facet_counts(phones.id) == {"8 GB": 3, "16 GB": 3}
+
+        with db.engine.begin() as connection:
+            FacetService.apply_deltas(connection, {(phones.id, "Память", "RAM", "16 GB"): -3})
+        assert facet_counts(phones.id) == {"8 GB": 3}
+
+
+def test_editing_expired_product_moves_facet_counts(app, make_catalog):
+    product_ids = make_catalog(count=4)
+    with app.app_context():
+        phones = Category.query.filter_by(slug="phones").one()
+        laptops = Category.query.filter_by(slug="laptops").one()
+        product = db.session.get(Product, product_ids[1])
+        db.session.commit()  # товар истек: прежние значения не загружены
+
+        product.specifications = {"Память": {"RAM": "16 GB"}}
+        db.session.commit()
+        assert facet_counts(phones.id) == {"8 GB": 1, "16 GB": 1}
+
+        product.category_id = laptops.id
+        db.session.commit()
+        assert facet_counts(phones.id) == {"8 GB": 1}
+        assert facet_counts(laptops.id) == {"4 GB": 2, "16 GB": 1}
+
+        product.category = phones
+        db.session.commit()
+        assert facet_counts(phones.id) == {"8 GB": 1, "16 GB": 1}
+        assert facet_counts(laptops.id) == {"4 GB": 2}
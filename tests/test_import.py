@@ -0,0 +1,97 @@
+import gzip
+import json
+
+import pytest
+
+from app import db
+from app.models import Category, ImportJob, Product, ProductSpec, SpecFacet
+from app.services.import_service import ImportService
+from app.services.search_service import SearchService
+
+HEADER = "id,name,sku,price,in_stock,category_name,brand_name,specifications\n"
+
+
+@pytest.fixture
+def run_import(app, tmp_path):
+    """Импортирует CSV-текст порциями по два; возвращает завершенную задачу."""
+
+    def run(text, compress=False):
+        path = tmp_path / ("import.csv.gz" if compress else "import.csv")
+        data = text.encode("utf-8")
+        path.write_bytes(gzip.compress(data) if compress else data)
+        with app.app_context():
+            job = ImportJob(filename=path.name, path=str(path), size_bytes=path.stat().st_size)
+            db.session.add(job)
+            db.session.commit()
+            job = ImportService.run(job.id, chunk_size=2)
+            return {
+                "status": job.status,
+                "counts": (job.rows_processed, job.created_count, job.updated_count, job.error_count),
+                "errors": {error["line"]: error["error"] for error in job.errors or []},
+                "file_removed": job.path is None and not path.exists(),
+            }
+
+    return run
+
+
+def csv_specs(specs):
+    return '"' + json.dumps(specs, ensure_ascii=False).replace('"', '""') + '"'
+
+
+def test_import_creates_updates_and_reports_errors(app, make_catalog, run_import):
+    product_ids = make_catalog(count=3)
+    tablet_specs = csv_specs({"Экран": {"Диагональ": "11"}})
+    job = run_import(
+        HEADER
+        + f"{product_ids[0]},,,150.50,,,,{csv_specs({'Память': {'RAM': '16 GB'}})}\n"
+        + f",Планшет Про,TAB-1,300,4,Планшеты,Acme,{tablet_specs}\n"
+        + ",Без цены,NOPRICE,,1,Планшеты,Acme,\n"
+        + ",Дубликат артикула,SKU-1,10,1,Планшеты,Acme,\n"
+        + ",Плохая цена,BAD,12abc,1,Планшеты,Acme,\n"
+        + f",Планшет Мини,TAB-2,200,0,Планшеты,Новый бренд,{tablet_specs}\n"
+    )
+
+    assert job["status"] == "done"
+    assert job["counts"] == (6, 2, 1, 3)
+    assert set(job["errors"]) == {4, 5, 6}
+    assert "price" in job["errors"][4]
+    assert "SKU-1" in job["errors"][5]
+    assert job["file_removed"]
+
+    with app.app_context():
+        updated = db.session.get(Product, product_ids[0])
+        assert (updated.name, str(updated.price), updated.sku) == ("Товар 0", "150.50", "SKU-0")
+        assert updated.specifications == {"Память": {"RAM": "16 GB"}}
+
+        tablets = Category.query.filter_by(name="Планшеты").one()
+        created = Product.query.filter_by(category_id=tablets.id).order_by(Product.id).all()
+        assert [(product.name, product.brand.name) for product in created] == [
+            ("Планшет Про", "Acme"),
+            ("Планшет Мини", "Новый бренд"),
+        ]
+        assert all(product.slug for product in created)
+        assert created[0].slug != created[1].slug
+
+        # Индексы, которые ORM-хуки вели бы сами: характеристики, фасеты, поиск
+        specs = ProductSpec.query.filter_by(product_id=created[0].id).all()
+        assert [(spec.spec_key, spec.spec_value) for spec in specs] == [("Диагональ", "11")]
+        facet = SpecFacet.query.filter_by(category_id=tablets.id, spec_key="Диагональ").one()
+        assert facet.product_count == 2
+        laptops = Category.query.filter_by(slug="laptops").one()
+        ram = {f.spec_value: f.product_count for f in SpecFacet.query.filter_by(category_id=laptops.id)}
+        assert ram == {"4 GB": 1, "16 GB": 1}
+        assert SearchService.search_ids("планшет мини") == [created[1].id]
+
+
+def test_import_reads_gzip_and_rejects_file_without_columns(app, make_catalog, run_import):
+    make_catalog(count=1)
+
+    job = run_import(HEADER + ",Сжатый товар,GZ-1,99,1,Смартфоны,Acme,\n", compress=True)
+    assert job["status"] == "done"
+    assert job["counts"] == (1, 1, 0, 0)
+    with app.app_context():
+        assert Product.query.filter_by(sku="GZ-1").one().category.slug == "phones"
+
+    job = run_import("title,cost\nТовар,1\n")
+    assert job["status"] == "failed"
+    assert job["counts"] == (0, 0, 0, 0)
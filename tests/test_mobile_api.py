@@ -0,0 +1,86 @@
+from flask_jwt_extended import create_access_token
+
+from app import db
+from app.models import User, Category, Product
+
+
+def auth_headers(app, user_id):
+    with app.test_request_context():
+        return {"Authorization": f"Bearer {create_access_token(identity=str(user_id))}"}
+
+
+def test_products_list_pages_by_cursor(client, make_catalog):
+    product_ids = make_catalog(count=25)
+
+    first = client.get("/api/mobile/products?sort_by=id_asc")
+    assert first.status_code == 200
+    data = first.get_json()
+    assert [item["id"] for item in data["items"]] == product_ids[:20]
+    assert data["total"] == 25
+    assert data["prev_cursor"] is None
+    assert data["next_cursor"]
+    assert data["items"][0]["main_image"].endswith("/static/images/p0-0.jpg")
+
+    second = client.get(f"/api/mobile/products?sort_by=id_asc&cursor={data['next_cursor']}")
+    data = second.get_json()
+    assert [item["id"] for item in data["items"]] == product_ids[20:]
+    assert data["next_cursor"] is None
+    assert data["prev_cursor"]
+
+
+def test_products_list_rejects_bad_cursor_and_sort(client, make_catalog):
+    make_catalog(count=3)
+    assert client.get("/api/mobile/products?cursor=garbage").status_code == 400
+    assert client.get("/api/mobile/products?sort_by=unknown").status_code == 400
+
+
+def test_products_list_filters_by_category_subtree(app, client, make_catalog):
+    make_catalog(count=6)
+    with app.app_context():
+        phones = Category.query.filter_by(slug="phones").one()
+        phones_id, root_id = phones.id, phones.parent_id
+
+    by_root = client.get(f"/api/mobile/products?category_id={root_id}").get_json()
+    by_leaf = client.get(f"/api/mobile/products?category_id={phones_id}").get_json()
+    assert by_root["total"] == 6
+    assert by_leaf["total"] == 3
+
+
+def test_products_list_marks_wishlist(app, client, make_catalog, make_user):
+    product_ids = make_catalog(count=3)
+    user_id = make_user()
+    with app.app_context():
+        user = db.session.get(User, user_id)
+        user.wishlist.append(db.session.get(Product, product_ids[1]))
+        db.session.commit()
+
+    anonymous = client.get("/api/mobile/products").get_json()
+    assert not any(item["in_wishlist"] for item in anonymous["items"])
+
+    items = client.get("/api/mobile/products", headers=auth_headers(app, user_id)).get_json()["items"]
+    assert {item["id"] for item in items if item["in_wishlist"]} == {product_ids[1]}
+
+
+def test_product_detail_includes_images_and_related(client, make_catalog):
+    product_ids = make_catalog(count=6)
+
+    response = client.get(f"/api/mobile/products/{product_ids[0]}")
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data["id"] == product_ids[0]
+    assert data["brand"] == "Acme"
+    assert [image["sort_order"] for image in data["images"]] == [0, 1]
+    # Без совместных покупок — товары той же категории
+    assert data["related"]
+    assert product_ids[0] not in {item["id"] for item in data["related"]}
+
+    assert client.get("/api/mobile/products/999999").status_code == 404
+
+
+def test_categories_are_nested(client, make_catalog):
+    make_catalog(count=2)
+
+    roots = client.get("/api/mobile/categories").get_json()
+    assert [root["slug"] for root in roots] == ["electronics"]
+    assert [child["slug"] for child in roots[0]["children"]] == ["laptops", "phones"]
+    assert roots[0]["children"][0]["children"] == []
@@ -0,0 +1,51 @@
+from app import db
+from app.models import Product, ProductImage
+from app.services.image_service import ImageService
+
+
+def primary_url(product_id):
+    product = db.session.get(Product, product_id)
+    db.session.refresh(product)
+    return product.primary_image.image_url if product.primary_image else None
+
+
+def test_image_writes_keep_primary_image_in_sync(app, make_catalog):
+    first, second = make_catalog(count=2)
+    with app.app_context():
+        assert primary_url(first) == "p0-0.jpg"
+
+        # Новое изображение раньше по sort_order становится главным
+        db.session.add(ProductImage(product_id=first, image_url="cover.jpg", sort_order=-1))
+        db.session.commit()
+        assert primary_url(first) == "cover.jpg"
+
+        # Перестановка истекшего после коммита изображения
+        cover = ProductImage.query.filter_by(image_url="cover.jpg").one()
+        cover.sort_order = 5
+        db.session.commit()
+        assert primary_url(first) == "p0-0.jpg"
+
+        # Перенос на другой товар пересчитывает оба
+        moved = ProductImage.query.filter_by(image_url="p0-0.jpg").one()
+        db.session.commit()
+        moved.product_id = second
+        moved.sort_order = -1
+        db.session.commit()
+        assert primary_url(first) == "p0-1.jpg"
+        assert primary_url(second) == "p0-0.jpg"
+
+        for image in ProductImage.query.filter_by(product_id=first).all():
+            db.session.delete(image)
+        db.session.commit()
+        assert primary_url(first) is None
+
+
+def test_repair_restores_drifted_primary_images(app, make_catalog):
+    product_ids = make_catalog(count=3)
+    with app.app_context():
+        db.session.execute(db.update(Product).values(primary_image_id=None))
+        db.session.commit()
+
+        assert ImageService.sync_primary_images(db.session.connection(), chunk_size=2) == 3
+        db.session.commit()
+        assert [primary_url(product_id) for product_id in product_ids] == ["p0-0.jpg", "p1-0.jpg", "p2-0.jpg"]
@@ -0,0 +1,24 @@
+from app import db
+from app.models import Product, Review
+
+
+def test_invalid_review_rerenders_full_product_page(app, client, make_catalog, make_user, login):
+    product_ids = make_catalog(count=2)
+    login(make_user())
+    with app.app_context():
+        product = db.session.get(Product, product_ids[1])
+        product.meta_description = "Описание для поисковиков"
+        db.session.commit()
+        slug = product.slug
+
+    # Без оценки форма не проходит проверку и страница товара рендерится заново
+    response = client.post(f"/product/{slug}/add_review", data={"comment": "Без оценки"})
+    assert response.status_code == 200
+    page = response.get_data(as_text=True)
+    assert 'href="/catalog/electronics"' in page
+    assert 'href="/catalog/phones"' in page
+    assert "images/p1-0.jpg" in page
+    assert "images/p1-1.jpg" in page
+    assert "Описание для поисковиков" in page
+    with app.app_context():
+        assert Review.query.count() == 0
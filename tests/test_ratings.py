@@ -0,0 +1,59 @@
+from decimal import Decimal
+
+from app import db
+from app.models import Product, Review
+from app.services.rating_service import RatingService
+
+
+def aggregates(product_id):
+    product = db.session.get(Product, product_id)
+    db.session.refresh(product)
+    return (
+        product.rating_avg,
+        product.rating_count,
+        [getattr(product, f"rating_{stars}") for stars in range(1, 6)],
+    )
+
+
+def test_review_writes_update_aggregates(app, make_catalog, make_user):
+    first, second = make_catalog(count=2)
+    user_id = make_user()
+    with app.app_context():
+        reviews = [Review(user_id=user_id, product_id=first, rating=rating) for rating in (5, 4, 1)]
+        db.session.add_all(reviews)
+        db.session.commit()
+        assert aggregates(first) == (Decimal("3.33"), 3, [1, 0, 0, 1, 1])
+
+        # Изменение оценки и перенос отзыва на другой товар
+        reviews[2].rating = 3
+        reviews[1].product_id = second
+        db.session.commit()
+        assert aggregates(first) == (Decimal("4.00"), 2, [0, 0, 1, 0, 1])
+        assert aggregates(second) == (Decimal("4.00"), 1, [0, 0, 0, 1, 0])
+
+        db.session.delete(reviews[0])
+        db.session.delete(reviews[1])
+        db.session.commit()
+        assert aggregates(first) == (Decimal("3.00"), 1, [0, 0, 1, 0, 0])
+        assert aggregates(second) == (Decimal("0.00"), 0, [0, 0, 0, 0, 0])
+
+
+def test_recompute_repairs_drifted_aggregates(app, make_catalog, make_user):
+    product_ids = make_catalog(count=3)
+    user_id = make_user()
+    with app.app_context():
+        db.session.add_all(Review(user_id=user_id, product_id=product_ids[1], rating=rating) for rating in (2, 4))
+        db.session.commit()
+        # Агрегаты разошлись с отзывами (запись в обход ORM)
+        db.session.execute(db.update(Product).values(rating_count=7, rating_avg=1, rating_5=7))
+        db.session.commit()
+
+        assert RatingService.recompute(chunk_size=2) == 3
+        assert aggregates(product_ids[0]) == (Decimal("0.00"), 0, [0, 0, 0, 0, 0])
+        assert aggregates(product_ids[1]) == (Decimal("3.00"), 2, [0, 1, 0, 1, 0])
+
+        db.session.execute(db.update(Product).values(rating_4=9))
+        db.session.commit()
+        RatingService.recompute(product_ids=[product_ids[1]])
+        assert aggregates(product_ids[1]) == (Decimal("3.00"), 2, [0, 1, 0, 1, 0])
+        assert aggregates(product_ids[2])[2][3] == 9
@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from app.models import Review
+from app.services.review_service import ReviewService
+
+
+@pytest.fixture
+def reviewed_product(app, make_catalog, make_user):
+    """Товар с 7 отзывами; у трех одинаковое время. Возвращает (товар, id от новых к старым)."""
+    product_ids = make_catalog(count=2)
+    user_id = make_user()
+    start = datetime(2026, 1, 1, 12, 0)
+    times = [start + timedelta(minutes=minutes) for minutes in (0, 1, 2, 2, 2, 3, 4)]
+    with app.app_context():
+        reviews = [
+            Review(user_id=user_id, product_id=product_ids[0], rating=5, comment=f"Отзыв {n}", created_at=created_at)
+            for n, created_at in enumerate(times)
+        ]
+        reviews.append(Review(user_id=user_id, product_id=product_ids[1], rating=1, created_at=start))
+        db.session.add_all(reviews)
+        db.session.commit()
+        expected = [review.id for review in sorted(reviews[:7], key=lambda r: (r.created_at, r.id), reverse=True)]
+    return product_ids[0], expected
+
+
+def test_pages_continue_without_gaps_or_repeats(app, reviewed_product):
+    product_id, expected = reviewed_product
+    with app.app_context():
+        seen, cursor, pages = [], None, 0
+        while True:
+            reviews, cursor = ReviewService.page(product_id, cursor=cursor, per_page=2)
+            seen += [review.id for review in reviews]
+            pages += 1
+            if cursor is None:
+                break
+    # Страница режет группу с одинаковым created_at — порядок по id продолжается
+    assert seen == expected
+    assert pages == 4
+
+
+def test_reviews_api_pages_by_cursor(client, reviewed_product):
+    product_id, expected = reviewed_product
+
+    first = client.get(f"/api/products/{product_id}/reviews?per_page=4").get_json()
+    assert [item["id"] for item in first["items"]] == expected[:4]
+    second = client.get(f"/api/mobile/products/{product_id}/reviews?per_page=4&cursor={first['next_cursor']}").get_json()
+    assert [item["id"] for item in second["items"]] == expected[4:]
+    assert second["next_cursor"] is None
+
+    assert client.get(f"/api/products/{product_id}/reviews?cursor=garbage").status_code == 400
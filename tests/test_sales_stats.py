@@ -0,0 +1,89 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+from app import db
+from app.models import Order, OrderItem, ProductSalesDaily, SalesDaily, SignupDaily, User
+from app.services.sales_stats_service import SalesStatsService
+
+DAY = date(2030, 3, 10)
+
+
+def add_order(user_id, product_id, status="Paid", created_at=datetime(2030, 3, 10, 12), quantity=2, price=50):
+    order = Order(
+        user_id=user_id,
+        total_amount=quantity * price,
+        final_amount=quantity * price,
+        status=status,
+        created_at=created_at,
+    )
+    order.items.append(OrderItem(product_id=product_id, quantity=quantity, price=price))
+    db.session.add(order)
+    db.session.commit()
+    return order.id
+
+
+def rollups():
+    """Содержимое таблиц итогов — для сравнения с пересчетом."""
+    return (
+        sorted((row.day, row.status, row.orders_count, row.amount) for row in SalesDaily.query),
+        sorted((row.day, row.product_id, row.units, row.revenue) for row in ProductSalesDaily.query),
+        sorted((row.day, row.users_count) for row in SignupDaily.query),
+    )
+
+
+def test_order_writes_keep_daily_rollups_in_sync(app, make_catalog, make_user):
+    first, second = make_catalog(count=2)
+    user_id = make_user()
+    with app.app_context():
+        db.session.get(User, user_id).created_at = datetime(2030, 3, 9, 8)
+        db.session.commit()
+        paid = add_order(user_id, first)
+        add_order(user_id, second, status="Pending", quantity=1, price=30)
+        add_order(user_id, first, created_at=datetime(2030, 3, 11, 9), quantity=1, price=50)
+
+        assert SalesStatsService.summary(DAY, DAY) == {"orders": 2, "revenue": Decimal("100.00"), "new_users": 0}
+        assert SalesStatsService.status_counts(DAY, DAY) == {"Paid": 1, "Pending": 1}
+        assert SalesStatsService.summary()["new_users"] == 1
+
+        # Смена статуса истекшего после коммита заказа переносит его в итогах
+        db.session.get(Order, paid).status = "Cancelled"
+        db.session.commit()
+        assert SalesStatsService.status_counts(DAY, DAY) == {"Cancelled": 1, "Pending": 1}
+        assert SalesStatsService.summary(DAY, DAY)["revenue"] == 0
+
+        db.session.get(Order, paid).status = "Paid"
+        db.session.commit()
+        assert [(name, int(units)) for name, units, _ in SalesStatsService.top_products(5)] == [
+            ("Товар 0", 3),
+            ("Товар 1", 1),
+        ]
+        series = SalesStatsService.daily_series(date(2030, 3, 9), date(2030, 3, 11))
+        assert [(point["orders"], point["revenue"]) for point in series] == [(0, 0), (2, 100.0), (1, 50.0)]
+
+        # Удаление позиции убирает ее из итогов по товарам; строка с нулем удаляется
+        db.session.delete(OrderItem.query.filter_by(product_id=second).one())
+        db.session.commit()
+        assert ProductSalesDaily.query.filter_by(product_id=second).count() == 0
+
+        # Пересчет из заказов дает те же итоги, что и инкрементальные изменения
+        incremental = rollups()
+        assert SalesStatsService.rebuild(end=date(2030, 3, 11)) == 3
+        assert rollups() == incremental
+
+
+def test_sales_endpoint_reads_rollups(client, app, make_catalog, make_user, login):
+    product_id = make_catalog(count=1)[0]
+    user_id = make_user("admin@example.com")
+    with app.app_context():
+        db.session.get(User, user_id).is_admin = True
+        db.session.commit()
+        add_order(user_id, product_id)
+    login(user_id)
+
+    data = client.get("/admin/sales?start=2030-03-09&end=2030-03-10").get_json()
+    assert (data["orders"], data["revenue"], data["statuses"]) == (1, 100.0, {"Paid": 1})
+    assert data["top_products"] == [{"name": "Товар 0", "units": 2, "revenue": 100.0}]
+    assert [point["orders"] for point in data["days"]] == [0, 1]
+
+    assert client.get("/admin/sales?start=2030-03-10&end=2030-03-09").status_code == 400
+    assert client.get("/admin/sales?start=10.03.2030").status_code == 400
@@ -0,0 +1,60 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from app import db, cache
+from app.models import Product
+from app.services import sitemap_service
+
+
+@pytest.fixture
+def sitemap_dir(app, tmp_path, monkeypatch):
+    """Шарды по два товара в отдельном каталоге."""
+    monkeypatch.setitem(app.config, "SITEMAP_DIR", str(tmp_path))
+    monkeypatch.setattr(sitemap_service, "SHARD_SIZE", 2)
+    return tmp_path
+
+
+def generated_at(sitemap_dir, name):
+    with open(sitemap_dir / f"{name}.json") as meta_file:
+        return json.load(meta_file)["generated_at"]
+
+
+def test_index_lists_shards_with_lastmod(app, client, make_catalog, sitemap_dir):
+    product_ids = make_catalog(count=5)
+    with app.app_context():
+        db.session.get(Product, product_ids[2]).updated_at = datetime(2030, 5, 1, 8, 30)
+        db.session.commit()
+        cache.delete("sitemap_index_entries")
+
+    xml = client.get("/sitemap.xml").get_data(as_text=True)
+    assert xml.count("<sitemap>") == 4
+    assert "/sitemap-pages.xml</loc>" in xml
+    assert "/sitemap-products-2.xml</loc>" in xml
+    assert "<loc>http://localhost/sitemap-products-1.xml</loc><lastmod>2030-05-01T08:30:00+00:00</lastmod>" in xml
+    assert client.get("/sitemap-products-3.xml").status_code == 404
+
+
+def test_only_changed_shard_is_regenerated(app, client, make_catalog, sitemap_dir):
+    product_ids = make_catalog(count=5)
+
+    first = {number: client.get(f"/sitemap-products-{number}.xml") for number in range(3)}
+    assert first[0].get_data(as_text=True).count("<url>") == 2
+    assert first[2].get_data(as_text=True).count("<url>") == 1
+    stamps = {number: generated_at(sitemap_dir, f"products-{number}") for number in range(3)}
+
+    # Повтор с тем же ETag — 304, файлы не переписываются
+    again = client.get("/sitemap-products-0.xml", headers={"If-None-Match": first[0].headers["ETag"]})
+    assert again.status_code == 304
+
+    with app.app_context():
+        db.session.get(Product, product_ids[2]).updated_at = datetime(2030, 5, 1)
+        db.session.commit()
+    second = {number: client.get(f"/sitemap-products-{number}.xml") for number in range(3)}
+
+    assert second[1].headers["ETag"] != first[1].headers["ETag"]
+    assert generated_at(sitemap_dir, "products-1") != stamps[1]
+    for number in (0, 2):
+        assert second[number].headers["ETag"] == first[number].headers["ETag"]
+        assert generated_at(sitemap_dir, f"products-{number}") == stamps[number]
@@ -0,0 +1,64 @@
+from app import db
+from app.models import Brand, Category, Product
+from app.services.slug_service import SlugService
+
+PRODUCT_TABLE = Product.__table__
+
+
+def add_products(slugs):
+    """Товары с заданными slug в категории и бренде пустого каталога (make_catalog(0))."""
+    category_id = Category.query.filter_by(slug="phones").one().id
+    brand_id = Brand.query.one().id
+    db.session.add_all(
+        Product(name=f"Товар {slug}", slug=slug, sku=f"SLUG-{n}", price=1, category_id=category_id, brand_id=brand_id)
+        for n, slug in enumerate(slugs)
+    )
+    db.session.commit()
+
+
+def test_allocate_suffixes_duplicate_taken_and_reserved_bases(app, make_catalog, count_queries):
+    make_catalog(count=0)
+    with app.app_context():
+        add_products(["phone", "phone-1", "phone-3", "phone-x", "case", "phones"])
+
+        with count_queries() as statements:
+            slugs = SlugService.allocate(
+                db.session.connection(),
+                PRODUCT_TABLE,
+                ["phone", "phone", "case", "new", "new", "reserved", "tablet"],
+                reserved={"new", "reserved-1"},
+            )
+    # Порядок сохранен, занятые -1 и -3 пропущены, «phones» и «phone-x» не мешают
+    assert slugs == ["phone-2", "phone-4", "case-1", "new-1", "new-2", "reserved", "tablet"]
+    # Основания одним IN, суффиксы — одним запросом по диапазонам
+    assert len(statements) == 2
+
+
+def test_allocate_free_bases_with_one_query(app, make_catalog, count_queries):
+    make_catalog(count=0)
+    with app.app_context():
+        add_products(["phone"])
+        with count_queries() as statements:
+            slugs = SlugService.allocate(db.session.connection(), PRODUCT_TABLE, ["tablet", "case"])
+    assert slugs == ["tablet", "case"]
+    assert len(statements) == 1
+
+
+def test_allocate_checks_suffixes_in_chunks(app, make_catalog, count_queries, monkeypatch):
+    monkeypatch.setattr("app.services.slug_service.LOOKUP_CHUNK_SIZE", 2)
+    make_catalog(count=0)
+    with app.app_context():
+        add_products(["a", "b", "b-1", "c", "d"])
+        with count_queries() as statements:
+            slugs = SlugService.allocate(db.session.connection(), PRODUCT_TABLE, ["a", "b", "c", "d", "e"])
+    assert slugs == ["a-1", "b-2", "c-1", "d-1", "e"]
+    # Три порции оснований и две — суффиксов
+    assert len(statements) == 5
+
+
+def test_matches_only_own_suffixes():
+    assert SlugService.matches("phone", "phone")
+    assert SlugService.matches("phone-12", "phone")
+    assert not SlugService.matches("phone-x", "phone")
+    assert not SlugService.matches("phones", "phone")
+    assert not SlugService.matches(None, "phone")
@@ -0,0 +1,27 @@
+import time
+
+import pytest
+from kombu.exceptions import OperationalError
+
+from app.services.image_service import generate_image_derivatives
+from app.utils import enqueue_task, ENQUEUE_CONNECT_TIMEOUT
+
+
+@pytest.fixture
+def broker_down(monkeypatch):
+    """Брокер на закрытом порту."""
+    monkeypatch.setenv("CELERY_BROKER_URL", "redis://127.0.0.1:1/0")
+
+
+def test_enqueue_task_publishes_without_result_subscription(app):
+    with app.app_context():
+        result = enqueue_task(generate_image_derivatives, [1], countdown=5)
+    assert result.id
+    assert result.ignored
+
+
+def test_enqueue_task_fails_fast_when_broker_is_down(app, broker_down):
+    started = time.monotonic()
+    with app.app_context(), pytest.raises(OperationalError):
+        enqueue_task(generate_image_derivatives, [1])
+    assert time.monotonic() - started < ENQUEUE_CONNECT_TIMEOUT